@@ -153,6 +153,9 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ],
+    # Listagens paginadas por cursor (?cursor=...&page_size=...), ver pedidos/paginacao.py
+    'DEFAULT_PAGINATION_CLASS': 'pedidos.paginacao.CursorPaginacao',
+    'PAGE_SIZE': 50,
 }
 
 # Configurações do Admin
@@ -163,6 +166,20 @@ ADMIN_INDEX_TITLE = "Painel Administrativo"
 # Mercado Pago (configurado via variável de ambiente)
 MERCADOPAGO_ACCESS_TOKEN = os.environ.get('MERCADOPAGO_ACCESS_TOKEN', '')
 MERCADOPAGO_PUBLIC_KEY = os.environ.get('MERCADOPAGO_PUBLIC_KEY', '')
+# URL base da API (trocar por um servidor falso local nos testes)
+MERCADOPAGO_API_URL = os.environ.get('MERCADOPAGO_API_URL', 'https://api.mercadopago.com')
+MERCADOPAGO_CONSULTAS_SIMULTANEAS = int(os.environ.get('MERCADOPAGO_CONSULTAS_SIMULTANEAS', '8'))
+# Cota global de chamadas da conciliação (comando conciliar_pagamentos, somando todos os workers)
+MERCADOPAGO_CHAMADAS_POR_MINUTO = int(os.environ.get('MERCADOPAGO_CHAMADAS_POR_MINUTO', '60'))
+# Segundos em que um pagamento ainda em aberto é servido do PagamentoSnapshot (finais: sempre)
+MERCADOPAGO_SNAPSHOT_TTL = int(os.environ.get('MERCADOPAGO_SNAPSHOT_TTL', '60'))
+# Chave secreta do webhook (painel do MP > Webhooks), usada para conferir o x-signature
+MERCADOPAGO_WEBHOOK_SECRET = os.environ.get('MERCADOPAGO_WEBHOOK_SECRET', '')
+
+# products.json do site, regravado automaticamente após mudanças de estoque
+# Opt-in: vazio (padrão) desativa; ex. PRODUCTS_JSON_PATH=/app/web/products.json
+PRODUCTS_JSON_PATH = os.environ.get('PRODUCTS_JSON_PATH', '')
+PRODUCTS_JSON_INTERVALO = int(os.environ.get('PRODUCTS_JSON_INTERVALO', '5'))  # segundos
 
 # Configurações de Email SMTP (Locaweb)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
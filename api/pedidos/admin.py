@@ -3,10 +3,7 @@ from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from decimal import Decimal
-from .models import Comprador, Pedido, ItemPedido, Produto, ProdutoTamanho, MovimentacaoEstoque
-import requests
-from django.conf import settings
-import os
+from .models import Comprador, Pedido, ItemPedido, Produto, ProdutoTamanho, MovimentacaoEstoque, ReservaEstoque, VersaoEstoque, EventoEntrega, NotificacaoMercadoPago, PagamentoSnapshot
 from django.db.models import Q
 
 
@@ -179,29 +176,9 @@ class ProdutoAdmin(admin.ModelAdmin):
     def gerar_products_json(self, request, queryset):
         """Action para gerar o products.json"""
         import json
+        from .catalogo import montar_catalogo
         
-        products_data = {"products": {}}
-        
-        for produto in Produto.objects.filter(ativo=True).order_by('ordem'):
-            sizes = {}
-            for tamanho in produto.tamanhos.all():
-                sizes[tamanho.tamanho] = {
-                    "product_size_id": tamanho.id,
-                    "available": tamanho.disponivel and tamanho.estoque > 0,
-                    "qtda_estoque": tamanho.estoque,
-                    # Manter campos legacy
-                    "stripe_link": None,
-                    "id_stripe": f"prod_{produto.json_key}_{tamanho.tamanho.lower()}"
-                }
-            
-            products_data["products"][produto.json_key] = {
-                "id": str(produto.id),
-                "title": produto.nome,
-                "price": float(produto.preco),
-                "preco_custo": float(produto.preco_custo),
-                "image": f"./img/camisetas/{produto.json_key.replace('-', '_')}.jpeg",
-                "sizes": sizes
-            }
+        products_data = montar_catalogo(apenas_ativos=True)
         
         # Salvar em arquivo temporário para download
         import tempfile
@@ -218,8 +195,8 @@ class ProdutoAdmin(admin.ModelAdmin):
     
     def marcar_sem_estoque(self, request, queryset):
         """Marca produtos selecionados como sem estoque"""
-        for produto in queryset:
-            produto.tamanhos.update(disponivel=False)
+        ProdutoTamanho.objects.filter(produto__in=queryset).update(disponivel=False)
+        VersaoEstoque.incrementar()
         
         self.message_user(
             request,
@@ -394,6 +371,74 @@ class MovimentacaoEstoqueAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(ReservaEstoque)
+class ReservaEstoqueAdmin(admin.ModelAdmin):
+    list_display = ['data_criacao', 'produto_tamanho', 'quantidade', 'status', 'expira_em', 'pedido_link']
+    list_filter = ['status', 'produto_tamanho__produto']
+    search_fields = ['produto_tamanho__produto__nome', 'pedido__id', 'pedido__external_reference']
+    readonly_fields = ['produto_tamanho', 'pedido', 'quantidade', 'expira_em', 'data_criacao', 'data_atualizacao']
+    list_select_related = ['produto_tamanho__produto', 'pedido']
+    date_hierarchy = 'data_criacao'
+    
+    def pedido_link(self, obj):
+        """Link para o pedido relacionado"""
+        if obj.pedido_id:
+            url = reverse('admin:pedidos_pedido_change', args=[obj.pedido_id])
+            return format_html('<a href="{}">Pedido #{}</a>', url, obj.pedido_id)
+        return '-'
+    pedido_link.short_description = 'Pedido'
+    
+    def has_add_permission(self, request):
+        # Reservas são criadas pelo checkout
+        return False
+
+
+@admin.register(EventoEntrega)
+class EventoEntregaAdmin(admin.ModelAdmin):
+    list_display = ['recebido_em', 'registrado_em', 'chave', 'item', 'quantidade_solicitada', 'quantidade_aplicada', 'status', 'dispositivo', 'usuario']
+    list_filter = ['status', 'dispositivo']
+    search_fields = ['chave', 'item_id_informado', 'item__pedido__comprador__nome']
+    readonly_fields = [
+        'chave', 'item', 'item_id_informado', 'quantidade_solicitada', 'quantidade_aplicada',
+        'status', 'motivo', 'dispositivo', 'usuario', 'registrado_em', 'recebido_em'
+    ]
+    list_select_related = ['item']
+    date_hierarchy = 'recebido_em'
+    
+    def has_add_permission(self, request):
+        # Eventos chegam pela sincronização dos tablets
+        return False
+
+
+@admin.register(NotificacaoMercadoPago)
+class NotificacaoMercadoPagoAdmin(admin.ModelAdmin):
+    list_display = ['recebida_em', 'tipo', 'acao', 'recurso_id', 'pedido', 'status', 'tentativas', 'resultado']
+    list_filter = ['status', 'tipo']
+    search_fields = ['notificacao_id', 'recurso_id', 'pedido__external_reference']
+    readonly_fields = [
+        'notificacao_id', 'tipo', 'acao', 'recurso_id', 'status', 'tentativas', 'pedido',
+        'resultado', 'payload', 'recebida_em', 'atualizada_em'
+    ]
+    list_select_related = ['pedido']
+    date_hierarchy = 'recebida_em'
+    
+    def has_add_permission(self, request):
+        # Notificações chegam pelo webhook do Mercado Pago
+        return False
+
+
+@admin.register(PagamentoSnapshot)
+class PagamentoSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['payment_id', 'status', 'consultado_em']
+    list_filter = ['status']
+    search_fields = ['payment_id']
+    readonly_fields = ['payment_id', 'status', 'dados', 'consultado_em']
+    
+    def has_add_permission(self, request):
+        # Gravados pelas consultas ao Mercado Pago
+        return False
+
+
 @admin.register(Comprador)
 class CompradorAdmin(admin.ModelAdmin):
     list_display = ['nome', 'email', 'telefone', 'data_cadastro', 'total_pedidos']
@@ -478,7 +523,10 @@ class PedidoAdmin(admin.ModelAdmin):
         'status_mercadopago',
         'link_mercadopago',
         'data_email_enviado',
-        'usuario_email_enviado'
+        'usuario_email_enviado',
+        'proxima_conciliacao',
+        'tentativas_conciliacao',
+        'snapshot_mercadopago'
     ]
     
     fieldsets = (
@@ -492,7 +540,10 @@ class PedidoAdmin(admin.ModelAdmin):
                 'preference_id', 
                 'merchant_order_id',
                 'status_mercadopago',
-                'link_mercadopago'
+                'snapshot_mercadopago',
+                'link_mercadopago',
+                'proxima_conciliacao',
+                'tentativas_conciliacao'
             ),
             'classes': ('collapse',)
         }),
@@ -602,6 +653,26 @@ class PedidoAdmin(admin.ModelAdmin):
         )
     status_mercadopago.short_description = 'Status no MP'
     
+    def snapshot_mercadopago(self, obj):
+        """Última consulta ao MP gravada (PagamentoSnapshot), sem chamar a API"""
+        from django.utils import timezone
+        if not obj.payment_id:
+            return "Payment ID não disponível"
+        snapshot = PagamentoSnapshot.objects.filter(payment_id=obj.payment_id).first()
+        if snapshot is None:
+            return "Ainda não consultado"
+        dados = snapshot.dados
+        return format_html(
+            '<strong>{}</strong> {} · R$ {} · {} <br><small>Consultado em {}{}</small>',
+            snapshot.status or '-',
+            dados.get('status_detail') or '',
+            dados.get('transaction_amount') or '-',
+            dados.get('payment_method_id') or '',
+            timezone.localtime(snapshot.consultado_em).strftime('%d/%m/%Y %H:%M:%S'),
+            ' (final)' if snapshot.final else '',
+        )
+    snapshot_mercadopago.short_description = 'Último status consultado'
+    
     def link_mercadopago(self, obj):
         """Link direto para o pagamento no painel do MP/PayPal"""
         if obj.payment_id:
@@ -624,161 +695,133 @@ class PedidoAdmin(admin.ModelAdmin):
     
     # Actions personalizadas
     def consultar_status_mp(self, request, queryset):
-        """Action melhorada para consultar status no Mercado Pago via payment_id ou external_reference"""
-        import requests
-        from django.conf import settings
-        import json
+        """
+        Action melhorada para consultar status no Mercado Pago via payment_id ou external_reference
+        
+        As consultas rodam em paralelo (pool limitado de threads, sessão HTTP
+        compartilhada, timeout e novas tentativas em 429/5xx), sem travas. Depois
+        os pedidos com pagamento são relidos com SELECT ... FOR UPDATE e o
+        pagamento é reaplicado sobre a linha travada (como em conciliar_periodo):
+        o que o webhook ou o worker gravaram durante as consultas não é sobrescrito
+        """
+        from django.db import transaction
+        from django.utils import timezone
+        from .mercadopago import aplicar_pagamento, consultar_pagamentos, pagamento_ignorado, token_configurado
+        
+        if not token_configurado():
+            self.message_user(request, 'Token do Mercado Pago não configurado!', level='ERROR')
+            return
+        
+        campos_pedido = (
+            'id', 'payment_id', 'external_reference', 'forma_pagamento',
+            'status_pagamento', 'merchant_order_id', 'estoque_decrementado'
+        )
+        pedidos = list(queryset.select_related(None).only(*campos_pedido))
         
         updated = 0
         errors = 0
         found_payments = 0
+        encontrados = {}
         
-        # Token do Mercado Pago (deve estar configurado no settings)
-        mp_token = getattr(settings, 'MERCADOPAGO_ACCESS_TOKEN', os.environ.get('MERCADOPAGO_ACCESS_TOKEN'))
+        resultados = consultar_pagamentos(pedidos)
+        for pedido, payment_data, method_used, avisos in resultados:
+            for aviso in avisos:
+                self.message_user(request, f'Pedido #{pedido.id}: {aviso}', level='WARNING')
+            
+            if not payment_data:
+                # Nenhum método funcionou
+                if pedido.forma_pagamento in Pedido.FORMAS_FORA_DO_MERCADOPAGO:
+                    message = f'Pedido #{pedido.id}: Pagamento {pedido.get_forma_pagamento_display()} - não consultável no MP'
+                elif not pedido.payment_id and not pedido.external_reference:
+                    message = f'Pedido #{pedido.id}: Sem payment_id nem external_reference para consultar'
+                else:
+                    message = f'Pedido #{pedido.id}: Pagamento não encontrado no Mercado Pago'
+                self.message_user(request, message, level='WARNING')
+                errors += 1
+                continue
+            encontrados[pedido.id] = (payment_data, method_used)
         
-        if not mp_token:
-            self.message_user(request, 'Token do Mercado Pago não configurado!', level='ERROR')
-            return
+        PagamentoSnapshot.gravar([payment_data for payment_data, _ in encontrados.values()])
         
-        for pedido in queryset:
-            try:
-                payment_data = None
-                method_used = None
+        mensagens = []
+        usuario = request.user.username if request.user.is_authenticated else 'admin'
+        with transaction.atomic():
+            travados = list(
+                Pedido.objects.select_for_update().filter(id__in=list(encontrados)).only(*campos_pedido).order_by('id')
+            )
+            alterados = []
+            mudancas_status = []
+            agora = timezone.now()
+            for pedido in travados:
+                payment_data, method_used = encontrados[pedido.id]
                 
-                # Método 1: Consultar por payment_id (se disponível)
-                if pedido.payment_id:
-                    try:
-                        response = requests.get(
-                            f'https://api.mercadopago.com/v1/payments/{pedido.payment_id}',
-                            headers={'Authorization': f'Bearer {mp_token}'}
-                        )
-                        
-                        if response.status_code == 200:
-                            payment_data = response.json()
-                            method_used = f'payment_id: {pedido.payment_id}'
-                        else:
-                            self.message_user(
-                                request, 
-                                f'Pedido #{pedido.id}: Payment ID {pedido.payment_id} não encontrado (HTTP {response.status_code})',
-                                level='WARNING'
-                            )
-                    except Exception as e:
-                        self.message_user(
-                            request, 
-                            f'Pedido #{pedido.id}: Erro ao consultar payment_id: {str(e)}',
-                            level='WARNING'
-                        )
+                # Tentativa antiga recusada não desfaz a aprovação de outro pagamento
+                motivo = pagamento_ignorado(pedido, payment_data)
+                if motivo:
+                    mensagens.append((f'Pedido #{pedido.id}: {motivo}', 'WARNING'))
+                    continue
                 
-                # Método 2: Buscar por external_reference (se payment_id falhou ou não existe)
-                if not payment_data and pedido.external_reference:
-                    try:
-                        # Buscar pagamentos por external_reference
-                        search_url = 'https://api.mercadopago.com/v1/payments/search'
-                        search_params = {
-                            'external_reference': pedido.external_reference,
-                            'limit': 50  # MP permite até 50 resultados
-                        }
-                        
-                        search_response = requests.get(
-                            search_url,
-                            headers={'Authorization': f'Bearer {mp_token}'},
-                            params=search_params
-                        )
-                        
-                        if search_response.status_code == 200:
-                            search_data = search_response.json()
-                            results = search_data.get('results', [])
-                            
-                            if results:
-                                # Pegar o pagamento mais recente
-                                payment_data = results[0]
-                                method_used = f'external_reference: {pedido.external_reference}'
-                                
-                                # Salvar payment_id se não existia
-                                if not pedido.payment_id and payment_data.get('id'):
-                                    pedido.payment_id = str(payment_data['id'])
-                                    found_payments += 1
-                                    self.message_user(
-                                        request, 
-                                        f'Pedido #{pedido.id}: Payment ID encontrado e salvo: {payment_data["id"]}',
-                                        level='SUCCESS'
-                                    )
-                            else:
-                                self.message_user(
-                                    request, 
-                                    f'Pedido #{pedido.id}: Nenhum pagamento encontrado com external_reference: {pedido.external_reference}',
-                                    level='WARNING'
-                                )
-                        else:
-                            self.message_user(
-                                request, 
-                                f'Pedido #{pedido.id}: Erro na busca por external_reference (HTTP {search_response.status_code})',
-                                level='WARNING'
-                            )
-                    except Exception as e:
-                        self.message_user(
-                            request, 
-                            f'Pedido #{pedido.id}: Erro ao buscar por external_reference: {str(e)}',
-                            level='WARNING'
-                        )
+                campos, status_anterior = aplicar_pagamento(pedido, payment_data)
+                if 'payment_id' in campos:
+                    found_payments += 1
+                    mensagens.append((f'Pedido #{pedido.id}: Payment ID encontrado e salvo: {pedido.payment_id}', 'SUCCESS'))
+                if campos:
+                    pedido.data_atualizacao = agora
+                    alterados.append(pedido)
                 
-                # Processar dados do pagamento se encontrado
-                if payment_data:
-                    novo_status = payment_data.get('status', pedido.status_pagamento)
-                    
-                    # Atualizar campos extras se disponíveis
-                    if not pedido.merchant_order_id and payment_data.get('order', {}).get('id'):
-                        pedido.merchant_order_id = str(payment_data['order']['id'])
-                    
-                    # Atualizar status se mudou
-                    if novo_status != pedido.status_pagamento:
-                        pedido.status_pagamento = novo_status
-                        pedido.save()
-                        updated += 1
-                        self.message_user(
-                            request, 
-                            f'Pedido #{pedido.id}: {pedido.status_pagamento} → {novo_status} (via {method_used})',
-                            level='SUCCESS'
-                        )
-                    else:
-                        pedido.save()  # Salvar payment_id ou outros campos atualizados
-                        self.message_user(
-                            request, 
-                            f'Pedido #{pedido.id}: Status mantido ({novo_status}) (via {method_used})',
-                            level='INFO'
-                        )
+                if 'status_pagamento' in campos:
+                    updated += 1
+                    mudancas_status.append((pedido, status_anterior))
+                    mensagens.append((
+                        f'Pedido #{pedido.id}: {status_anterior} → {pedido.status_pagamento} (via {method_used})',
+                        'SUCCESS'
+                    ))
                 else:
-                    # Nenhum método funcionou
-                    if not pedido.payment_id and not pedido.external_reference:
-                        message = f'Pedido #{pedido.id}: Sem payment_id nem external_reference para consultar'
-                    elif pedido.forma_pagamento == 'presencial':
-                        message = f'Pedido #{pedido.id}: Pagamento presencial - não consultável no MP'
-                    else:
-                        message = f'Pedido #{pedido.id}: Pagamento não encontrado no Mercado Pago'
-                    
-                    self.message_user(request, message, level='WARNING')
-                    errors += 1
-                    
-            except Exception as e:
-                errors += 1
-                self.message_user(
-                    request, 
-                    f'Erro geral ao processar pedido #{pedido.id}: {str(e)}',
-                    level='ERROR'
-                )
+                    mensagens.append((
+                        f'Pedido #{pedido.id}: Status mantido ({pedido.status_pagamento}) (via {method_used})',
+                        'INFO'
+                    ))
+            
+            # Só os campos do pagamento: o resto da linha (estoque_decrementado etc.) não é regravado
+            Pedido.objects.bulk_update(
+                alterados,
+                ['status_pagamento', 'payment_id', 'merchant_order_id', 'data_atualizacao'],
+                batch_size=500
+            )
+            
+            # Efeitos de estoque (como registrar_pagamento): só pedidos com reserva do checkout pendente
+            com_reserva = set(
+                ReservaEstoque.objects.filter(
+                    pedido_id__in=[pedido.id for pedido, _ in mudancas_status],
+                    status__in=['ativa', 'expirada']
+                ).values_list('pedido_id', flat=True)
+            ) if mudancas_status else set()
+            for pedido, status_anterior in mudancas_status:
+                if pedido.id in com_reserva:
+                    pedido.aplicar_efeitos_status(status_anterior, usuario=usuario, origem='consultar_status_mp_admin')
+        
+        for mensagem, level in mensagens:
+            self.message_user(request, mensagem, level=level)
         
         # Resumo final
-        total_processed = queryset.count()
         self.message_user(
             request, 
-            f'📊 Processados: {total_processed} pedidos | ✅ Atualizados: {updated} | 🔍 Payment IDs encontrados: {found_payments} | ❌ Erros/Avisos: {errors}',
+            f'📊 Processados: {len(pedidos)} pedidos | ✅ Atualizados: {updated} | 🔍 Payment IDs encontrados: {found_payments} | ❌ Erros/Avisos: {errors}',
             level='SUCCESS' if errors == 0 else 'INFO'
         )
     
     consultar_status_mp.short_description = "🔄 Consultar status no Mercado Pago"
     
     def marcar_como_aprovado(self, request, queryset):
-        updated = queryset.update(status_pagamento='approved')
+        from django.utils import timezone
+        # Pedidos que mudam de status: reservas do checkout viram venda
+        pedidos = list(queryset.exclude(status_pagamento='approved').only('id', 'status_pagamento', 'estoque_decrementado'))
+        updated = queryset.update(status_pagamento='approved', data_atualizacao=timezone.now())
+        usuario = request.user.username if request.user.is_authenticated else 'admin'
+        for pedido in pedidos:
+            status_anterior = pedido.status_pagamento
+            pedido.status_pagamento = 'approved'
+            pedido.aplicar_efeitos_status(status_anterior, usuario=usuario, origem='marcar_como_aprovado_admin')
         self.message_user(request, f'{updated} pedidos marcados como aprovados.')
     marcar_como_aprovado.short_description = "✅ Marcar como aprovado"
     
@@ -819,9 +862,11 @@ class PedidoAdmin(admin.ModelAdmin):
                                 level='SUCCESS'
                             )
                     
-                    # Marcar como cancelado
+                    # Marcar como cancelado e liberar reservas ativas do checkout
+                    status_anterior = pedido.status_pagamento
                     pedido.status_pagamento = 'cancelled'
                     pedido.save()
+                    pedido.aplicar_efeitos_status(status_anterior, origem='marcar_como_cancelado_admin')
                     processados += 1
                     
             except Exception as e:
@@ -867,6 +912,15 @@ class PedidoAdmin(admin.ModelAdmin):
         for pedido in pedidos:
             try:
                 with transaction.atomic():
+                    # O filtro acima foi lido sem trava: só segue quem marcar o pedido primeiro
+                    if not pedido.reivindicar_decremento():
+                        self.message_user(
+                            request,
+                            f'Pedido #{pedido.id}: Estoque já decrementado',
+                            level='WARNING'
+                        )
+                        continue
+                    
                     if pedido.usa_novo_sistema and pedido.produto_tamanho:
                         # Decrementar estoque do produto_tamanho
                         if pedido.produto_tamanho.decrementar_estoque(
@@ -876,10 +930,9 @@ class PedidoAdmin(admin.ModelAdmin):
                             observacao=f'Sincronização de estoque - Pedido #{pedido.id}',
                             origem='sincronizar_estoque_admin'
                         ):
-                            pedido.estoque_decrementado = True
-                            pedido.save()
                             processados += 1
                         else:
+                            transaction.set_rollback(True)
                             erros += 1
                             self.message_user(
                                 request,
@@ -902,16 +955,19 @@ class PedidoAdmin(admin.ModelAdmin):
                                     break
                         
                         if sucesso:
-                            pedido.estoque_decrementado = True
-                            pedido.save()
                             processados += 1
                         else:
+                            # Desfaz os itens já decrementados e a marcação do pedido
+                            transaction.set_rollback(True)
                             erros += 1
                             self.message_user(
                                 request,
                                 f'Pedido #{pedido.id}: Estoque insuficiente em algum item',
                                 level='ERROR'
                             )
+                    else:
+                        # Nada para decrementar: o pedido não fica marcado
+                        transaction.set_rollback(True)
             except Exception as e:
                 erros += 1
                 self.message_user(
@@ -952,8 +1008,10 @@ class PedidoAdmin(admin.ModelAdmin):
             return
         
         # Atualizar status
+        from django.utils import timezone
         updated = pedidos.update(
             status_pagamento='approved',
+            data_atualizacao=timezone.now(),
             observacoes=models.F('observacoes') + '\n\nPagamento presencial confirmado pelo admin.'
         )
         
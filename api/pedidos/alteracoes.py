@@ -0,0 +1,102 @@
+"""
+Feed incremental de alterações de pedidos (/api/pedidos/changes/)
+
+Quem espelha os pedidos guarda o cursor devolvido e pede só o que mudou desde
+ele. São três fluxos lidos pelo índice (data, id), cada um com sua posição
+dentro do cursor: pedidos (data_atualizacao), itens (data_atualizacao) e
+exclusões (RegistroExclusao.excluido_em). O custo de cada chamada depende do
+número de alterações, não do tamanho da tabela.
+
+O data_atualizacao é calculado antes do COMMIT, então uma transação lenta pode
+gravar uma data anterior à de outra já visível. Por isso o feed só entrega
+alterações com mais de ATRASO_CONSISTENCIA de idade: nenhuma linha aparece
+atrás de um cursor já entregue.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ItemPedido, Pedido, RegistroExclusao
+
+
+ATRASO_CONSISTENCIA = timedelta(seconds=10)
+
+LIMITE_PADRAO = 200
+LIMITE_MAXIMO = 1000
+
+# chave no cursor -> (queryset base, campo de data)
+FLUXOS = {
+    'p': (lambda: Pedido.objects.select_related('comprador'), 'data_atualizacao'),
+    'i': (lambda: ItemPedido.objects.all(), 'data_atualizacao'),
+    'x': (lambda: RegistroExclusao.objects.all(), 'excluido_em'),
+}
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(posicoes):
+    """{'p': (data, id), ...} -> texto opaco para a URL"""
+    dados = {
+        chave: [data.isoformat(), objeto_id]
+        for chave, (data, objeto_id) in posicoes.items()
+    }
+    return base64.urlsafe_b64encode(json.dumps(dados, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Inverso de codificar_cursor; cursor vazio = desde o início"""
+    if not cursor:
+        return {}
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        posicoes = {}
+        for chave, (data, objeto_id) in dados.items():
+            if chave not in FLUXOS or not isinstance(objeto_id, int):
+                raise CursorInvalido(cursor)
+            posicoes[chave] = (datetime.fromisoformat(data), objeto_id)
+        return posicoes
+    except (binascii.Error, ValueError, TypeError, AttributeError):
+        raise CursorInvalido(cursor)
+
+
+def _ler_fluxo(chave, posicao, ate, limite):
+    queryset, campo = FLUXOS[chave]
+    linhas = queryset().filter(**{f'{campo}__lte': ate})
+    if posicao:
+        data, objeto_id = posicao
+        linhas = linhas.filter(Q(**{f'{campo}__gt': data}) | Q(**{campo: data, 'id__gt': objeto_id}))
+    linhas = list(linhas.order_by(campo, 'id')[:limite + 1])
+    tem_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    if linhas:
+        posicao = (getattr(linhas[-1], campo), linhas[-1].id)
+    return linhas, posicao, tem_mais
+
+
+def alteracoes_desde(cursor, limite=LIMITE_PADRAO):
+    """
+    Pedidos, itens e exclusões alterados depois do cursor (até `limite` de cada)
+
+    Retorna (pedidos, itens, exclusoes, novo_cursor, tem_mais). Com tem_mais,
+    chame de novo com o novo cursor até esgotar; sem ele, guarde o cursor para
+    a próxima sincronização. Levanta CursorInvalido para cursor malformado.
+    """
+    posicoes = decodificar_cursor(cursor)
+    ate = timezone.now() - ATRASO_CONSISTENCIA
+
+    resultados = {}
+    tem_mais = False
+    for chave in FLUXOS:
+        linhas, posicao, mais = _ler_fluxo(chave, posicoes.get(chave), ate, limite)
+        resultados[chave] = linhas
+        if posicao:
+            posicoes[chave] = posicao
+        tem_mais = tem_mais or mais
+
+    return resultados['p'], resultados['i'], resultados['x'], codificar_cursor(posicoes), tem_mais
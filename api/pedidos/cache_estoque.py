@@ -0,0 +1,62 @@
+"""
+Cache de leitura do estoque por processo (cada worker do gunicorn tem o seu)
+
+Guarda {product_size_id: dados} de todos os tamanhos e só reconstrói o mapa
+quando VersaoEstoque muda. Cada leitura custa uma query por chave primária
+(a versão); o mapa inteiro é recarregado apenas depois de uma mutação.
+
+A versão é lida ANTES do mapa: no pior caso um mapa novo fica marcado com a
+versão antiga e é recarregado de novo na próxima leitura, nunca o contrário.
+Decremento e reserva continuam validando no banco, então o cache serve só
+para consulta; ele nunca é a última palavra antes de vender uma unidade.
+"""
+import threading
+
+from .models import ProdutoTamanho, VersaoEstoque
+
+
+CAMPOS = (
+    'id', 'tamanho', 'estoque', 'disponivel',
+    'produto_id', 'produto__nome', 'produto__preco', 'produto__json_key', 'produto__ativo',
+)
+
+_lock = threading.Lock()
+_versao = None
+_mapa = {}
+
+
+def obter_tamanhos(product_size_ids):
+    """
+    Retorna {product_size_id: dict} para os ids existentes, a partir do cache
+    Ids inexistentes simplesmente não aparecem no resultado
+    """
+    mapa = _mapa_atualizado()
+    return {
+        product_size_id: mapa[product_size_id]
+        for product_size_id in product_size_ids
+        if product_size_id in mapa
+    }
+
+
+def limpar():
+    """Descarta o cache deste processo (próxima leitura recarrega do banco)"""
+    global _versao, _mapa
+    with _lock:
+        _versao = None
+        _mapa = {}
+
+
+def _mapa_atualizado():
+    global _versao, _mapa
+    versao = VersaoEstoque.atual()
+    if versao == _versao:
+        return _mapa
+
+    with _lock:
+        if versao != _versao:
+            _mapa = {
+                tamanho['id']: tamanho
+                for tamanho in ProdutoTamanho.objects.values(*CAMPOS)
+            }
+            _versao = versao
+        return _mapa
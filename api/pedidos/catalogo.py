@@ -0,0 +1,279 @@
+"""
+Catálogo de produtos no formato do products.json do site
+
+montar_catalogo() gera o dicionário; catalogo_serializado() devolve o JSON já
+pronto (corpo, variantes gzip/brotli e ETag), guardado em memória por versão
+do estoque (VersaoEstoque) e reconstruído uma única vez a cada mudança.
+
+agendar_products_json() é chamado a cada mudança de estoque e, se
+PRODUCTS_JSON_PATH estiver configurado, regrava o products.json no máximo uma
+vez a cada PRODUCTS_JSON_INTERVALO segundos.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Prefetch
+
+from .models import Produto, ProdutoTamanho, VersaoEstoque
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional: sem ele servimos só gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+# Mapeamento de imagens corretas
+IMAGE_MAP = {
+    'camiseta-marrom': './img/camisetas/camiseta_marrom.jpeg',
+    'camiseta-jesus': './img/camisetas/Camiseta_jesus.jpeg',
+    'camiseta-oneway-branca': './img/camisetas/Camiseta_onewayBranca.jpeg',
+    'camiseta-the-way': './img/camisetas/Camiseta_theway.jpeg',
+}
+
+# Mapeamento de imagens extras (se existirem)
+IMAGES_MAP = {
+    'camiseta-marrom': [
+        './img/camisetas/camiseta_marrom.jpeg',
+        './img/camisetas/camiseta_marrom-2.jpeg'
+    ]
+}
+
+# Mapeamento de vídeos (se existirem)
+VIDEO_MAP = {
+    'camiseta-marrom': './videos/camiseta-marrom-preview.mp4'
+}
+
+
+def montar_catalogo(apenas_ativos=False):
+    """
+    Monta {"products": {...}} com produtos e tamanhos em duas queries fixas
+    (produtos + prefetch dos tamanhos), independente do tamanho do catálogo
+
+    Produtos inativos entram com available=false, a menos que apenas_ativos=True
+    """
+    produtos = Produto.objects.order_by('ordem', 'nome').prefetch_related(
+        Prefetch('tamanhos', queryset=ProdutoTamanho.objects.order_by('tamanho'))
+    )
+    if apenas_ativos:
+        produtos = produtos.filter(ativo=True)
+
+    products_data = {"products": {}}
+
+    for produto in produtos:
+        tamanhos = produto.tamanhos.all()
+        if not tamanhos:
+            # Produto sem tamanhos não aparece no site
+            continue
+
+        sizes = {}
+        for tamanho in tamanhos:
+            # Mesmo critério de ProdutoTamanho.esta_disponivel, sem voltar ao banco
+            disponivel = tamanho.disponivel and tamanho.estoque > 0 and produto.ativo
+            sizes[tamanho.tamanho] = {
+                "product_size_id": tamanho.id,
+                "available": disponivel,
+                "qtda_estoque": tamanho.estoque,
+                # Campos legacy preservados
+                "stripe_link": None,
+                "id_stripe": f"prod_{produto.json_key}_{tamanho.tamanho.lower()}"
+            }
+
+        produto_data = {
+            "id": str(produto.id),
+            "title": produto.nome,
+            "price": float(produto.preco),
+            "preco_custo": float(produto.preco_custo),
+            "image": IMAGE_MAP.get(produto.json_key, f"./img/camisetas/{produto.json_key}.jpeg"),
+            "sizes": sizes
+        }
+
+        if produto.json_key in IMAGES_MAP:
+            produto_data["images"] = IMAGES_MAP[produto.json_key]
+
+        if produto.json_key in VIDEO_MAP:
+            produto_data["video"] = VIDEO_MAP[produto.json_key]
+
+        products_data["products"][produto.json_key] = produto_data
+
+    return products_data
+
+
+class CatalogoSerializado:
+    """Corpo JSON do catálogo com as variantes comprimidas e o ETag forte"""
+
+    def __init__(self, versao, catalogo):
+        self.versao = versao
+        self.corpo = json.dumps(catalogo, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.hash = hashlib.sha256(self.corpo).hexdigest()[:32]
+        self.variantes = {
+            'identity': self.corpo,
+            'gzip': gzip.compress(self.corpo, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            self.variantes['br'] = brotli.compress(self.corpo, quality=11)
+
+    def etag(self, encoding='identity'):
+        # ETag forte muda com a codificação (RFC 9110), mas o hash do conteúdo é o mesmo
+        if encoding == 'identity':
+            return f'"{self.hash}"'
+        return f'"{self.hash}-{encoding}"'
+
+    def etags(self):
+        return {self.etag(encoding) for encoding in self.variantes}
+
+
+_lock = threading.Lock()
+_serializado = None
+
+
+def catalogo_serializado():
+    """
+    Retorna o CatalogoSerializado da versão atual do estoque
+    Custa uma query (a versão) quando nada mudou; reconstrói uma vez por mudança
+    """
+    global _serializado
+    versao = VersaoEstoque.atual()
+    atual = _serializado
+    if atual is not None and atual.versao == versao:
+        return atual
+
+    with _lock:
+        if _serializado is None or _serializado.versao != versao:
+            _serializado = CatalogoSerializado(versao, montar_catalogo())
+        return _serializado
+
+
+def limpar():
+    """Descarta o catálogo em memória deste processo"""
+    global _serializado
+    with _lock:
+        _serializado = None
+
+
+# ---------------------------------------------------------------------------
+# Regeneração automática do products.json
+# ---------------------------------------------------------------------------
+
+_timer_lock = threading.Lock()
+_timer = None
+
+
+def caminho_products_json():
+    """Caminho configurado do products.json, ou None se a pasta não existe aqui"""
+    caminho = getattr(settings, 'PRODUCTS_JSON_PATH', '')
+    if not caminho or not os.path.isdir(os.path.dirname(os.path.abspath(caminho))):
+        return None
+    return caminho
+
+
+def agendar_products_json():
+    """
+    Agenda a regravação do products.json daqui a PRODUCTS_JSON_INTERVALO segundos
+    Chamadas enquanto já existe uma agendada são absorvidas por ela, então uma
+    rajada de vendas gera uma única reconstrução por intervalo
+    """
+    global _timer
+    if caminho_products_json() is None:
+        return
+
+    with _timer_lock:
+        if _timer is not None:
+            return
+        intervalo = getattr(settings, 'PRODUCTS_JSON_INTERVALO', 5)
+        _timer = threading.Timer(intervalo, _executar_agendado)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _executar_agendado():
+    global _timer
+    # Libera o agendamento antes de ler o banco: mudanças durante a gravação agendam outra
+    with _timer_lock:
+        _timer = None
+    try:
+        gravar_products_json()
+    except Exception:
+        logger.exception('Erro ao regenerar products.json')
+    finally:
+        # A thread do timer abriu conexões próprias
+        connections.close_all()
+
+
+# Campos que vêm do banco; todo o resto do products.json atual é do arquivo
+CAMPOS_PRODUTO_BANCO = ('id', 'title', 'price', 'preco_custo', 'sizes')
+CAMPOS_TAMANHO_BANCO = ('product_size_id', 'available', 'qtda_estoque')
+
+
+def mesclar_com_original(catalogo, original):
+    """
+    Preserva do products.json atual o que não vem do banco: imagem de capa,
+    imagens, vídeo, os links legacy do Stripe de cada tamanho e qualquer campo
+    que só exista no arquivo
+    """
+    produtos_originais = original.get('products', {})
+    for json_key, produto_data in catalogo['products'].items():
+        produto_original = produtos_originais.get(json_key, {})
+        for campo, valor in produto_original.items():
+            if campo not in CAMPOS_PRODUTO_BANCO:
+                produto_data[campo] = valor
+        tamanhos_originais = produto_original.get('sizes', {})
+        for tamanho, tamanho_data in produto_data['sizes'].items():
+            tamanho_original = tamanhos_originais.get(tamanho, {})
+            for campo, valor in tamanho_original.items():
+                # stripe_link/id_stripe vazios no arquivo não apagam os gerados
+                if campo not in CAMPOS_TAMANHO_BANCO and (valor or campo not in tamanho_data):
+                    tamanho_data[campo] = valor
+    return catalogo
+
+
+def gravar_products_json(caminho=None):
+    """
+    Regrava o products.json a partir do banco de forma atômica
+    (arquivo temporário na mesma pasta + os.replace). Não toca no arquivo se o
+    conteúdo não mudou. Retorna True se o arquivo foi gravado.
+    """
+    caminho = caminho or caminho_products_json()
+    if caminho is None:
+        return False
+
+    atual = b''
+    original = {}
+    if os.path.exists(caminho):
+        with open(caminho, 'rb') as f:
+            atual = f.read()
+        try:
+            original = json.loads(atual)
+        except ValueError:
+            logger.warning('products.json atual inválido, regravando sem mesclar: %s', caminho)
+
+    catalogo = mesclar_com_original(montar_catalogo(), original)
+    conteudo = (json.dumps(catalogo, indent=2, ensure_ascii=False) + '\n').encode('utf-8')
+
+    if hashlib.sha256(conteudo).digest() == hashlib.sha256(atual).digest():
+        return False
+
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    fd, temporario = tempfile.mkstemp(prefix='.products-', suffix='.json', dir=pasta)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(conteudo)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temporario, 0o644)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.unlink(temporario)
+        raise
+
+    logger.info('products.json regenerado: %s', caminho)
+    return True
@@ -0,0 +1,172 @@
+"""
+Checkout do carrinho em uma única transação (POST /api/checkout/)
+
+Substitui a sequência estoque-multiplo -> POST /pedidos/ -> um POST /itempedidos/
+por item -> atualizar_status: comprador, pedido, itens e estoque são gravados
+juntos ou nada é gravado, então uma falha no meio não deixa pedido órfão.
+
+Custo fixo por checkout: 1 SELECT dos tamanhos, upsert do comprador, 1 INSERT
+do pedido, 1 INSERT dos itens e as queries fixas de reservar/decrementar_estoque_lote.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from functools import reduce
+import operator
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .models import Comprador, ItemPedido, Pedido, ProdutoTamanho, ReservaEstoque, gerar_referencia
+
+
+DESCONTO_PIX = Decimal('0.95')
+
+
+class ErroCheckout(Exception):
+    """Checkout recusado; status é o HTTP sugerido (400 dados, 409 estoque/conflito)"""
+
+    def __init__(self, mensagem, status=400, itens=None):
+        super().__init__(mensagem)
+        self.mensagem = mensagem
+        self.status = status
+        self.itens = itens or []
+
+
+def resolver_tamanhos(itens):
+    """
+    Resolve os ProdutoTamanho do carrinho em uma query
+    (por product_size_id ou por json_key do produto + tamanho)
+
+    Retorna {product_size_id: quantidade} na ordem do carrinho e o dict de tamanhos.
+    Levanta ErroCheckout se algum item não existe
+    """
+    condicoes = []
+    for item in itens:
+        if item.get('product_size_id'):
+            condicoes.append(Q(id=item['product_size_id']))
+        else:
+            condicoes.append(Q(produto__json_key=item['produto'], tamanho=item['tamanho']))
+
+    encontrados = list(ProdutoTamanho.objects.select_related('produto').filter(reduce(operator.or_, condicoes)))
+    por_id = {tamanho.id: tamanho for tamanho in encontrados}
+    por_chave = {(tamanho.produto.json_key, tamanho.tamanho): tamanho for tamanho in encontrados}
+
+    solicitados = {}
+    erros = []
+    for item in itens:
+        if item.get('product_size_id'):
+            tamanho = por_id.get(item['product_size_id'])
+            descricao = f"ID {item['product_size_id']}"
+        else:
+            tamanho = por_chave.get((item['produto'], item['tamanho']))
+            descricao = f"{item['produto']} ({item['tamanho']})"
+        if tamanho is None:
+            erros.append(f'Produto {descricao} não encontrado')
+            continue
+        # Mesmo tamanho repetido no carrinho vira um único item (pedido, produto, tamanho é único)
+        solicitados[tamanho.id] = solicitados.get(tamanho.id, 0) + item['quantidade']
+
+    if erros:
+        raise ErroCheckout('; '.join(erros), status=400)
+    return solicitados, por_id
+
+
+def validar_estoque(solicitados, tamanhos):
+    """Só confere (sem travar): estoque menos reservas ativas, como o estoque-multiplo"""
+    reservado = ReservaEstoque.quantidades_reservadas(solicitados.keys())
+    sucesso = True
+    resultados = []
+    for product_size_id, quantidade in solicitados.items():
+        tamanho = tamanhos[product_size_id]
+        livre = max(0, tamanho.estoque - reservado.get(product_size_id, 0))
+        resultado = {
+            'product_size_id': product_size_id,
+            'quantidade_solicitada': quantidade,
+            'estoque_disponivel': livre,
+            'ok': tamanho.disponivel and tamanho.produto.ativo and livre >= quantidade,
+        }
+        if not resultado['ok']:
+            resultado['erro'] = f'{tamanho}: Estoque insuficiente (disponível: {livre}, solicitado: {quantidade})'
+        sucesso = sucesso and resultado['ok']
+        resultados.append(resultado)
+    return sucesso, resultados
+
+
+def preco_final(preco, forma_pagamento):
+    """Preço unitário cobrado no gateway (PIX com 5% de desconto)"""
+    if forma_pagamento == 'pix':
+        preco = preco * DESCONTO_PIX
+    return preco.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def realizar_checkout(dados, usuario='api_checkout'):
+    """
+    Grava comprador, pedido, itens e a operação de estoque em uma transação
+
+    Args:
+        dados: validated_data do CheckoutSerializer
+
+    Retorna (pedido, itens, estoque) com estoque = {'modo', 'items', 'expira_em'}.
+    Levanta ErroCheckout (nada é gravado)
+    """
+    forma_pagamento = dados['forma_pagamento']
+    modo = dados['estoque']
+    solicitados, tamanhos = resolver_tamanhos(dados['itens'])
+    primeiro = tamanhos[next(iter(solicitados))]
+    total = sum(tamanhos[product_size_id].produto.preco * quantidade for product_size_id, quantidade in solicitados.items())
+    referencia = dados.get('external_reference') or gerar_referencia('ONEWAY-CART')
+
+    try:
+        with transaction.atomic():
+            comprador, _ = Comprador.registrar(dados['nome'], dados['email'], dados['telefone'])
+
+            pedido = Pedido.objects.create(
+                comprador=comprador,
+                # Campos legacy: primeiro item do carrinho e total sem desconto
+                produto=primeiro.produto.json_key,
+                tamanho=primeiro.tamanho,
+                preco=total,
+                produto_tamanho=primeiro if len(solicitados) == 1 else None,
+                forma_pagamento=forma_pagamento,
+                external_reference=referencia,
+                observacoes=dados.get('observacoes') or f'Carrinho com {len(solicitados)} itens diferentes',
+            )
+
+            itens = ItemPedido.objects.bulk_create([
+                ItemPedido(
+                    pedido=pedido,
+                    produto=tamanhos[product_size_id].produto.json_key,
+                    tamanho=tamanhos[product_size_id].tamanho,
+                    produto_tamanho=tamanhos[product_size_id],
+                    quantidade=quantidade,
+                    preco_unitario=tamanhos[product_size_id].produto.preco,
+                )
+                for product_size_id, quantidade in solicitados.items()
+            ])
+
+            itens_estoque = list(solicitados.items())
+            expira_em = None
+            if modo == 'reservar':
+                sucesso, resultados = ReservaEstoque.reservar(itens_estoque, pedido=pedido, minutos=dados.get('minutos'))
+                if sucesso:
+                    expira_em = resultados[0]['expira_em']
+            elif modo == 'decrementar':
+                sucesso, resultados = ProdutoTamanho.decrementar_estoque_lote(
+                    itens_estoque,
+                    pedido=pedido,
+                    usuario=usuario,
+                    observacao=f'Checkout {forma_pagamento} - Pedido #{pedido.id}',
+                    origem='checkout_view'
+                )
+            else:
+                sucesso, resultados = validar_estoque(solicitados, tamanhos)
+
+            if not sucesso:
+                raise ErroCheckout('Estoque insuficiente', status=409, itens=resultados)
+    except IntegrityError:
+        # external_reference é única: o mesmo checkout já foi gravado. Qualquer
+        # outra violação (e-mail do comprador, itens) não é conflito de referência
+        if not Pedido.objects.filter(external_reference=referencia).exists():
+            raise
+        raise ErroCheckout('Já existe um pedido com esta external_reference', status=409)
+
+    return pedido, itens, {'modo': modo, 'items': resultados, 'expira_em': expira_em}
@@ -0,0 +1,278 @@
+"""
+Conciliação contínua dos pagamentos em aberto com o Mercado Pago
+
+Todo pedido de gateway nasce com proxima_conciliacao (Pedido.save) e fica na
+fila enquanto o status está em aberto. O worker (comando conciliar_pagamentos)
+pega os mais atrasados primeiro pelo índice parcial da fila, com
+SELECT ... FOR UPDATE SKIP LOCKED, e empurra proxima_conciliacao para frente
+antes de soltar a trava: vários workers dividem a fila sem consultar o mesmo
+pedido, e se um deles morrer o pedido volta sozinho depois de RESERVA.
+
+Cada consulta segue a mesma ordem da action do admin (payment_id, depois
+external_reference) e cada chamada HTTP passa pela cota global
+(CotaMercadoPago). Pedido que continua em aberto volta para a fila no próximo
+intervalo de Pedido.INTERVALOS_CONCILIACAO (1min, 5min, 30min, 2h...).
+
+conciliar_periodo() é a conciliação em massa (comando conciliar_periodo): pagina
+o /v1/payments/search do período inteiro, casa os pagamentos com os pedidos
+locais em memória e grava só os que mudaram, com bulk_update.
+"""
+import logging
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .mercadopago import ClienteMercadoPago, aplicar_pagamento, pagamento_ignorado, registrar_pagamento
+from .models import CotaMercadoPago, PagamentoSnapshot, Pedido, ReservaEstoque
+
+logger = logging.getLogger(__name__)
+
+
+LOTE = 20
+# Tempo que um pedido reivindicado fica fora da fila (worker que morreu no meio)
+RESERVA = timedelta(minutes=10)
+# Pedido em aberto há mais que isso sai da fila (a preferência do MP expira em 24h)
+ABANDONAR_APOS = timedelta(days=3)
+
+
+def chamadas_por_minuto():
+    return getattr(settings, 'MERCADOPAGO_CHAMADAS_POR_MINUTO', 60)
+
+
+def proximo_intervalo(tentativas):
+    intervalos = Pedido.INTERVALOS_CONCILIACAO
+    return intervalos[min(tentativas, len(intervalos) - 1)]
+
+
+def limpar_fila():
+    """
+    Tira da fila os pedidos que saíram do status em aberto por outro caminho
+    (webhook, retorno do site, admin), os abandonados e os de formas de
+    pagamento fora do Mercado Pago; usa o índice parcial
+    """
+    agendados = Pedido.objects.filter(proxima_conciliacao__isnull=False)
+    resolvidos = agendados.exclude(status_pagamento__in=Pedido.STATUS_EM_ABERTO).update(proxima_conciliacao=None)
+    abandonados = agendados.filter(data_pedido__lt=timezone.now() - ABANDONAR_APOS).update(proxima_conciliacao=None)
+    fora_do_mp = agendados.filter(forma_pagamento__in=Pedido.FORMAS_FORA_DO_MERCADOPAGO).update(proxima_conciliacao=None)
+    return resolvidos + abandonados + fora_do_mp
+
+
+def reivindicar(limite=LOTE):
+    """Pega até `limite` pedidos vencidos (mais atrasados primeiro) e os reserva por RESERVA"""
+    agora = timezone.now()
+    fila = Pedido.objects.filter(
+        proxima_conciliacao__lte=agora,
+        status_pagamento__in=Pedido.STATUS_EM_ABERTO,
+    ).exclude(forma_pagamento__in=Pedido.FORMAS_FORA_DO_MERCADOPAGO).order_by('proxima_conciliacao')
+
+    with transaction.atomic():
+        pedidos = list(
+            fila.select_for_update(skip_locked=True, of=('self',))
+            .only('id', 'payment_id', 'external_reference', 'forma_pagamento',
+                  'status_pagamento', 'data_pedido', 'tentativas_conciliacao')[:limite]
+        )
+        if pedidos:
+            Pedido.objects.filter(id__in=[pedido.id for pedido in pedidos]).update(
+                proxima_conciliacao=agora + RESERVA
+            )
+    return pedidos
+
+
+def conciliar_lote(cliente, limite=LOTE):
+    """
+    Consulta e aplica um lote da fila
+
+    Retorna {'consultados', 'atualizados', 'nao_encontrados'}
+    """
+    contagem = {'consultados': 0, 'atualizados': 0, 'nao_encontrados': 0}
+    pedidos = reivindicar(limite)
+    reagendados = []
+
+    for pedido in pedidos:
+        contagem['consultados'] += 1
+        status_atual = pedido.status_pagamento
+        try:
+            payment_data, _, avisos = cliente.consultar_pedido(pedido.payment_id, pedido.external_reference)
+        except Exception:
+            logger.exception('Erro ao conciliar pedido %s', pedido.id)
+            payment_data, avisos = None, []
+
+        if payment_data:
+            try:
+                atualizado, campos, _, _ = registrar_pagamento(
+                    payment_data, usuario='conciliacao', origem='conciliar_pagamentos'
+                )
+                if atualizado is not None and atualizado.id == pedido.id:
+                    status_atual = atualizado.status_pagamento
+                if 'status_pagamento' in campos:
+                    contagem['atualizados'] += 1
+            except Exception:
+                logger.exception('Erro ao aplicar pagamento do pedido %s', pedido.id)
+        else:
+            contagem['nao_encontrados'] += 1
+            for aviso in avisos:
+                logger.info('Pedido %s: %s', pedido.id, aviso)
+
+        if status_atual in Pedido.STATUS_EM_ABERTO and pedido.data_pedido >= timezone.now() - ABANDONAR_APOS:
+            pedido.proxima_conciliacao = timezone.now() + proximo_intervalo(pedido.tentativas_conciliacao + 1)
+        else:
+            pedido.proxima_conciliacao = None
+        pedido.tentativas_conciliacao += 1
+        reagendados.append(pedido)
+
+    if reagendados:
+        Pedido.objects.bulk_update(reagendados, ['proxima_conciliacao', 'tentativas_conciliacao'])
+    return contagem
+
+
+def novo_cliente(limite=None):
+    """ClienteMercadoPago cujas chamadas consomem a cota global"""
+    limite = limite or chamadas_por_minuto()
+    return ClienteMercadoPago(conexoes=1, limitador=partial(CotaMercadoPago.aguardar, limite))
+
+
+# ---------------------------------------------------------------------------
+# Conciliação em massa por período
+# ---------------------------------------------------------------------------
+
+# O pagamento pode ser criado depois do pedido: a busca vai além do fim do período
+FOLGA_PAGAMENTO = timedelta(days=1)
+LOTE_GRAVACAO = 500
+CAMPOS_PEDIDO = (
+    'id', 'payment_id', 'external_reference', 'merchant_order_id', 'forma_pagamento',
+    'status_pagamento', 'estoque_decrementado', 'proxima_conciliacao',
+)
+CAMPOS_GRAVADOS = ['status_pagamento', 'payment_id', 'merchant_order_id', 'data_atualizacao', 'proxima_conciliacao']
+
+
+def _mais_relevante(atual, novo):
+    """Entre dois pagamentos da mesma referência: o aprovado, senão o mais recente"""
+    if atual is None:
+        return novo
+    def chave(pagamento):
+        return (pagamento.get('status') == 'approved', pagamento.get('date_created') or '')
+    return novo if chave(novo) > chave(atual) else atual
+
+
+def mapear_pagamentos(pagamentos):
+    """Retorna ({payment_id: pagamento}, {external_reference: pagamento mais relevante})"""
+    por_id = {}
+    por_referencia = {}
+    for pagamento in pagamentos:
+        por_id[str(pagamento.get('id'))] = pagamento
+        referencia = pagamento.get('external_reference')
+        if referencia:
+            por_referencia[referencia] = _mais_relevante(por_referencia.get(referencia), pagamento)
+    return por_id, por_referencia
+
+
+def pagamento_do_pedido(pedido, por_id, por_referencia):
+    """
+    O pagamento já associado (payment_id) ou, se não houver, o da referência;
+    uma nova tentativa aprovada na referência vence um pagamento não aprovado
+    """
+    pagamento = por_id.get(pedido.payment_id) if pedido.payment_id else None
+    alternativo = por_referencia.get(pedido.external_reference)
+    if pagamento is None or (
+        alternativo is not None and alternativo.get('status') == 'approved' and pagamento.get('status') != 'approved'
+    ):
+        return alternativo or pagamento
+    return pagamento
+
+
+def _aplicar(pedido, pagamento):
+    """aplicar_pagamento respeitando pagamento_ignorado; retorna (campos, status_anterior)"""
+    if pagamento_ignorado(pedido, pagamento):
+        return [], pedido.status_pagamento
+    return aplicar_pagamento(pedido, pagamento)
+
+
+def conciliar_periodo(inicio, fim, cliente=None, dry_run=False, usuario='conciliacao_periodo'):
+    """
+    Concilia todos os pedidos de gateway feitos entre inicio e fim (datetimes)
+
+    Custo: ceil(pagamentos / 100) chamadas ao MP, uma leitura dos pedidos do
+    período, o upsert dos snapshots e, para os que mudaram, um SELECT ... FOR
+    UPDATE, um bulk_update e uma consulta de reservas por lote de LOTE_GRAVACAO
+    (o pedido é reaplicado sobre a linha travada, então uma mudança do webhook
+    no meio do caminho não é sobrescrita); só pedidos com reserva do checkout
+    custam queries a mais
+
+    Retorna {'chamadas', 'pagamentos', 'pedidos', 'sem_pagamento', 'alterados', 'status_alterados'}
+    """
+    proprio = cliente is None
+    cliente = cliente or novo_cliente()
+    try:
+        por_id, por_referencia = mapear_pagamentos(cliente.buscar_periodo(inicio, fim + FOLGA_PAGAMENTO))
+        chamadas = cliente.chamadas
+    finally:
+        if proprio:
+            cliente.fechar()
+
+    resumo = {
+        'chamadas': chamadas, 'pagamentos': len(por_id), 'pedidos': 0,
+        'sem_pagamento': 0, 'alterados': 0, 'status_alterados': 0,
+    }
+
+    # Primeira passada (sem travas): quais pedidos mudariam e com qual pagamento
+    candidatos = {}
+    pedidos = (
+        Pedido.objects.filter(data_pedido__gte=inicio, data_pedido__lte=fim)
+        .exclude(forma_pagamento__in=Pedido.FORMAS_FORA_DO_MERCADOPAGO)
+        .only(*CAMPOS_PEDIDO)
+        .order_by('id')
+    )
+    for pedido in pedidos.iterator(chunk_size=2000):
+        resumo['pedidos'] += 1
+        pagamento = pagamento_do_pedido(pedido, por_id, por_referencia)
+        if pagamento is None:
+            resumo['sem_pagamento'] += 1
+            continue
+        campos, _ = _aplicar(pedido, pagamento)
+        if campos:
+            candidatos[pedido.id] = pagamento
+            resumo['alterados'] += 1
+            if 'status_pagamento' in campos:
+                resumo['status_alterados'] += 1
+
+    if dry_run:
+        return resumo
+    PagamentoSnapshot.gravar(list(por_id.values()))
+    if not candidatos:
+        return resumo
+
+    ids = list(candidatos)
+    for posicao in range(0, len(ids), LOTE_GRAVACAO):
+        lote = ids[posicao:posicao + LOTE_GRAVACAO]
+        agora = timezone.now()
+        with transaction.atomic():
+            travados = list(Pedido.objects.select_for_update().filter(id__in=lote).only(*CAMPOS_PEDIDO))
+            alterados = []
+            mudancas_status = []
+            for pedido in travados:
+                campos, status_anterior = _aplicar(pedido, candidatos[pedido.id])
+                if not campos:
+                    continue
+                pedido.data_atualizacao = agora
+                if pedido.status_pagamento not in Pedido.STATUS_EM_ABERTO:
+                    pedido.proxima_conciliacao = None
+                alterados.append(pedido)
+                if 'status_pagamento' in campos:
+                    mudancas_status.append((pedido, status_anterior))
+
+            Pedido.objects.bulk_update(alterados, CAMPOS_GRAVADOS)
+            # Efeitos de estoque: só pedidos com status novo e reservas do checkout pendentes
+            com_reserva = set(
+                ReservaEstoque.objects.filter(
+                    pedido_id__in=[pedido.id for pedido, _ in mudancas_status],
+                    status__in=['ativa', 'expirada']
+                ).values_list('pedido_id', flat=True)
+            ) if mudancas_status else set()
+            for pedido, status_anterior in mudancas_status:
+                if pedido.id in com_reserva:
+                    pedido.aplicar_efeitos_status(status_anterior, usuario=usuario, origem='conciliar_periodo')
+
+    return resumo
@@ -0,0 +1,235 @@
+"""
+Exportação do relatório de vendas e dos compradores em CSV/XLSX
+
+As linhas saem do banco com values_list().iterator(chunk_size) e vão direto
+para a resposta (StreamingHttpResponse): a memória não cresce com o número de
+itens e o primeiro byte sai antes de a consulta terminar.
+
+O XLSX é um zip escrito em sequência (zipfile sobre um buffer sem seek, com
+data descriptors) com uma única planilha de strings inline, então também é
+gerado aos pedaços, sem montar a pasta de trabalho em memória.
+"""
+import csv
+import re
+import zipfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .models import Comprador, ItemPedido, Pedido
+from .relatorios import NOMES_PRODUTOS, filtrar_categoria, itens_vendidos
+
+
+CHUNK_SIZE = 2000
+
+FORMATOS = ('csv', 'xlsx')
+
+CAMPOS = (
+    'pedido_id', 'pedido__data_pedido', 'pedido__external_reference',
+    'pedido__comprador__nome', 'pedido__comprador__email', 'pedido__comprador__telefone',
+    'produto', 'tamanho', 'quantidade', 'preco_unitario', 'quantidade_entregue',
+    'pedido__forma_pagamento', 'pedido__status_pagamento',
+)
+
+CABECALHO = (
+    'Pedido', 'Data', 'Referência',
+    'Comprador', 'Email', 'Telefone',
+    'Produto', 'Tamanho', 'Quantidade', 'Preço Unitário', 'Subtotal', 'Qtd. Entregue',
+    'Forma de Pagamento', 'Status',
+)
+
+ORDENACAO = {
+    'vendas': ('produto', 'tamanho', 'pedido__comprador__nome', 'id'),
+    'compradores': ('pedido__comprador__nome', 'pedido_id', 'id'),
+}
+
+FORMAS_PAGAMENTO = dict(Pedido.FORMA_PAGAMENTO_CHOICES)
+STATUS_PAGAMENTO = dict(Pedido.STATUS_CHOICES)
+
+
+def filtrar_itens(parametros, tipo='vendas'):
+    """
+    Monta o queryset da exportação a partir dos parâmetros GET
+
+    categoria: todos | camisetas | alimentacao
+    status: lista separada por vírgula (sem status = mesmo critério do relatório:
+            aprovados ou qualquer presencial)
+    data_inicio / data_fim: AAAA-MM-DD, pela data do pedido
+    nome: trecho do nome do comprador, sem acentos (apenas tipo=compradores)
+
+    Retorna (queryset, erro)
+    """
+    categoria = parametros.get('categoria', 'todos')
+    status = [valor.strip() for valor in parametros.get('status', '').split(',') if valor.strip()]
+
+    if status:
+        itens = filtrar_categoria(ItemPedido.objects.filter(pedido__status_pagamento__in=status), categoria)
+    else:
+        itens = itens_vendidos(categoria)
+
+    # Intervalos em data_pedido (e não __date) para o banco usar o índice;
+    # data_fim inclui o dia inteiro: data_pedido < meia-noite do dia seguinte
+    for parametro, lookup, dias in (('data_inicio', 'gte', 0), ('data_fim', 'lt', 1)):
+        valor = parametros.get(parametro)
+        if not valor:
+            continue
+        try:
+            data = datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            return None, f'{parametro} deve estar no formato AAAA-MM-DD'
+        limite = timezone.make_aware(datetime.combine(data + timedelta(days=dias), time.min))
+        itens = itens.filter(**{f'pedido__data_pedido__{lookup}': limite})
+
+    nome = parametros.get('nome', '').strip()
+    if tipo == 'compradores' and nome:
+        itens = itens.filter(pedido__comprador__in=Comprador.buscar_por_nome(nome))
+
+    return itens.order_by(*ORDENACAO[tipo]), None
+
+
+def linhas(itens):
+    """Gera as linhas da exportação (tuplas na ordem de CABECALHO)"""
+    fuso = timezone.get_current_timezone()
+    for (pedido_id, data_pedido, referencia, nome, email, telefone, produto, tamanho,
+         quantidade, preco_unitario, quantidade_entregue, forma, status) in (
+            itens.values_list(*CAMPOS).iterator(chunk_size=CHUNK_SIZE)):
+        yield (
+            pedido_id,
+            timezone.localtime(data_pedido, fuso).strftime('%d/%m/%Y %H:%M') if data_pedido else '',
+            referencia or '',
+            nome, email, telefone,
+            NOMES_PRODUTOS.get(produto, produto), tamanho,
+            quantidade, preco_unitario, preco_unitario * quantidade, quantidade_entregue,
+            FORMAS_PAGAMENTO.get(forma, forma), STATUS_PAGAMENTO.get(status, status),
+        )
+
+
+# ---------------------------------------------------------------------------
+# CSV
+# ---------------------------------------------------------------------------
+
+class _Eco:
+    """Pseudo-arquivo para o csv.writer: devolve a linha em vez de guardá-la"""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(itens):
+    writer = csv.writer(_Eco())
+    # BOM para o Excel abrir acentos corretamente
+    yield '\ufeff' + writer.writerow(CABECALHO)
+    for linha in linhas(itens):
+        yield writer.writerow(linha)
+
+
+# ---------------------------------------------------------------------------
+# XLSX
+# ---------------------------------------------------------------------------
+
+class _BufferSequencial:
+    """
+    Destino do zipfile sem seek/tell: o zipfile passa a usar data descriptors
+    e escreve tudo em sequência; drenar() entrega o que já foi escrito
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def drenar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+
+_CARACTERES_INVALIDOS_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{nome}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+_SHEET_INICIO = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+
+_SHEET_FIM = '</sheetData></worksheet>'
+
+
+def _celula_xlsx(valor):
+    if isinstance(valor, bool):
+        return f'<c t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CARACTERES_INVALIDOS_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _linha_xlsx(valores):
+    return '<row>' + ''.join(_celula_xlsx(valor) for valor in valores) + '</row>'
+
+
+def gerar_xlsx(itens, nome_planilha='Vendas'):
+    buffer = _BufferSequencial()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo:
+        arquivo.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        arquivo.writestr('_rels/.rels', _RELS)
+        arquivo.writestr('xl/workbook.xml', _WORKBOOK.format(nome=escape(nome_planilha)))
+        arquivo.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        yield buffer.drenar()
+
+        with arquivo.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write((_SHEET_INICIO + _linha_xlsx(CABECALHO)).encode('utf-8'))
+            pendentes = []
+            for linha in linhas(itens):
+                pendentes.append(_linha_xlsx(linha))
+                if len(pendentes) >= CHUNK_SIZE:
+                    planilha.write(''.join(pendentes).encode('utf-8'))
+                    pendentes = []
+                    yield buffer.drenar()
+            planilha.write((''.join(pendentes) + _SHEET_FIM).encode('utf-8'))
+
+    yield buffer.drenar()
@@ -0,0 +1,90 @@
+"""
+Idempotency-Key para as criações da API (POST /api/pedidos/, POST /api/checkout/)
+
+A chave, a criação e a resposta são gravadas na mesma transação: a linha de
+ChaveIdempotencia é inserida antes de executar a view, então um reenvio
+concorrente com a mesma chave espera no índice único e, quando a primeira
+transação confirma, recebe a resposta gravada. Se a view falhar (exceção ou
+5xx), tudo é desfeito e a chave fica livre para uma nova tentativa.
+
+Reenvio com a mesma chave e corpo diferente é erro do cliente (422).
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import ChaveIdempotencia
+
+
+HEADER = 'Idempotency-Key'
+TAMANHO_MAXIMO_CHAVE = 255
+
+
+def hash_requisicao(request):
+    # Corpo já interpretado (request.data), com chaves ordenadas: espaços e ordem não contam
+    corpo = json.dumps(request.data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(f'{request.method} {request.path}\n{corpo}'.encode('utf-8')).hexdigest()
+
+
+def _repetir(registro, hash_atual):
+    if registro.hash_requisicao != hash_atual:
+        return Response(
+            {'erro': f'{HEADER} já usada com outro conteúdo de requisição'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    resposta = Response(registro.resposta, status=registro.status_http)
+    resposta['Idempotent-Replayed'] = 'true'
+    return resposta
+
+
+def idempotente(escopo):
+    """
+    Decorator para views DRF (função ou método de ViewSet) de criação
+    Sem o header a view roda normalmente
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Funciona como view de função (request, ...) ou método (self, request, ...)
+            request = args[1] if len(args) > 1 and hasattr(args[1], 'headers') else args[0]
+            chave = request.headers.get(HEADER, '').strip()
+            if not chave:
+                return view(*args, **kwargs)
+            if len(chave) > TAMANHO_MAXIMO_CHAVE:
+                return Response(
+                    {'erro': f'{HEADER} deve ter no máximo {TAMANHO_MAXIMO_CHAVE} caracteres'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            hash_atual = hash_requisicao(request)
+            registro = ChaveIdempotencia.objects.filter(escopo=escopo, chave=chave).first()
+            if registro is not None:
+                return _repetir(registro, hash_atual)
+            
+            try:
+                with transaction.atomic():
+                    registro = ChaveIdempotencia.objects.create(
+                        escopo=escopo, chave=chave, hash_requisicao=hash_atual,
+                        status_http=0, resposta={}
+                    )
+                    resposta = view(*args, **kwargs)
+                    if resposta.status_code >= 500:
+                        transaction.set_rollback(True)
+                        return resposta
+                    registro.status_http = resposta.status_code
+                    registro.resposta = json.loads(JSONRenderer().render(resposta.data) or 'null')
+                    registro.save(update_fields=['status_http', 'resposta'])
+                    return resposta
+            except IntegrityError:
+                # Outra requisição com a mesma chave confirmou primeiro
+                registro = ChaveIdempotencia.objects.filter(escopo=escopo, chave=chave).first()
+                if registro is None:
+                    raise
+                return _repetir(registro, hash_atual)
+        return wrapper
+    return decorator
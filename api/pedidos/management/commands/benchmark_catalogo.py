@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from pedidos.catalogo import montar_catalogo
+from pedidos.models import Produto, ProdutoTamanho
+from decimal import Decimal
+import time
+
+
+class Command(BaseCommand):
+    help = 'Mede queries e tempo de montar_catalogo com catálogos sintéticos de tamanhos crescentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--escalas',
+            type=str,
+            default='10,100,1000',
+            help='Quantidades de produtos sintéticos, separadas por vírgula (padrão: 10,100,1000)',
+        )
+        parser.add_argument(
+            '--tamanhos',
+            type=int,
+            default=5,
+            help='Tamanhos por produto sintético, até 5 (padrão: 5)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            escalas = [int(escala) for escala in options['escalas'].split(',') if escala.strip()]
+        except ValueError:
+            raise CommandError('--escalas deve ser uma lista de inteiros separados por vírgula')
+        tamanhos_por_produto = min(max(1, options['tamanhos']), len(ProdutoTamanho.TAMANHOS_CHOICES))
+
+        self.stdout.write(self.style.SUCCESS('\n' + '='*60))
+        self.stdout.write(self.style.SUCCESS('⏱️  BENCHMARK DO CATÁLOGO (montar_catalogo)'))
+        self.stdout.write(self.style.SUCCESS('='*60 + '\n'))
+        self.stdout.write('ℹ️  Dados sintéticos criados em transação desfeita ao final de cada escala\n')
+
+        contagens = set()
+        for escala in escalas:
+            queries, segundos, produtos = self.medir(escala, tamanhos_por_produto)
+            contagens.add(queries)
+            self.stdout.write(
+                f'  📦 {escala:>6} produtos sintéticos x {tamanhos_por_produto} tamanhos '
+                f'({produtos} no catálogo): {queries} queries, {segundos * 1000:.1f} ms'
+            )
+
+        if len(contagens) > 1:
+            raise CommandError(f'❌ Número de queries variou com o tamanho do catálogo: {sorted(contagens)}')
+
+        self.stdout.write(self.style.SUCCESS(f'\n✅ Número de queries constante: {contagens.pop() if contagens else 0}'))
+
+    def medir(self, escala, tamanhos_por_produto):
+        nomes_tamanhos = [valor for valor, _ in ProdutoTamanho.TAMANHOS_CHOICES[:tamanhos_por_produto]]
+
+        with transaction.atomic():
+            # bulk_create não passa por save(): não mexe em VersaoEstoque nem agenda o products.json
+            produtos = Produto.objects.bulk_create([
+                Produto(
+                    nome=f'Benchmark {indice}',
+                    slug=f'benchmark-{indice}',
+                    json_key=f'benchmark-{indice}',
+                    preco=Decimal('50.00'),
+                    preco_custo=Decimal('20.00'),
+                    ordem=indice,
+                )
+                for indice in range(escala)
+            ])
+            if not connection.features.can_return_rows_from_bulk_insert:
+                produtos = list(Produto.objects.filter(json_key__startswith='benchmark-'))
+            ProdutoTamanho.objects.bulk_create([
+                ProdutoTamanho(produto=produto, tamanho=nome, estoque=indice % 7)
+                for produto in produtos
+                for indice, nome in enumerate(nomes_tamanhos)
+            ])
+
+            inicio = time.perf_counter()
+            with CaptureQueriesContext(connection) as contexto:
+                catalogo = montar_catalogo()
+            segundos = time.perf_counter() - inicio
+
+            transaction.set_rollback(True)
+
+        return len(contexto), segundos, len(catalogo['products'])
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from pedidos.conciliacao import LOTE, chamadas_por_minuto, conciliar_lote, limpar_fila, novo_cliente
+from pedidos.mercadopago import token_configurado
+import time
+
+
+class Command(BaseCommand):
+    help = 'Worker contínuo: confere no Mercado Pago os pedidos em aberto da fila de conciliação (vários podem rodar juntos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=LOTE,
+            help=f'Pedidos reivindicados por vez (padrão: {LOTE})',
+        )
+        parser.add_argument(
+            '--taxa',
+            type=int,
+            default=None,
+            help='Chamadas por minuto à API do MP, somando todos os workers (padrão: MERCADOPAGO_CHAMADAS_POR_MINUTO)',
+        )
+        parser.add_argument(
+            '--espera',
+            type=float,
+            default=15,
+            help='Segundos de espera quando a fila não tem pedidos vencidos (padrão: 15)',
+        )
+        parser.add_argument(
+            '--uma-vez',
+            action='store_true',
+            help='Processa os pedidos vencidos agora e termina (para cron)',
+        )
+
+    def handle(self, *args, **options):
+        if not token_configurado():
+            raise CommandError('❌ Token do Mercado Pago não configurado')
+        lote = max(1, options.get('lote', LOTE))
+        taxa = max(1, options.get('taxa') or chamadas_por_minuto())
+        espera = max(1.0, options.get('espera', 15))
+        uma_vez = options.get('uma_vez', False)
+
+        self.stdout.write(self.style.SUCCESS('\n🔁 CONCILIAÇÃO DE PAGAMENTOS COM O MERCADO PAGO'))
+        self.stdout.write(f'   • Lote: {lote} | Cota global: {taxa} chamadas/min' + ('' if uma_vez else f' | Espera: {espera:g}s'))
+
+        totais = {'consultados': 0, 'atualizados': 0, 'nao_encontrados': 0}
+        cliente = novo_cliente(taxa)
+        try:
+            while True:
+                close_old_connections()
+                removidos = limpar_fila()
+                if removidos:
+                    self.stdout.write(f'   • {removidos} pedidos resolvidos/abandonados saíram da fila')
+
+                contagem = conciliar_lote(cliente, lote)
+                for chave, valor in contagem.items():
+                    totais[chave] += valor
+                if contagem['consultados']:
+                    self.stdout.write(
+                        f"   🔍 {contagem['consultados']} consultados | ✅ {contagem['atualizados']} atualizados"
+                        f" | ❓ {contagem['nao_encontrados']} sem pagamento no MP"
+                    )
+                    continue
+
+                if uma_vez:
+                    break
+                time.sleep(espera)
+        except KeyboardInterrupt:
+            self.stdout.write('\n⏹️  Interrompido')
+        finally:
+            cliente.fechar()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Total: {totais['consultados']} consultados, {totais['atualizados']} atualizados, "
+            f"{totais['nao_encontrados']} sem pagamento no MP"
+        ))
@@ -0,0 +1,71 @@
+from datetime import datetime, time, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from pedidos.conciliacao import conciliar_periodo
+from pedidos.mercadopago import ErroMercadoPago, token_configurado
+
+
+class Command(BaseCommand):
+    help = 'Concilia com o Mercado Pago todos os pedidos de um período (busca paginada de pagamentos + bulk_update)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--inicio',
+            type=str,
+            help='Primeiro dia do período, AAAA-MM-DD (padrão: 7 dias atrás)',
+        )
+        parser.add_argument(
+            '--fim',
+            type=str,
+            help='Último dia do período, AAAA-MM-DD (padrão: hoje)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas conta os pedidos que mudariam, sem alterar nada',
+        )
+
+    def handle(self, *args, **options):
+        if not token_configurado():
+            raise CommandError('❌ Token do Mercado Pago não configurado')
+
+        hoje = timezone.localdate()
+        inicio = self.data(options.get('inicio'), 'inicio') or hoje - timedelta(days=7)
+        fim = self.data(options.get('fim'), 'fim') or hoje
+        if inicio > fim:
+            raise CommandError('--inicio deve ser anterior a --fim')
+        dry_run = options.get('dry_run', False)
+
+        self.stdout.write(self.style.SUCCESS('\n🧮 CONCILIAÇÃO POR PERÍODO COM O MERCADO PAGO'))
+        self.stdout.write(f'   • Período: {inicio:%d/%m/%Y} a {fim:%d/%m/%Y}')
+
+        try:
+            resumo = conciliar_periodo(
+                timezone.make_aware(datetime.combine(inicio, time.min)),
+                timezone.make_aware(datetime.combine(fim, time.max)),
+                dry_run=dry_run,
+            )
+        except ErroMercadoPago as e:
+            raise CommandError(f'❌ {e}')
+
+        self.stdout.write(f"   • Chamadas à API: {resumo['chamadas']} ({resumo['pagamentos']} pagamentos)")
+        self.stdout.write(f"   • Pedidos no período: {resumo['pedidos']} ({resumo['sem_pagamento']} sem pagamento no MP)")
+        if dry_run:
+            self.stdout.write(
+                f"🔍 [DRY RUN] {resumo['alterados']} pedidos seriam atualizados "
+                f"({resumo['status_alterados']} com mudança de status)"
+            )
+        elif resumo['alterados']:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {resumo['alterados']} pedidos atualizados ({resumo['status_alterados']} com mudança de status)"
+            ))
+        else:
+            self.stdout.write('ℹ️  Todos os pedidos já estavam conciliados')
+
+    def data(self, valor, nome):
+        if not valor:
+            return None
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'--{nome} deve estar no formato AAAA-MM-DD')
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from pedidos.models import Produto, ProdutoTamanho
+from pedidos.catalogo import montar_catalogo
 import json
 import os
 
@@ -23,82 +23,24 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('='*60 + '\n'))
         
         try:
-            # Mapeamento de imagens corretas
-            image_map = {
-                'camiseta-marrom': './img/camisetas/camiseta_marrom.jpeg',
-                'camiseta-jesus': './img/camisetas/Camiseta_jesus.jpeg',
-                'camiseta-oneway-branca': './img/camisetas/Camiseta_onewayBranca.jpeg',
-                'camiseta-the-way': './img/camisetas/Camiseta_theway.jpeg',
-            }
-            
-            # Mapeamento de imagens extras (se existirem)
-            images_map = {
-                'camiseta-marrom': [
-                    './img/camisetas/camiseta_marrom.jpeg',
-                    './img/camisetas/camiseta_marrom-2.jpeg'
-                ]
-            }
-            
-            # Mapeamento de vídeos (se existirem)
-            video_map = {
-                'camiseta-marrom': './videos/camiseta-marrom-preview.mp4'
-            }
-            
-            # Estrutura base do products.json
-            products_data = {"products": {}}
-            
-            # Buscar todos os produtos ordenados (o método esta_disponivel valida se está ativo)
-            produtos = Produto.objects.all().order_by('ordem', 'nome')
-            
-            if not produtos.exists():
-                self.stdout.write(self.style.ERROR('❌ Nenhum produto ativo encontrado'))
+            # Catálogo inteiro em duas queries (produtos + prefetch dos tamanhos)
+            products_data = montar_catalogo()
+            
+            if not products_data["products"]:
+                self.stdout.write(self.style.ERROR('❌ Nenhum produto com tamanhos encontrado'))
                 return
             
-            self.stdout.write(self.style.NOTICE(f'📦 Processando {produtos.count()} produtos...'))
+            self.stdout.write(self.style.NOTICE(f'📦 Processando {len(products_data["products"])} produtos...'))
             
-            for produto in produtos:
-                self.stdout.write(f'\n  🔄 Processando: {produto.nome}')
-                
-                # Buscar tamanhos do produto
-                tamanhos = produto.tamanhos.all().order_by('tamanho')
-                
-                if not tamanhos.exists():
-                    self.stdout.write(f'    ⚠️  Produto sem tamanhos - pulando')
-                    continue
-                
-                # Construir sizes dict
-                sizes = {}
-                for tamanho in tamanhos:
-                    sizes[tamanho.tamanho] = {
-                        "product_size_id": tamanho.id,  # ✨ NOVO CAMPO PRINCIPAL
-                        "available": tamanho.esta_disponivel,  # Usa método que valida produto.ativo
-                        "qtda_estoque": tamanho.estoque,
-                        # Campos legacy preservados
-                        "stripe_link": None,
-                        "id_stripe": f"prod_{produto.json_key}_{tamanho.tamanho.lower()}"
-                    }
-                    
-                    status_icon = "✅" if tamanho.esta_disponivel else "❌"
-                    self.stdout.write(f'    {status_icon} {tamanho.tamanho}: {tamanho.estoque} unidades (ID: {tamanho.id})')
-                
-                # Construir produto completo
-                produto_data = {
-                    "id": str(produto.id),  # ID numérico do produto
-                    "title": produto.nome,
-                    "price": float(produto.preco),
-                    "preco_custo": float(produto.preco_custo),
-                    "image": image_map.get(produto.json_key, f"./img/camisetas/{produto.json_key}.jpeg"),
-                    "sizes": sizes
-                }
-                
-                # Adicionar campos extras se existirem
-                if produto.json_key in images_map:
-                    produto_data["images"] = images_map[produto.json_key]
-                
-                if produto.json_key in video_map:
-                    produto_data["video"] = video_map[produto.json_key]
+            for produto_data in products_data["products"].values():
+                self.stdout.write(f'\n  🔄 Processando: {produto_data["title"]}')
                 
-                products_data["products"][produto.json_key] = produto_data
+                for nome_tamanho, size_data in produto_data["sizes"].items():
+                    status_icon = "✅" if size_data["available"] else "❌"
+                    self.stdout.write(
+                        f'    {status_icon} {nome_tamanho}: {size_data["qtda_estoque"]} unidades '
+                        f'(ID: {size_data["product_size_id"]})'
+                    )
             
             # Salvar arquivo JSON
             output_content = json.dumps(products_data, indent=2, ensure_ascii=False)
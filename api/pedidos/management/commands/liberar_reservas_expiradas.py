@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from pedidos.models import ReservaEstoque
+import time
+
+
+class Command(BaseCommand):
+    help = 'Libera reservas de estoque do checkout online que passaram da validade'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas conta as reservas vencidas, sem alterar nada',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Quantidade de reservas liberadas por UPDATE (padrão: 1000)',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=int,
+            default=0,
+            help='Repetir a varredura a cada N segundos (padrão: 0 = executar uma vez)',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options.get('dry_run', False)
+        lote = max(1, options.get('lote', 1000))
+        intervalo = options.get('intervalo', 0)
+
+        while True:
+            self.varrer(lote, dry_run)
+            if not intervalo or dry_run:
+                break
+            time.sleep(intervalo)
+
+    def varrer(self, lote, dry_run):
+        agora = timezone.now()
+
+        # Usa o índice (status, expira_em): custo proporcional às vencidas, não à tabela
+        vencidas = ReservaEstoque.objects.filter(status='ativa', expira_em__lte=agora)
+
+        if dry_run:
+            self.stdout.write(f'🔍 [DRY RUN] {vencidas.count()} reservas vencidas seriam liberadas')
+            return 0
+
+        total = 0
+        while True:
+            ids = list(vencidas.order_by('expira_em').values_list('id', flat=True)[:lote])
+            if not ids:
+                break
+            # Repetir o filtro de status: uma reserva convertida no meio da varredura fica intacta
+            total += ReservaEstoque.objects.filter(id__in=ids, status='ativa').update(
+                status='expirada', data_atualizacao=agora
+            )
+
+        if total:
+            self.stdout.write(self.style.SUCCESS(f'✅ {total} reservas expiradas liberadas'))
+        else:
+            self.stdout.write('ℹ️  Nenhuma reserva vencida')
+        return total
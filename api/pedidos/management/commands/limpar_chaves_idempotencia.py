@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from pedidos.models import ChaveIdempotencia
+
+
+class Command(BaseCommand):
+    help = f'Remove chaves de idempotência com mais de {ChaveIdempotencia.VALIDADE_HORAS}h (reenvios depois disso criam outro pedido)'
+
+    def handle(self, *args, **options):
+        removidas = ChaveIdempotencia.limpar_expiradas()
+        if removidas:
+            self.stdout.write(self.style.SUCCESS(f'✅ {removidas} chaves de idempotência expiradas removidas'))
+        else:
+            self.stdout.write('ℹ️  Nenhuma chave de idempotência expirada')
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from pedidos.models import Comprador, normalizar_nome, somente_digitos
+
+
+class Command(BaseCommand):
+    help = 'Preenche/atualiza os campos de busca de Comprador (nome_normalizado e telefone_digitos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas conta os compradores desatualizados, sem alterar nada',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Compradores atualizados por bulk_update (padrão: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options.get('dry_run', False)
+        lote = max(1, options.get('lote', 1000))
+
+        self.stdout.write(self.style.SUCCESS('\n🔤 NORMALIZAÇÃO DOS CAMPOS DE BUSCA DE COMPRADORES'))
+
+        # Recalcula todos: nomes/telefones alterados via update() não passam pelo save()
+        pendentes = []
+        verificados = 0
+        desatualizados = 0
+        campos = ['nome_normalizado', 'telefone_digitos']
+        compradores = Comprador.objects.only('id', 'nome', 'telefone', *campos)
+        for comprador in compradores.iterator(chunk_size=lote):
+            verificados += 1
+            normalizado = normalizar_nome(comprador.nome)
+            digitos = somente_digitos(comprador.telefone)
+            if comprador.nome_normalizado == normalizado and comprador.telefone_digitos == digitos:
+                continue
+            desatualizados += 1
+            if dry_run:
+                continue
+            comprador.nome_normalizado = normalizado
+            comprador.telefone_digitos = digitos
+            pendentes.append(comprador)
+            if len(pendentes) >= lote:
+                Comprador.objects.bulk_update(pendentes, campos)
+                pendentes = []
+
+        if pendentes:
+            Comprador.objects.bulk_update(pendentes, campos)
+
+        self.stdout.write(f'   • Compradores verificados: {verificados}')
+        if dry_run:
+            self.stdout.write(f'🔍 [DRY RUN] {desatualizados} compradores seriam atualizados')
+        elif desatualizados:
+            self.stdout.write(self.style.SUCCESS(f'✅ {desatualizados} compradores atualizados'))
+        else:
+            self.stdout.write('ℹ️  Todos os compradores já estavam normalizados')
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from pedidos.mercadopago import token_configurado
+from pedidos.models import NotificacaoMercadoPago
+from pedidos.webhooks import LOTE, TENTATIVAS_MAXIMAS, processar_pendentes
+
+
+class Command(BaseCommand):
+    help = 'Processa as notificações do webhook do Mercado Pago que ficaram na fila (worker reiniciado, MP fora do ar)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=LOTE,
+            help=f'Notificações reivindicadas por vez (padrão: {LOTE})',
+        )
+
+    def handle(self, *args, **options):
+        if not token_configurado():
+            raise CommandError('❌ Token do Mercado Pago não configurado')
+        lote = max(1, options.get('lote', LOTE))
+
+        self.stdout.write(self.style.SUCCESS('\n🔔 PROCESSAMENTO DAS NOTIFICAÇÕES DO MERCADO PAGO'))
+
+        totais = {'processadas': 0, 'ignoradas': 0, 'erros': 0}
+        while True:
+            contagem = processar_pendentes(limite=lote)
+            for chave, valor in contagem.items():
+                totais[chave] += valor
+            # Lote vazio (fila drenada) ou só de erros (MP indisponível): para e tenta na próxima execução
+            if not contagem['processadas'] and not contagem['ignoradas']:
+                break
+
+        self.stdout.write(f"   • Processadas: {totais['processadas']}")
+        self.stdout.write(f"   • Ignoradas: {totais['ignoradas']}")
+        if totais['erros']:
+            self.stdout.write(self.style.WARNING(f"⚠️  {totais['erros']} com erro (voltam para a fila até {TENTATIVAS_MAXIMAS} tentativas)"))
+        restantes = NotificacaoMercadoPago.objects.filter(status='pendente').count()
+        self.stdout.write(self.style.SUCCESS(f'✅ Fila processada ({restantes} pendentes)'))
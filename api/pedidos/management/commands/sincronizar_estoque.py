@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from pedidos.models import Pedido, ItemPedido, Produto, ProdutoTamanho
+from pedidos.catalogo import montar_catalogo, mesclar_com_original
 import json
 import os
 from datetime import datetime, timedelta
@@ -385,65 +386,24 @@ class Command(BaseCommand):
     
     def gerar_products_json(self):
         """Gera o arquivo products.json atualizado"""
-        products_data = {"products": {}}
+        products_data = montar_catalogo(apenas_ativos=True)
         
-        for produto in Produto.objects.filter(ativo=True).order_by('ordem'):
-            sizes = {}
-            for tamanho in produto.tamanhos.all().order_by('tamanho'):
-                sizes[tamanho.tamanho] = {
-                    "product_size_id": tamanho.id,
-                    "available": tamanho.disponivel and tamanho.estoque > 0,
-                    "qtda_estoque": tamanho.estoque,
-                    # Campos legacy - buscar do JSON original se existir
-                    "stripe_link": None,
-                    "id_stripe": f"prod_{produto.json_key}_{tamanho.tamanho.lower()}"
-                }
-            
-            # Determinar imagem correta
-            image_map = {
-                'camiseta-marrom': './img/camisetas/camiseta_marrom.jpeg',
-                'camiseta-jesus': './img/camisetas/Camiseta_jesus.jpeg',
-                'camiseta-oneway-branca': './img/camisetas/Camiseta_onewayBranca.jpeg',
-                'camiseta-the-way': './img/camisetas/Camiseta_theway.jpeg',
-            }
-            
-            products_data["products"][produto.json_key] = {
-                "id": str(produto.id),
-                "title": produto.nome,
-                "price": float(produto.preco),
-                "preco_custo": float(produto.preco_custo),
-                "image": image_map.get(produto.json_key, f"./img/camisetas/{produto.json_key}.jpeg"),
-                "sizes": sizes
-            }
-            
-            # Adicionar campos extras se existirem no JSON original
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-            json_path = os.path.join(base_dir, 'web', 'products.json')
-            
-            # Fallback para estrutura Railway
-            if not os.path.exists(json_path):
-                json_path = '/app/web/products.json'
-                
-            # Fallback para desenvolvimento local  
-            if not os.path.exists(json_path):
-                json_path = os.path.join(os.getcwd(), 'web', 'products.json')
+        # Adicionar campos extras se existirem no JSON original
+        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        json_path = os.path.join(base_dir, 'web', 'products.json')
+        
+        # Fallback para estrutura Railway
+        if not os.path.exists(json_path):
+            json_path = '/app/web/products.json'
             
-            if os.path.exists(json_path):
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    original_data = json.load(f)
-                    original_product = original_data.get('products', {}).get(produto.json_key, {})
-                    
-                    # Preservar campos extras
-                    if 'images' in original_product:
-                        products_data["products"][produto.json_key]['images'] = original_product['images']
-                    if 'video' in original_product:
-                        products_data["products"][produto.json_key]['video'] = original_product['video']
-                    
-                    # Preservar stripe_link dos tamanhos
-                    for tamanho, tamanho_data in original_product.get('sizes', {}).items():
-                        if tamanho in sizes and 'stripe_link' in tamanho_data:
-                            sizes[tamanho]['stripe_link'] = tamanho_data['stripe_link']
-                            sizes[tamanho]['id_stripe'] = tamanho_data.get('id_stripe', sizes[tamanho]['id_stripe'])
+        # Fallback para desenvolvimento local  
+        if not os.path.exists(json_path):
+            json_path = os.path.join(os.getcwd(), 'web', 'products.json')
+        
+        if os.path.exists(json_path):
+            with open(json_path, 'r', encoding='utf-8') as f:
+                # Preserva imagens, vídeo e stripe_link do JSON original
+                mesclar_com_original(products_data, json.load(f))
         
         # Salvar o arquivo
         # Tentar primeiro na estrutura local
@@ -0,0 +1,330 @@
+"""
+Cliente HTTP do Mercado Pago usado pelas consultas de status
+
+Uma requests.Session compartilhada (conexões keep-alive em pool), timeout em
+toda chamada e novas tentativas com backoff exponencial em 429/5xx e falhas
+de conexão (respeitando Retry-After). consultar_pagamentos() consulta vários
+pedidos em paralelo num pool limitado de threads; as threads só fazem HTTP,
+quem grava no banco é o chamador, de uma vez (bulk_update).
+
+MERCADOPAGO_API_URL permite apontar para um servidor falso local.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+# (conexão, leitura) em segundos
+TIMEOUT = (3.05, 10)
+TENTATIVAS = 3
+BACKOFF = 0.5  # 0.5s, 1s, 2s...
+STATUS_REPETIR = (429, 500, 502, 503, 504)
+
+# Maior offset aceito pelo /v1/payments/search
+MAX_OFFSET = 10000
+
+
+class ErroMercadoPago(Exception):
+    pass
+
+
+def formatar_data(valor):
+    """Data no formato da API de busca (ISO 8601 com milissegundos e fuso)"""
+    if isinstance(valor, str):
+        return valor
+    return valor.isoformat(timespec='milliseconds')
+
+
+def token_configurado():
+    return getattr(settings, 'MERCADOPAGO_ACCESS_TOKEN', '') or os.environ.get('MERCADOPAGO_ACCESS_TOKEN', '')
+
+
+class ClienteMercadoPago:
+    """Cliente mínimo da API de pagamentos (GET /v1/payments/...)"""
+
+    def __init__(self, token=None, url_base=None, conexoes=None, limitador=None):
+        # limitador: chamado antes de cada requisição (ex.: cota global de chamadas)
+        self.limitador = limitador
+        self.chamadas = 0
+        self.url_base = (url_base or getattr(settings, 'MERCADOPAGO_API_URL', 'https://api.mercadopago.com')).rstrip('/')
+        conexoes = conexoes or getattr(settings, 'MERCADOPAGO_CONSULTAS_SIMULTANEAS', 8)
+
+        repetir = Retry(
+            total=TENTATIVAS,
+            backoff_factor=BACKOFF,
+            status_forcelist=STATUS_REPETIR,
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=conexoes, max_retries=repetir)
+
+        self.sessao = requests.Session()
+        self.sessao.headers['Authorization'] = f'Bearer {token or token_configurado()}'
+        self.sessao.mount('https://', adaptador)
+        self.sessao.mount('http://', adaptador)
+
+    def fechar(self):
+        self.sessao.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fechar()
+
+    def _get(self, caminho, params=None):
+        if self.limitador:
+            self.limitador()
+        self.chamadas += 1
+        try:
+            resposta = self.sessao.get(f'{self.url_base}{caminho}', params=params, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            raise ErroMercadoPago(f'Falha de conexão com o Mercado Pago: {e}') from e
+        return resposta
+
+    def buscar_pagamento(self, payment_id):
+        """Dados do pagamento, ou None se o MP não o conhece (404)"""
+        resposta = self._get(f'/v1/payments/{payment_id}')
+        if resposta.status_code == 404:
+            return None
+        if resposta.status_code != 200:
+            raise ErroMercadoPago(f'Payment ID {payment_id} não consultado (HTTP {resposta.status_code})')
+        return resposta.json()
+
+    def buscar_por_referencia(self, external_reference, limite=50):
+        """Pagamentos com a external_reference, mais recente primeiro"""
+        resposta = self._get('/v1/payments/search', {
+            'external_reference': external_reference,
+            'sort': 'date_created',
+            'criteria': 'desc',
+            'limit': limite,
+        })
+        if resposta.status_code != 200:
+            raise ErroMercadoPago(f'Erro na busca por external_reference (HTTP {resposta.status_code})')
+        return resposta.json().get('results', [])
+
+    def buscar_periodo(self, inicio, fim, limite=100):
+        """
+        Todos os pagamentos criados entre inicio e fim (datetimes com fuso),
+        paginando /v1/payments/search com offset/limit em ordem de criação
+
+        O MP não pagina além de MAX_OFFSET: ao chegar lá a busca recomeça a
+        partir da data do último pagamento recebido (repetidos são descartados)
+        """
+        vistos = set()
+        desde = inicio
+        offset = 0
+        while True:
+            resposta = self._get('/v1/payments/search', {
+                'range': 'date_created',
+                'begin_date': formatar_data(desde),
+                'end_date': formatar_data(fim),
+                'sort': 'date_created',
+                'criteria': 'asc',
+                'offset': offset,
+                'limit': limite,
+            })
+            if resposta.status_code != 200:
+                raise ErroMercadoPago(f'Erro na busca por período (HTTP {resposta.status_code})')
+            resultados = resposta.json().get('results', [])
+            for pagamento in resultados:
+                if pagamento.get('id') not in vistos:
+                    vistos.add(pagamento.get('id'))
+                    yield pagamento
+            if len(resultados) < limite:
+                return
+
+            offset += limite
+            if offset + limite > MAX_OFFSET:
+                ultimo = resultados[-1].get('date_created')
+                if not ultimo or ultimo == formatar_data(desde):
+                    raise ErroMercadoPago('Pagamentos demais no mesmo instante para paginar')
+                desde = ultimo
+                offset = 0
+
+    def consultar_pedido(self, payment_id, external_reference):
+        """
+        payment_id primeiro; se não houver ou não for encontrado, busca pela
+        external_reference (pagamento mais recente)
+
+        Retorna (payment_data, metodo, avisos); payment_data None se não achou
+        """
+        avisos = []
+        if payment_id:
+            try:
+                pagamento = self.buscar_pagamento(payment_id)
+                if pagamento is not None:
+                    return pagamento, f'payment_id: {payment_id}', avisos
+                avisos.append(f'Payment ID {payment_id} não encontrado (HTTP 404)')
+            except ErroMercadoPago as e:
+                avisos.append(str(e))
+
+        if external_reference:
+            try:
+                resultados = self.buscar_por_referencia(external_reference)
+                if resultados:
+                    return resultados[0], f'external_reference: {external_reference}', avisos
+                avisos.append(f'Nenhum pagamento encontrado com external_reference: {external_reference}')
+            except ErroMercadoPago as e:
+                avisos.append(str(e))
+
+        return None, None, avisos
+
+
+def consultar_pagamentos(pedidos, cliente=None, simultaneas=None):
+    """
+    Consulta o MP para vários pedidos em paralelo (pool limitado de threads)
+
+    Args:
+        pedidos: Objetos com id, payment_id, external_reference e forma_pagamento
+        cliente: ClienteMercadoPago (um novo, fechado ao final, se omitido)
+
+    Retorna [(pedido, payment_data, metodo, avisos)] na ordem recebida.
+    Pedidos pagos fora do MP (presencial, PayPal) não são consultados (payment_data None)
+    """
+    from .models import Pedido
+
+    simultaneas = simultaneas or getattr(settings, 'MERCADOPAGO_CONSULTAS_SIMULTANEAS', 8)
+    proprio = cliente is None
+    cliente = cliente or ClienteMercadoPago(conexoes=simultaneas)
+
+    def consultar(pedido):
+        if pedido.forma_pagamento in Pedido.FORMAS_FORA_DO_MERCADOPAGO:
+            return pedido, None, None, []
+        try:
+            return (pedido, *cliente.consultar_pedido(pedido.payment_id, pedido.external_reference))
+        except Exception as e:
+            logger.exception('Erro ao consultar pedido %s no Mercado Pago', pedido.id)
+            return pedido, None, None, [f'Erro ao consultar: {e}']
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(simultaneas, len(pedidos) or 1))) as executor:
+            return list(executor.map(consultar, pedidos))
+    finally:
+        if proprio:
+            cliente.fechar()
+
+
+def aplicar_pagamento(pedido, payment_data):
+    """
+    Copia do payment_data para o pedido (em memória) o status, o payment_id e o
+    merchant_order_id que faltarem
+
+    Retorna (campos_alterados, status_anterior)
+    """
+    alterados = []
+    status_anterior = pedido.status_pagamento
+
+    if not pedido.payment_id and payment_data.get('id'):
+        pedido.payment_id = str(payment_data['id'])
+        alterados.append('payment_id')
+
+    merchant_order_id = (payment_data.get('order') or {}).get('id')
+    if not pedido.merchant_order_id and merchant_order_id:
+        pedido.merchant_order_id = str(merchant_order_id)
+        alterados.append('merchant_order_id')
+
+    novo_status = payment_data.get('status') or pedido.status_pagamento
+    if novo_status != pedido.status_pagamento:
+        pedido.status_pagamento = novo_status
+        alterados.append('status_pagamento')
+
+    return alterados, status_anterior
+
+
+def pagamento_ignorado(pedido, payment_data):
+    """
+    Um pagamento diferente do já associado ao pedido só o substitui se vier
+    aprovado e o pedido ainda não estiver aprovado (nova tentativa do
+    comprador); senão é ignorado, para uma tentativa antiga recusada não
+    desfazer uma aprovação
+
+    Retorna o motivo ('' se o pagamento vale; nesse caso libera o payment_id
+    antigo do pedido em memória para aplicar_pagamento trocar)
+    """
+    payment_id = str(payment_data.get('id') or '')
+    if not pedido.payment_id or not payment_id or pedido.payment_id == payment_id:
+        return ''
+    if pedido.status_pagamento == 'approved' or payment_data.get('status') != 'approved':
+        return f'Pagamento {payment_id} ignorado: pedido associado ao pagamento {pedido.payment_id}'
+    pedido.payment_id = None
+    return ''
+
+
+def consultar_pagamento(payment_id, cliente=None, forcar=False):
+    """
+    Pagamento servido do PagamentoSnapshot enquanto ele for válido (status
+    final, ou consultado há menos de MERCADOPAGO_SNAPSHOT_TTL); senão consulta
+    o MP e regrava o snapshot. forcar ignora o snapshot
+
+    Retorna (payment_data, consultado_em, do_cache); payment_data None se o MP
+    não conhece o pagamento. Levanta ErroMercadoPago
+    """
+    from .models import PagamentoSnapshot
+
+    if not forcar:
+        snapshot = PagamentoSnapshot.objects.filter(payment_id=str(payment_id)).first()
+        if snapshot is not None and snapshot.valido():
+            return snapshot.dados, snapshot.consultado_em, True
+
+    proprio = cliente is None
+    cliente = cliente or ClienteMercadoPago(conexoes=1)
+    try:
+        payment_data = cliente.buscar_pagamento(payment_id)
+    finally:
+        if proprio:
+            cliente.fechar()
+    if payment_data is None:
+        return None, None, False
+    snapshot, = PagamentoSnapshot.gravar(payment_data)
+    return payment_data, snapshot.consultado_em, False
+
+
+def registrar_pagamento(payment_data, usuario='sistema', origem='mercadopago', gravar_snapshot=True):
+    """
+    Grava no pedido correspondente um pagamento consultado no MP (status,
+    payment_id, merchant_order_id) e aplica os efeitos de estoque da mudança
+
+    O pedido é achado pela external_reference do pagamento (ou pelo payment_id)
+    e travado durante a gravação; pagamentos de outra tentativa seguem
+    pagamento_ignorado(). O payload também atualiza o PagamentoSnapshot.
+
+    Retorna (pedido, campos_alterados, status_anterior, motivo); pedido None se
+    não há pedido para o pagamento, motivo explica quando nada foi aplicado
+    """
+    from django.db import transaction
+    from django.db.models import Q
+    from .models import PagamentoSnapshot, Pedido
+
+    if gravar_snapshot:
+        PagamentoSnapshot.gravar(payment_data)
+
+    payment_id = str(payment_data.get('id') or '')
+    referencia = payment_data.get('external_reference') or ''
+    condicao = Q(payment_id=payment_id) if payment_id else Q(pk__in=[])
+    if referencia:
+        condicao |= Q(external_reference=referencia)
+
+    with transaction.atomic():
+        pedido = Pedido.objects.select_for_update().filter(condicao).order_by('id').first()
+        if pedido is None:
+            return None, [], None, f'Nenhum pedido para o pagamento {payment_id} ({referencia or "sem external_reference"})'
+
+        motivo = pagamento_ignorado(pedido, payment_data)
+        if motivo:
+            return pedido, [], pedido.status_pagamento, motivo
+
+        campos, status_anterior = aplicar_pagamento(pedido, payment_data)
+        if campos:
+            pedido.save(update_fields=campos + ['data_atualizacao'])
+            pedido.aplicar_efeitos_status(status_anterior, usuario=usuario, origem=origem)
+
+    return pedido, campos, status_anterior, ''
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0013_popular_quantidade_entregue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.PositiveIntegerField(verbose_name='Quantidade')),
+                ('status', models.CharField(choices=[('ativa', 'Ativa'), ('convertida', 'Convertida em venda'), ('liberada', 'Liberada'), ('expirada', 'Expirada')], default='ativa', max_length=20, verbose_name='Status')),
+                ('expira_em', models.DateTimeField(verbose_name='Expira em')),
+                ('data_criacao', models.DateTimeField(auto_now_add=True, verbose_name='Data de Criação')),
+                ('data_atualizacao', models.DateTimeField(auto_now=True, verbose_name='Última Atualização')),
+                ('pedido', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='pedidos.pedido', verbose_name='Pedido')),
+                ('produto_tamanho', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='pedidos.produtotamanho', verbose_name='Produto/Tamanho')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Estoque',
+                'verbose_name_plural': 'Reservas de Estoque',
+                'ordering': ['-data_criacao'],
+                'indexes': [models.Index(fields=['status', 'expira_em'], name='pedidos_res_status_287935_idx'), models.Index(fields=['produto_tamanho', 'status', 'expira_em'], name='pedidos_res_produto_cda848_idx')],
+            },
+        ),
+    ]
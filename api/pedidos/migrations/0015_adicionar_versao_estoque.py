@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:19
+
+from django.db import migrations, models
+
+
+def criar_versao_inicial(apps, schema_editor):
+    """Cria a linha única do contador de versão do estoque"""
+    VersaoEstoque = apps.get_model('pedidos', 'VersaoEstoque')
+    VersaoEstoque.objects.get_or_create(pk=1, defaults={'versao': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0014_adicionar_reserva_estoque'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versao', models.BigIntegerField(default=0, verbose_name='Versão')),
+                ('data_atualizacao', models.DateTimeField(auto_now=True, verbose_name='Última Atualização')),
+            ],
+            options={
+                'verbose_name': 'Versão do Estoque',
+                'verbose_name_plural': 'Versão do Estoque',
+            },
+        ),
+        migrations.RunPython(criar_versao_inicial, reverse_code=migrations.RunPython.noop),
+    ]
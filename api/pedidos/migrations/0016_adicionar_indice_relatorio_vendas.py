@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0015_adicionar_versao_estoque'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itempedido',
+            index=models.Index(fields=['produto', 'tamanho'], name='pedidos_ite_produto_08ce2b_idx'),
+        ),
+    ]
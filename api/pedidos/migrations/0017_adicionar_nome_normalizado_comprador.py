@@ -0,0 +1,70 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:27
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar_nome(texto):
+    # Cópia de pedidos.models.normalizar_nome (migrations não devem importar o código atual)
+    if not texto:
+        return ""
+    texto_normalizado = unicodedata.normalize('NFD', texto.lower().strip())
+    return ''.join(c for c in texto_normalizado if unicodedata.category(c) != 'Mn')
+
+
+def preencher_nome_normalizado(apps, schema_editor):
+    """Preenche nome_normalizado dos compradores existentes em lotes"""
+    Comprador = apps.get_model('pedidos', 'Comprador')
+    lote = []
+    for comprador in Comprador.objects.only('id', 'nome').iterator(chunk_size=1000):
+        comprador.nome_normalizado = normalizar_nome(comprador.nome)
+        lote.append(comprador)
+        if len(lote) >= 1000:
+            Comprador.objects.bulk_update(lote, ['nome_normalizado'])
+            lote = []
+    if lote:
+        Comprador.objects.bulk_update(lote, ['nome_normalizado'])
+
+
+def criar_indice_trigram(apps, schema_editor):
+    """
+    PostgreSQL: índice GIN com pg_trgm para LIKE '%termo%' em nome_normalizado
+    Se a extensão não puder ser criada (sem permissão), a busca continua
+    funcionando, só que sem índice para termos no meio do nome
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.db import transaction
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            schema_editor.execute(
+                'CREATE INDEX IF NOT EXISTS pedidos_comprador_nome_normalizado_trgm '
+                'ON pedidos_comprador USING gin (nome_normalizado gin_trgm_ops)'
+            )
+    except Exception as e:
+        print(f'\n⚠️  Índice trigram não criado ({e}); busca por nome segue sem ele')
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS pedidos_comprador_nome_normalizado_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0016_adicionar_indice_relatorio_vendas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comprador',
+            name='nome_normalizado',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Nome normalizado'),
+        ),
+        migrations.RunPython(preencher_nome_normalizado, reverse_code=migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_trigram, reverse_code=remover_indice_trigram),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:29
+
+from django.db import migrations, models
+
+
+def preencher_telefone_digitos(apps, schema_editor):
+    """Preenche telefone_digitos dos compradores existentes em lotes"""
+    Comprador = apps.get_model('pedidos', 'Comprador')
+    lote = []
+    for comprador in Comprador.objects.only('id', 'telefone').iterator(chunk_size=1000):
+        comprador.telefone_digitos = ''.join(c for c in comprador.telefone or '' if c in '0123456789')
+        lote.append(comprador)
+        if len(lote) >= 1000:
+            Comprador.objects.bulk_update(lote, ['telefone_digitos'])
+            lote = []
+    if lote:
+        Comprador.objects.bulk_update(lote, ['telefone_digitos'])
+
+
+def criar_indice_trigram(apps, schema_editor):
+    """PostgreSQL: índice trigram para LIKE '%digitos%' (mesma regra da 0017)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.db import transaction
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            schema_editor.execute(
+                'CREATE INDEX IF NOT EXISTS pedidos_comprador_telefone_digitos_trgm '
+                'ON pedidos_comprador USING gin (telefone_digitos gin_trgm_ops)'
+            )
+    except Exception as e:
+        print(f'\n⚠️  Índice trigram não criado ({e}); busca por telefone segue sem ele')
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS pedidos_comprador_telefone_digitos_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0017_adicionar_nome_normalizado_comprador'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comprador',
+            name='telefone_digitos',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20, verbose_name='Telefone (dígitos)'),
+        ),
+        migrations.AlterField(
+            model_name='comprador',
+            name='email',
+            field=models.EmailField(db_index=True, max_length=254, verbose_name='E-mail'),
+        ),
+        migrations.RunPython(preencher_telefone_digitos, reverse_code=migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_trigram, reverse_code=remover_indice_trigram),
+    ]
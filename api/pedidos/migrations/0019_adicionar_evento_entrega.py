@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0018_adicionar_campos_busca_comprador'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoEntrega',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(max_length=100, unique=True, verbose_name='Chave de idempotência')),
+                ('item_id_informado', models.BigIntegerField(verbose_name='Item informado')),
+                ('quantidade_solicitada', models.PositiveIntegerField(verbose_name='Quantidade solicitada')),
+                ('quantidade_aplicada', models.PositiveIntegerField(default=0, verbose_name='Quantidade aplicada')),
+                ('status', models.CharField(choices=[('aplicado', 'Aplicado'), ('parcial', 'Aplicado parcialmente'), ('rejeitado', 'Rejeitado')], max_length=20, verbose_name='Status')),
+                ('motivo', models.CharField(blank=True, max_length=200, verbose_name='Motivo')),
+                ('dispositivo', models.CharField(blank=True, max_length=100, verbose_name='Dispositivo')),
+                ('usuario', models.CharField(blank=True, max_length=100, verbose_name='Usuário')),
+                ('registrado_em', models.DateTimeField(verbose_name='Registrado no dispositivo em')),
+                ('recebido_em', models.DateTimeField(auto_now_add=True, verbose_name='Recebido em')),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='eventos_entrega', to='pedidos.itempedido', verbose_name='Item')),
+            ],
+            options={
+                'verbose_name': 'Evento de Entrega (offline)',
+                'verbose_name_plural': 'Eventos de Entrega (offline)',
+                'ordering': ['-recebido_em'],
+            },
+        ),
+    ]
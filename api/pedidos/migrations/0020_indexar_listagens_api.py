@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0019_adicionar_evento_entrega'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comprador',
+            index=models.Index(fields=['data_cadastro', 'id'], name='pedidos_com_data_ca_c476c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['data_pedido', 'id'], name='pedidos_ped_data_pe_fc0fb2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['status_pagamento', 'data_pedido'], name='pedidos_ped_status__877482_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['forma_pagamento', 'data_pedido'], name='pedidos_ped_forma_p_731560_idx'),
+        ),
+    ]
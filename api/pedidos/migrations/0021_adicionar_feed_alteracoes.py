@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0020_indexar_listagens_api'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroExclusao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('pedido', 'Pedido'), ('item', 'Item do Pedido')], max_length=10, verbose_name='Tipo')),
+                ('objeto_id', models.BigIntegerField(verbose_name='ID excluído')),
+                ('pedido_id', models.BigIntegerField(blank=True, null=True, verbose_name='Pedido')),
+                ('excluido_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Excluído em')),
+            ],
+            options={
+                'verbose_name': 'Registro de Exclusão',
+                'verbose_name_plural': 'Registros de Exclusão',
+                'ordering': ['excluido_em', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='itempedido',
+            name='data_atualizacao',
+            field=models.DateTimeField(auto_now=True, verbose_name='Última Atualização'),
+        ),
+        migrations.AddIndex(
+            model_name='itempedido',
+            index=models.Index(fields=['data_atualizacao', 'id'], name='pedidos_ite_data_at_1b4d26_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['data_atualizacao', 'id'], name='pedidos_ped_data_at_99b569_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroexclusao',
+            index=models.Index(fields=['excluido_em', 'id'], name='pedidos_reg_excluid_c33ab4_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0021_adicionar_feed_alteracoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChaveIdempotencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('escopo', models.CharField(max_length=50, verbose_name='Escopo')),
+                ('chave', models.CharField(max_length=255, verbose_name='Chave')),
+                ('hash_requisicao', models.CharField(max_length=64, verbose_name='Hash da requisição')),
+                ('status_http', models.PositiveSmallIntegerField(verbose_name='Status HTTP')),
+                ('resposta', models.JSONField(verbose_name='Resposta')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Criado em')),
+            ],
+            options={
+                'verbose_name': 'Chave de Idempotência',
+                'verbose_name_plural': 'Chaves de Idempotência',
+                'unique_together': {('escopo', 'chave')},
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+
+def mesclar_compradores_duplicados(apps, schema_editor):
+    """
+    Prepara o índice único de e-mail: grava todos os e-mails em minúsculas e
+    junta compradores com o mesmo e-mail. Fica o cadastro mais antigo, com o
+    nome/telefone do mais recente; os pedidos dos duplicados passam para ele
+    """
+    from collections import defaultdict
+    from django.db.models import Count
+    from django.db.models.functions import Lower, Trim
+
+    Comprador = apps.get_model('pedidos', 'Comprador')
+    Pedido = apps.get_model('pedidos', 'Pedido')
+
+    duplicados = (
+        Comprador.objects.annotate(email_normalizado=Lower(Trim('email')))
+        .values('email_normalizado')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('email_normalizado', flat=True)
+    )
+    emails = set(duplicados)
+
+    grupos = defaultdict(list)
+    if emails:
+        compradores = (
+            Comprador.objects.annotate(email_normalizado=Lower(Trim('email')))
+            .filter(email_normalizado__in=emails)
+            .order_by('data_cadastro', 'id')
+        )
+        for comprador in compradores:
+            grupos[comprador.email_normalizado].append(comprador)
+
+    removidos = 0
+    pedidos_movidos = 0
+    for email, compradores in grupos.items():
+        mantido, mais_recente = compradores[0], compradores[-1]
+        outros = [comprador.id for comprador in compradores[1:]]
+        pedidos_movidos += Pedido.objects.filter(comprador_id__in=outros).update(comprador_id=mantido.id)
+        removidos += Comprador.objects.filter(id__in=outros).delete()[0]
+        mantido.nome = mais_recente.nome
+        mantido.telefone = mais_recente.telefone
+        mantido.nome_normalizado = mais_recente.nome_normalizado
+        mantido.telefone_digitos = mais_recente.telefone_digitos
+        mantido.save(update_fields=['nome', 'telefone', 'nome_normalizado', 'telefone_digitos'])
+
+    # Nenhum e-mail repetido restou: pode gravar todos normalizados
+    atualizados = Comprador.objects.exclude(email=Lower(Trim('email'))).update(email=Lower(Trim('email')))
+
+    if grupos or atualizados:
+        print(
+            f'\n✅ {len(grupos)} e-mails duplicados mesclados ({removidos} compradores removidos, '
+            f'{pedidos_movidos} pedidos movidos); {atualizados} e-mails normalizados'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0022_adicionar_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.RunPython(mesclar_compradores_duplicados, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0023_mesclar_compradores_duplicados'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comprador',
+            name='email',
+            field=models.EmailField(max_length=254, unique=True, verbose_name='E-mail'),
+        ),
+    ]
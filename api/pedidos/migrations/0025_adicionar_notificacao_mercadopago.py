@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0024_tornar_email_comprador_unico'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificacaoMercadoPago',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notificacao_id', models.CharField(max_length=100, unique=True, verbose_name='ID da notificação')),
+                ('tipo', models.CharField(max_length=50, verbose_name='Tipo')),
+                ('acao', models.CharField(blank=True, max_length=50, verbose_name='Ação')),
+                ('recurso_id', models.CharField(max_length=50, verbose_name='ID do recurso')),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('processada', 'Processada'), ('ignorada', 'Ignorada'), ('erro', 'Erro')], default='pendente', max_length=20, verbose_name='Status')),
+                ('tentativas', models.PositiveSmallIntegerField(default=0, verbose_name='Tentativas')),
+                ('resultado', models.TextField(blank=True, verbose_name='Resultado')),
+                ('payload', models.JSONField(default=dict, verbose_name='Payload')),
+                ('recebida_em', models.DateTimeField(auto_now_add=True, verbose_name='Recebida em')),
+                ('atualizada_em', models.DateTimeField(auto_now=True, verbose_name='Atualizada em')),
+                ('pedido', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notificacoes_mp', to='pedidos.pedido', verbose_name='Pedido')),
+            ],
+            options={
+                'verbose_name': 'Notificação Mercado Pago',
+                'verbose_name_plural': 'Notificações Mercado Pago',
+                'ordering': ['-recebida_em'],
+                'indexes': [models.Index(fields=['status', 'atualizada_em'], name='pedidos_notif_mp_fila_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:50
+
+from django.db import migrations, models
+
+
+def agendar_pedidos_em_aberto(apps, schema_editor):
+    """Coloca na fila os pedidos de gateway ainda em aberto dos últimos 3 dias"""
+    from datetime import timedelta
+    from django.utils import timezone
+
+    Pedido = apps.get_model('pedidos', 'Pedido')
+    agora = timezone.now()
+    Pedido.objects.filter(
+        status_pagamento__in=['pending', 'in_process'],
+        data_pedido__gte=agora - timedelta(days=3),
+    ).exclude(forma_pagamento__in=['presencial', 'paypal', 'paypal_3x']).update(proxima_conciliacao=agora)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0025_adicionar_notificacao_mercadopago'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CotaMercadoPago',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('janela_inicio', models.DateTimeField(verbose_name='Início da janela')),
+                ('chamadas', models.PositiveIntegerField(default=0, verbose_name='Chamadas na janela')),
+            ],
+            options={
+                'verbose_name': 'Cota do Mercado Pago',
+                'verbose_name_plural': 'Cota do Mercado Pago',
+            },
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='proxima_conciliacao',
+            field=models.DateTimeField(blank=True, help_text='Quando o status será conferido de novo no Mercado Pago (vazio = fora da fila)', null=True, verbose_name='Próxima conciliação'),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='tentativas_conciliacao',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Tentativas de conciliação'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(condition=models.Q(('proxima_conciliacao__isnull', False)), fields=['proxima_conciliacao'], name='pedidos_conciliacao_fila_idx'),
+        ),
+        migrations.RunPython(agendar_pedidos_em_aberto, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0026_adicionar_fila_conciliacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PagamentoSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=50, unique=True, verbose_name='ID Pagamento MP')),
+                ('status', models.CharField(blank=True, max_length=20, verbose_name='Status no MP')),
+                ('dados', models.JSONField(verbose_name='Payload')),
+                ('consultado_em', models.DateTimeField(verbose_name='Consultado em')),
+            ],
+            options={
+                'verbose_name': 'Snapshot de Pagamento MP',
+                'verbose_name_plural': 'Snapshots de Pagamentos MP',
+            },
+        ),
+    ]
@@ -1,6 +1,135 @@
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
+import logging
+import os
+import threading
+import time
+import unicodedata
+
+
+logger = logging.getLogger(__name__)
+
+
+def _update_aceita_returning(connection):
+    """
+    UPDATE ... RETURNING: PostgreSQL e SQLite >= 3.35 (as features do Django
+    só descrevem RETURNING em INSERT, então a checagem é explícita)
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+class VersaoEstoque(models.Model):
+    """
+    Contador global de versão do estoque/catálogo (linha única)
+    Toda mutação de estoque, preço ou disponibilidade incrementa a versão;
+    caches por processo comparam a versão para saber quando reconstruir
+    """
+    ID_UNICO = 1
+    
+    versao = models.BigIntegerField(default=0, verbose_name="Versão")
+    data_atualizacao = models.DateTimeField(auto_now=True, verbose_name="Última Atualização")
+    
+    class Meta:
+        verbose_name = "Versão do Estoque"
+        verbose_name_plural = "Versão do Estoque"
+    
+    def __str__(self):
+        return f"Estoque v{self.versao}"
+    
+    @classmethod
+    def incrementar(cls):
+        """
+        Invalida os caches de estoque de todos os workers
+        O UPDATE da linha única roda depois do commit (fora de um atomic, na
+        hora): dentro da transação de estoque ele travaria a linha até o fim e
+        serializaria (ou levaria a deadlock) as vendas simultâneas
+        """
+        from django.db import transaction
+        transaction.on_commit(cls._aplicar_incremento, robust=True)
+    
+    @classmethod
+    def _aplicar_incremento(cls):
+        atualizados = cls.objects.filter(pk=cls.ID_UNICO).update(
+            versao=models.F('versao') + 1,
+            data_atualizacao=timezone.now()
+        )
+        if not atualizados:
+            cls.objects.get_or_create(pk=cls.ID_UNICO, defaults={'versao': 1})
+        
+        # Regrava o products.json (rajadas viram uma gravação só)
+        from .catalogo import agendar_products_json
+        agendar_products_json()
+    
+    @classmethod
+    def atual(cls):
+        """Versão atual (uma query por chave primária)"""
+        return cls.objects.filter(pk=cls.ID_UNICO).values_list('versao', flat=True).first() or 0
+
+
+class CotaMercadoPago(models.Model):
+    """
+    Limite global de chamadas à API do Mercado Pago (linha única, janela de 1 minuto)
+    Compartilhado por todos os workers de conciliação: cada chamada reserva uma
+    unidade com um UPDATE condicional; sem cota, o worker espera a próxima janela
+    """
+    ID_UNICO = 1
+    JANELA = timedelta(minutes=1)
+    
+    janela_inicio = models.DateTimeField(verbose_name="Início da janela")
+    chamadas = models.PositiveIntegerField(default=0, verbose_name="Chamadas na janela")
+    
+    class Meta:
+        verbose_name = "Cota do Mercado Pago"
+        verbose_name_plural = "Cota do Mercado Pago"
+    
+    def __str__(self):
+        return f"{self.chamadas} chamadas desde {self.janela_inicio:%H:%M:%S}"
+    
+    @classmethod
+    def reservar(cls, limite, quantidade=1):
+        """
+        Tenta reservar `quantidade` chamadas na janela atual (um UPDATE)
+        Retorna 0 se conseguiu, ou os segundos até a próxima janela
+        """
+        agora = timezone.now()
+        vencida = models.Q(janela_inicio__lte=agora - cls.JANELA)
+        atualizados = cls.objects.filter(pk=cls.ID_UNICO).filter(
+            vencida | models.Q(chamadas__lte=limite - quantidade)
+        ).update(
+            chamadas=models.Case(
+                models.When(vencida, then=models.Value(quantidade)),
+                default=models.F('chamadas') + quantidade,
+            ),
+            janela_inicio=models.Case(
+                models.When(vencida, then=models.Value(agora)),
+                default=models.F('janela_inicio'),
+            ),
+        )
+        if atualizados:
+            return 0
+        
+        inicio = cls.objects.filter(pk=cls.ID_UNICO).values_list('janela_inicio', flat=True).first()
+        if inicio is None:
+            cls.objects.get_or_create(pk=cls.ID_UNICO, defaults={'janela_inicio': agora - cls.JANELA})
+            return cls.reservar(limite, quantidade)
+        return max(0.05, (inicio + cls.JANELA - agora).total_seconds())
+    
+    @classmethod
+    def aguardar(cls, limite, quantidade=1):
+        """Bloqueia até conseguir reservar `quantidade` chamadas"""
+        while True:
+            espera = cls.reservar(limite, quantidade)
+            if not espera:
+                return
+            time.sleep(espera)
 
 
 class Produto(models.Model):
@@ -21,6 +150,11 @@ class Produto(models.Model):
     def __str__(self):
         return self.nome
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Preço/ativo fazem parte do cache de estoque
+        VersaoEstoque.incrementar()
+    
     @property
     def estoque_total(self):
         """Retorna o estoque total somando todos os tamanhos"""
@@ -71,19 +205,80 @@ class ProdutoTamanho(models.Model):
     def __str__(self):
         return f"{self.produto.nome} - {self.tamanho}"
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        VersaoEstoque.incrementar()
+    
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        VersaoEstoque.incrementar()
+        return resultado
+    
     @property
     def esta_disponivel(self):
         """Verifica se o produto está disponível para venda"""
         return self.disponivel and self.estoque > 0 and self.produto.ativo
     
+    def _aplicar_delta_estoque(self, delta):
+        """
+        Soma `delta` ao estoque num único UPDATE condicional (nunca deixa o
+        estoque negativo) e ajusta `disponivel` no mesmo comando.
+        Retorna (estoque, disponivel) lidos do próprio banco ou None se não havia saldo.
+        Deve ser chamado dentro de transaction.atomic()
+        """
+        from django.db import connection
+        
+        tabela = connection.ops.quote_name(self._meta.db_table)
+        if delta < 0:
+            # Esgotou: marcar indisponível
+            disponivel_sql = "CASE WHEN estoque + %s <= 0 THEN %s ELSE disponivel END"
+            disponivel_params = [delta, False]
+        else:
+            # Voltou a ter estoque: reativar
+            disponivel_sql = "CASE WHEN estoque + %s > 0 THEN %s ELSE disponivel END"
+            disponivel_params = [delta, True]
+        
+        # Em UPDATE as expressões enxergam o valor ANTERIOR da linha (PostgreSQL e SQLite)
+        sql = (
+            f"UPDATE {tabela} SET estoque = estoque + %s, disponivel = {disponivel_sql} "
+            f"WHERE id = %s AND estoque + %s >= 0"
+        )
+        params = [delta, *disponivel_params, self.pk, delta]
+        
+        with connection.cursor() as cursor:
+            if _update_aceita_returning(connection):
+                cursor.execute(sql + " RETURNING estoque, disponivel", params)
+                row = cursor.fetchone()
+            else:
+                cursor.execute(sql, params)
+                row = None
+                if cursor.rowcount:
+                    row = type(self).objects.filter(pk=self.pk).values_list('estoque', 'disponivel').get()
+        
+        if row is None:
+            return None
+        return row[0], bool(row[1])
+    
     def decrementar_estoque(self, quantidade=1, pedido=None, usuario="", observacao="", origem=""):
         """
         Decrementa o estoque e atualiza disponibilidade se necessário
         Registra automaticamente a movimentação no histórico
+        
+        O decremento é um UPDATE condicional (estoque >= quantidade): dois checkouts
+        simultâneos no mesmo tamanho nunca vendem a mesma unidade
         """
-        if self.estoque >= quantidade:
-            # Registrar movimentação ANTES de alterar o estoque
-            from .models import MovimentacaoEstoque
+        if quantidade <= 0:
+            return False
+        
+        from django.db import transaction
+        from .models import MovimentacaoEstoque
+        
+        with transaction.atomic():
+            resultado = self._aplicar_delta_estoque(-quantidade)
+            if resultado is None:
+                return False
+            estoque_posterior, disponivel = resultado
+            
             MovimentacaoEstoque.registrar_movimentacao(
                 produto_tamanho=self,
                 tipo='saida',
@@ -91,16 +286,182 @@ class ProdutoTamanho(models.Model):
                 pedido=pedido,
                 usuario=usuario,
                 observacao=observacao or f"Decremento de estoque: {quantidade} unidade(s)",
-                origem=origem or 'decrementar_estoque'
+                origem=origem or 'decrementar_estoque',
+                estoque_anterior=estoque_posterior + quantidade
             )
             
-            # Atualizar estoque
-            self.estoque -= quantidade
-            if self.estoque == 0:
-                self.disponivel = False
-            self.save()
-            return True
-        return False
+            if pedido is not None:
+                from .models import ReservaEstoque
+                ReservaEstoque.converter_reservas(pedido, [self.pk])
+            
+            VersaoEstoque.incrementar()
+        
+        # Refletir na instância os valores reais do banco
+        self.estoque = estoque_posterior
+        self.disponivel = disponivel
+        return True
+    
+    @classmethod
+    def decrementar_estoque_lote(cls, itens, pedido=None, usuario="", observacao="", origem=""):
+        """
+        Decrementa o estoque de vários tamanhos de uma vez (tudo ou nada)
+        Registra as movimentações no histórico com um único INSERT
+        
+        Args:
+            itens: Lista de (product_size_id, quantidade); ids repetidos são somados
+            pedido, usuario, observacao, origem: Gravados em cada movimentação
+        
+        Retorna (sucesso, resultados) com um dict por product_size_id.
+        Custo constante: 1 SELECT ... FOR UPDATE, 1 UPDATE e 1 INSERT, independente
+        do número de itens. As linhas são travadas sempre em ordem de id, então
+        checkouts concorrentes com os mesmos tamanhos não entram em deadlock
+        
+        Reservas ativas de outros pedidos (ReservaEstoque) não podem ser consumidas;
+        as do próprio pedido são convertidas em venda e o pedido é marcado com
+        estoque_decrementado, tudo na mesma transação. Pedido já decrementado
+        (Pedido.reivindicar_decremento) não toca no estoque: retorna sucesso com
+        ja_decrementado=True em cada resultado
+        """
+        from functools import reduce
+        import operator
+        from django.db import transaction
+        from django.db.models import Case, F, Q, Value, When
+        from .models import MovimentacaoEstoque, ReservaEstoque
+        
+        # Somar quantidades de ids repetidos
+        solicitados = {}
+        for product_size_id, quantidade in itens:
+            solicitados[product_size_id] = solicitados.get(product_size_id, 0) + quantidade
+        
+        if not solicitados:
+            return False, []
+        
+        with transaction.atomic():
+            # O pedido é travado antes dos tamanhos (mesma ordem de registrar_pagamento)
+            if pedido is not None and not pedido.reivindicar_decremento():
+                # Já decrementado por outro caminho: as reservas restantes ficam sem efeito
+                ReservaEstoque.converter_reservas(pedido, solicitados.keys())
+                return True, [
+                    {
+                        'product_size_id': product_size_id,
+                        'quantidade_solicitada': quantidade,
+                        'ok': True,
+                        'ja_decrementado': True,
+                    }
+                    for product_size_id, quantidade in solicitados.items()
+                ]
+            
+            tamanhos = {
+                tamanho.id: tamanho
+                for tamanho in cls.objects.select_for_update(of=('self',))
+                .select_related('produto')
+                .filter(id__in=solicitados.keys())
+                .order_by('id')
+            }
+            
+            reservado = ReservaEstoque.quantidades_reservadas(tamanhos.keys(), excluir_pedido=pedido)
+            
+            # Validar todas as linhas em memória antes de escrever qualquer coisa
+            sucesso = True
+            resultados = []
+            for product_size_id, quantidade in solicitados.items():
+                tamanho = tamanhos.get(product_size_id)
+                resultado = {
+                    'product_size_id': product_size_id,
+                    'quantidade_solicitada': quantidade,
+                    'ok': False,
+                }
+                if tamanho is None:
+                    resultado['erro'] = f'Produto com ID {product_size_id} não encontrado'
+                elif quantidade <= 0:
+                    resultado['erro'] = f'{tamanho}: Quantidade inválida ({quantidade})'
+                elif tamanho.estoque - reservado.get(tamanho.id, 0) < quantidade:
+                    resultado['erro'] = (
+                        f'{tamanho}: Estoque insuficiente '
+                        f'(disponível: {max(0, tamanho.estoque - reservado.get(tamanho.id, 0))}, '
+                        f'solicitado: {quantidade})'
+                    )
+                else:
+                    resultado['ok'] = True
+                
+                if tamanho is not None:
+                    resultado.update({
+                        'produto_nome': tamanho.produto.nome,
+                        'tamanho': tamanho.tamanho,
+                        'estoque_disponivel': max(0, tamanho.estoque - reservado.get(tamanho.id, 0)),
+                    })
+                
+                sucesso = sucesso and resultado['ok']
+                resultados.append(resultado)
+            
+            if not sucesso:
+                # Desfaz a marcação do pedido
+                transaction.set_rollback(True)
+                return False, resultados
+            
+            # Um único UPDATE para todos os tamanhos; a condição estoque >= quantidade
+            # continua valendo mesmo em bancos sem FOR UPDATE (SQLite)
+            condicao = reduce(operator.or_, (
+                Q(id=product_size_id, estoque__gte=quantidade)
+                for product_size_id, quantidade in solicitados.items()
+            ))
+            atualizados = cls.objects.filter(condicao).update(
+                estoque=F('estoque') - Case(
+                    *[When(id=product_size_id, then=Value(quantidade))
+                      for product_size_id, quantidade in solicitados.items()],
+                    output_field=models.IntegerField()
+                ),
+                disponivel=Case(
+                    *[When(id=product_size_id, estoque__lte=quantidade, then=Value(False))
+                      for product_size_id, quantidade in solicitados.items()],
+                    default=F('disponivel'),
+                    output_field=models.BooleanField()
+                )
+            )
+            
+            if atualizados != len(solicitados):
+                # Estoque mudou entre a leitura e a escrita: desfazer tudo
+                transaction.set_rollback(True)
+                for resultado in resultados:
+                    resultado['ok'] = False
+                    resultado['erro'] = 'Estoque alterado durante o processamento, tente novamente'
+                return False, resultados
+            
+            movimentacoes = []
+            for resultado in resultados:
+                tamanho = tamanhos[resultado['product_size_id']]
+                quantidade = resultado['quantidade_solicitada']
+                estoque_anterior = tamanho.estoque
+                
+                tamanho.estoque = estoque_anterior - quantidade
+                if tamanho.estoque <= 0:
+                    tamanho.disponivel = False
+                
+                movimentacoes.append(MovimentacaoEstoque(
+                    produto_tamanho=tamanho,
+                    pedido=pedido,
+                    tipo='saida',
+                    quantidade=-quantidade,
+                    estoque_anterior=estoque_anterior,
+                    estoque_posterior=tamanho.estoque,
+                    usuario=usuario,
+                    observacao=observacao or f"Decremento de estoque: {quantidade} unidade(s)",
+                    origem=origem or 'decrementar_estoque_lote'
+                ))
+                resultado.update({
+                    'quantidade_decrementada': quantidade,
+                    'estoque_restante': tamanho.estoque,
+                    'ainda_disponivel': tamanho.disponivel,
+                })
+            
+            MovimentacaoEstoque.objects.bulk_create(movimentacoes)
+            
+            if pedido is not None:
+                ReservaEstoque.converter_reservas(pedido, solicitados.keys())
+            
+            VersaoEstoque.incrementar()
+        
+        return True, resultados
     
     def incrementar_estoque(self, quantidade=1, pedido=None, usuario="", observacao="", origem=""):
         """
@@ -108,24 +469,32 @@ class ProdutoTamanho(models.Model):
         Registra automaticamente a movimentação no histórico
         """
         if quantidade > 0:
-            # Registrar movimentação ANTES de alterar o estoque
+            from django.db import transaction
             from .models import MovimentacaoEstoque
-            MovimentacaoEstoque.registrar_movimentacao(
-                produto_tamanho=self,
-                tipo='entrada',
-                quantidade=quantidade,
-                pedido=pedido,
-                usuario=usuario,
-                observacao=observacao or f"Incremento de estoque: {quantidade} unidade(s)",
-                origem=origem or 'incrementar_estoque'
-            )
             
-            # Atualizar estoque
-            self.estoque += quantidade
-            # Reativar produto se estava indisponível e agora tem estoque
-            if not self.disponivel and self.estoque > 0:
-                self.disponivel = True
-            self.save()
+            # Mesmo UPDATE atômico do decremento, para não sobrescrever vendas concorrentes
+            with transaction.atomic():
+                resultado = self._aplicar_delta_estoque(quantidade)
+                if resultado is None:
+                    # Tamanho removido do banco depois de carregado
+                    return False
+                estoque_posterior, disponivel = resultado
+                
+                MovimentacaoEstoque.registrar_movimentacao(
+                    produto_tamanho=self,
+                    tipo='entrada',
+                    quantidade=quantidade,
+                    pedido=pedido,
+                    usuario=usuario,
+                    observacao=observacao or f"Incremento de estoque: {quantidade} unidade(s)",
+                    origem=origem or 'incrementar_estoque',
+                    estoque_anterior=estoque_posterior - quantidade
+                )
+                
+                VersaoEstoque.incrementar()
+            
+            self.estoque = estoque_posterior
+            self.disponivel = disponivel
             return True
         return False
     
@@ -157,20 +526,209 @@ class ProdutoTamanho(models.Model):
         return False
 
 
+def normalizar_nome(texto):
+    """Minúsculas e sem acentos, para busca insensível a acentos ("João" -> "joao")"""
+    if not texto:
+        return ""
+    # Normalizar caracteres unicode (NFD) e remover acentos
+    texto_normalizado = unicodedata.normalize('NFD', texto.lower().strip())
+    # Remover caracteres de combinação (acentos)
+    return ''.join(c for c in texto_normalizado if unicodedata.category(c) != 'Mn')
+
+
+def somente_digitos(texto):
+    """Só os dígitos de um texto ("(16) 99314-1115" -> "16993141115")"""
+    return ''.join(c for c in (texto or '') if c in '0123456789')
+
+
+def normalizar_email(email):
+    """E-mail como é gravado e comparado: sem espaços e em minúsculas"""
+    return (email or '').strip().lower()
+
+
+_ALFABETO_ULID = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # base32 de Crockford
+_ultimo_ulid = (0, 0)
+_ulid_lock = threading.Lock()
+
+
+def gerar_ulid():
+    """
+    Identificador de 26 caracteres no formato ULID: 48 bits de milissegundos +
+    80 bits aleatórios. Ordena pelo tempo como texto e não colide entre
+    processos; no mesmo milissegundo o mesmo processo só incrementa a parte
+    aleatória, então a ordem também vale dentro do processo
+    """
+    global _ultimo_ulid
+    with _ulid_lock:
+        milissegundos = int(time.time() * 1000)
+        ultimo_ms, ultimo_aleatorio = _ultimo_ulid
+        if milissegundos <= ultimo_ms and ultimo_aleatorio < (1 << 80) - 1:
+            milissegundos, aleatorio = ultimo_ms, ultimo_aleatorio + 1
+        else:
+            aleatorio = int.from_bytes(os.urandom(10), 'big')
+        _ultimo_ulid = (milissegundos, aleatorio)
+    
+    valor = (milissegundos << 80) | aleatorio
+    return ''.join(_ALFABETO_ULID[(valor >> deslocamento) & 31] for deslocamento in range(125, -1, -5))
+
+
+def gerar_referencia(prefixo='ONEWAY'):
+    """external_reference única e ordenada pelo tempo ("PRESENCIAL-01J0Z...")"""
+    return f'{prefixo}-{gerar_ulid()}'
+
+
 class Comprador(models.Model):
     nome = models.CharField(max_length=100, verbose_name="Nome")
-    email = models.EmailField(verbose_name="E-mail")
+    # Preenchido no save(); compradores antigos: python manage.py normalizar_nomes_compradores
+    nome_normalizado = models.CharField(
+        max_length=100,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name="Nome normalizado"
+    )
+    # Único e sempre em minúsculas (normalizar_email): um comprador por e-mail
+    email = models.EmailField(unique=True, verbose_name="E-mail")
     telefone = models.CharField(max_length=20, verbose_name="Telefone")
+    # Só os dígitos do telefone, para buscar "16993141115" em "(16) 99314-1115"
+    telefone_digitos = models.CharField(
+        max_length=20,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name="Telefone (dígitos)"
+    )
     data_cadastro = models.DateTimeField(auto_now_add=True, verbose_name="Data de Cadastro")
 
+    # Abaixo disso o índice trigram do PostgreSQL não ajuda; usa prefixo (índice btree)
+    TAMANHO_MINIMO_TRIGRAM = 3
+
     class Meta:
         verbose_name = "Comprador"
         verbose_name_plural = "Compradores"
         ordering = ['-data_cadastro']
+        indexes = [
+            # Ordem do cursor da listagem da API
+            models.Index(fields=['data_cadastro', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.nome} ({self.email})"
 
+    def save(self, *args, **kwargs):
+        self.email = normalizar_email(self.email)
+        self.nome_normalizado = normalizar_nome(self.nome)
+        self.telefone_digitos = somente_digitos(self.telefone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if 'nome' in update_fields:
+                update_fields.add('nome_normalizado')
+            if 'telefone' in update_fields:
+                update_fields.add('telefone_digitos')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def registrar(cls, nome, email, telefone):
+        """
+        Cria o comprador pelo e-mail ou atualiza nome/telefone do existente
+        
+        Comprador conhecido e sem mudanças (o caso comum): 1 SELECT pelo índice
+        único, nenhuma escrita. Com mudança: 1 UPDATE só dos campos alterados.
+        Comprador novo: 1 INSERT ... ON CONFLICT (email) DO UPDATE, então dois
+        primeiros pedidos simultâneos do mesmo e-mail não criam duplicata.
+        
+        Retorna (comprador, criado)
+        """
+        email = normalizar_email(email)
+        comprador = cls.objects.filter(email=email).first()
+        
+        if comprador is None:
+            comprador = cls(
+                nome=nome,
+                email=email,
+                telefone=telefone,
+                nome_normalizado=normalizar_nome(nome),
+                telefone_digitos=somente_digitos(telefone),
+            )
+            cls.objects.bulk_create(
+                [comprador],
+                update_conflicts=True,
+                unique_fields=['email'],
+                update_fields=['nome', 'telefone', 'nome_normalizado', 'telefone_digitos'],
+            )
+            if comprador.pk is None:
+                # Banco sem RETURNING no upsert
+                comprador = cls.objects.get(email=email)
+            return comprador, True
+        
+        alterados = []
+        if comprador.nome != nome:
+            comprador.nome = nome
+            alterados.append('nome')
+        if comprador.telefone != telefone:
+            comprador.telefone = telefone
+            alterados.append('telefone')
+        if alterados:
+            comprador.save(update_fields=alterados)
+        return comprador, False
+
+    @classmethod
+    def buscar_por_nome(cls, termo):
+        """
+        Compradores cujo nome contém o termo, sem diferenciar acentos/maiúsculas
+
+        Consulta só a coluna nome_normalizado: termos curtos usam prefixo (índice
+        btree, LIKE 'x%'); a partir de TAMANHO_MINIMO_TRIGRAM caracteres busca em
+        qualquer parte do nome (LIKE '%x%', servido pelo índice trigram no PostgreSQL)
+        """
+        termo_normalizado = normalizar_nome(termo)
+        if not termo_normalizado:
+            return cls.objects.none()
+        if len(termo_normalizado) < cls.TAMANHO_MINIMO_TRIGRAM:
+            return cls.objects.filter(nome_normalizado__startswith=termo_normalizado)
+        return cls.objects.filter(nome_normalizado__contains=termo_normalizado)
+
+
+    @classmethod
+    def buscar(cls, termo):
+        """
+        Busca rápida do balcão de retirada: nome, e-mail, telefone, número do
+        pedido ou external_reference. Cada critério usa um índice próprio:
+        nome_normalizado/telefone_digitos (prefixo ou trigram), prefixo do
+        e-mail, chave primária do pedido e prefixo do external_reference
+        """
+        termo = (termo or '').strip()
+        termo_normalizado = normalizar_nome(termo)
+        if not termo_normalizado:
+            return cls.objects.none()
+
+        curto = len(termo_normalizado) < cls.TAMANHO_MINIMO_TRIGRAM
+        filtro = models.Q(**{
+            'nome_normalizado__startswith' if curto else 'nome_normalizado__contains': termo_normalizado
+        })
+
+        if '@' in termo or not curto:
+            filtro |= models.Q(email__startswith=termo.lower())
+
+        pedidos = models.Q(external_reference__startswith=termo) if not curto else models.Q()
+        digitos = somente_digitos(termo)
+        # Telefone digitado com ou sem formatação: "(16) 99314", "16 99314-1115"
+        if digitos and not set(termo) - set('0123456789()+-. '):
+            filtro |= models.Q(**{
+                'telefone_digitos__startswith' if len(digitos) < cls.TAMANHO_MINIMO_TRIGRAM
+                else 'telefone_digitos__contains': digitos
+            })
+            # Número do pedido (até 18 dígitos cabe em BigAutoField)
+            if termo == digitos and len(digitos) <= 18:
+                pedidos |= models.Q(id=int(digitos))
+
+        if pedidos:
+            filtro |= models.Q(id__in=Pedido.objects.filter(pedidos).values('comprador_id'))
+
+        return cls.objects.filter(filtro)
+
 
 class Pedido(models.Model):
     PRODUTOS_CHOICES = [
@@ -215,6 +773,19 @@ class Pedido(models.Model):
         ('cancelled', 'Cancelado'),
         ('refunded', 'Reembolsado'),
     ]
+    STATUS_EM_ABERTO = ('pending', 'in_process')
+    # Formas de pagamento que não passam pelo Mercado Pago (fora da conciliação)
+    FORMAS_FORA_DO_MERCADOPAGO = ('presencial', 'paypal', 'paypal_3x')
+    
+    # Intervalos entre conferências no Mercado Pago enquanto o pagamento está em aberto
+    INTERVALOS_CONCILIACAO = [
+        timedelta(minutes=1),
+        timedelta(minutes=5),
+        timedelta(minutes=30),
+        timedelta(hours=2),
+        timedelta(hours=6),
+        timedelta(hours=24),
+    ]
 
     # Dados do Pedido
     comprador = models.ForeignKey(Comprador, on_delete=models.CASCADE, verbose_name="Comprador")
@@ -276,11 +847,34 @@ class Pedido(models.Model):
         verbose_name="Usuário que enviou o email",
         help_text="Nome do usuário admin que enviou o email de confirmação"
     )
+    
+    # Fila de conciliação com o Mercado Pago (ver pedidos/conciliacao.py)
+    proxima_conciliacao = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Próxima conciliação",
+        help_text="Quando o status será conferido de novo no Mercado Pago (vazio = fora da fila)"
+    )
+    tentativas_conciliacao = models.PositiveSmallIntegerField(default=0, verbose_name="Tentativas de conciliação")
 
     class Meta:
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
         ordering = ['-data_pedido']
+        indexes = [
+            # Listagem da API: ordem do cursor e filtros por status/forma de pagamento no período
+            models.Index(fields=['data_pedido', 'id']),
+            models.Index(fields=['status_pagamento', 'data_pedido']),
+            models.Index(fields=['forma_pagamento', 'data_pedido']),
+            # Feed de alterações (/api/pedidos/changes/)
+            models.Index(fields=['data_atualizacao', 'id']),
+            # Fila de conciliação: só os pedidos agendados entram no índice
+            models.Index(
+                fields=['proxima_conciliacao'],
+                condition=models.Q(proxima_conciliacao__isnull=False),
+                name='pedidos_conciliacao_fila_idx'
+            ),
+        ]
 
     def __str__(self):
         if self.produto_tamanho:
@@ -329,12 +923,41 @@ class Pedido(models.Model):
         return self.preco
 
     def save(self, *args, **kwargs):
-        # Se não tem external_reference, gerar uma baseada no timestamp
+        # Se não tem external_reference, gerar uma única e ordenada pelo tempo
         if not self.external_reference:
-            timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
-            self.external_reference = f"ONEWAY-{self.id or 'NEW'}-{timestamp}"
+            self.external_reference = gerar_referencia('ONEWAY')
+        # Pedido novo de gateway entra na fila de conciliação
+        if (self._state.adding and self.proxima_conciliacao is None
+                and self.forma_pagamento not in self.FORMAS_FORA_DO_MERCADOPAGO
+                and self.status_pagamento in self.STATUS_EM_ABERTO):
+            self.proxima_conciliacao = timezone.now() + self.INTERVALOS_CONCILIACAO[0]
         super().save(*args, **kwargs)
     
+    def reivindicar_decremento(self):
+        """
+        Marca estoque_decrementado só se ainda não estava marcado (UPDATE
+        condicional, que trava a linha do pedido até o fim da transação)
+        Chamado dentro da transação do decremento: retorna False se outro
+        caminho (webhook, conciliação, admin, nova tentativa) já decrementou
+        """
+        marcados = Pedido.objects.filter(pk=self.pk, estoque_decrementado=False).update(
+            estoque_decrementado=True, data_atualizacao=timezone.now()
+        )
+        self.estoque_decrementado = True
+        return bool(marcados)
+    
+    def aplicar_efeitos_status(self, status_anterior, usuario='sistema', origem='atualizar_status'):
+        """
+        Efeitos de estoque de uma mudança de status já gravada: as reservas do
+        checkout viram venda na aprovação e são liberadas na recusa/cancelamento
+        """
+        if self.status_pagamento == status_anterior:
+            return
+        if self.status_pagamento == 'approved':
+            ReservaEstoque.confirmar_reservas(self, usuario=usuario, origem=origem)
+        elif self.status_pagamento in ('rejected', 'cancelled'):
+            ReservaEstoque.liberar_reservas(self)
+    
     @property
     def total_pedido(self):
         """Calcula o total do pedido baseado nos itens (para nova estrutura)"""
@@ -414,11 +1037,18 @@ class ItemPedido(models.Model):
         verbose_name="Entregue por",
         help_text="Nome do usuário que registrou a entrega"
     )
+    data_atualizacao = models.DateTimeField(auto_now=True, verbose_name="Última Atualização")
     
     class Meta:
         verbose_name = "Item do Pedido"
         verbose_name_plural = "Itens do Pedido"
         unique_together = [['pedido', 'produto', 'tamanho']]
+        indexes = [
+            # Relatório de vendas: totais e compradores por produto/tamanho
+            models.Index(fields=['produto', 'tamanho']),
+            # Feed de alterações (/api/pedidos/changes/)
+            models.Index(fields=['data_atualizacao', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.quantidade}x {self.get_produto_display()} ({self.tamanho})"
@@ -465,6 +1095,173 @@ class ItemPedido(models.Model):
             self.entregue = False
         
         super().save(*args, **kwargs)
+    
+    @classmethod
+    def registrar_entrega(cls, item_id, quantidade, usuario=''):
+        """
+        Soma `quantidade` a quantidade_entregue num único UPDATE condicional
+        (quantidade_entregue + quantidade <= quantidade do item), marcando
+        entregue/data_entrega no mesmo comando quando a entrega completa.
+        Dois voluntários entregando o mesmo item ao mesmo tempo nunca passam
+        do total: o segundo UPDATE simplesmente não encontra a linha.
+        
+        Retorna (sucesso, item) com o item relido (pedido e comprador via
+        select_related); item é None se não existe
+        """
+        agora = timezone.now()
+        completa = models.Q(quantidade_entregue__gte=models.F('quantidade') - quantidade)
+        
+        atualizados = cls.objects.filter(
+            id=item_id,
+            quantidade_entregue__lte=models.F('quantidade') - quantidade
+        ).update(
+            # Todas as expressões enxergam os valores de ANTES do UPDATE
+            quantidade_entregue=models.F('quantidade_entregue') + quantidade,
+            data_atualizacao=agora,
+            entregue=models.Case(
+                models.When(completa, then=models.Value(True)),
+                default=models.F('entregue'),
+            ),
+            data_entrega=models.Case(
+                models.When(completa, then=models.Value(agora)),
+                default=models.F('data_entrega'),
+            ),
+            # Usuário registrado na primeira entrega e na entrega final
+            usuario_entrega=models.Case(
+                models.When(completa | models.Q(quantidade_entregue=0), then=models.Value(usuario)),
+                default=models.F('usuario_entrega'),
+            ),
+        )
+        
+        item = cls.objects.select_related('pedido__comprador').filter(id=item_id).first()
+        return atualizados == 1, item
+    
+    @classmethod
+    def registrar_entregas_lote(cls, itens=None, pedido_id=None, usuario=''):
+        """
+        Registra várias entregas de uma vez (tudo ou nada)
+        
+        Args:
+            itens: Lista de (item_id, quantidade); ids repetidos são somados
+            pedido_id: Alternativa a itens - entrega tudo o que está pendente no pedido
+            usuario: Gravado em usuario_entrega (primeira entrega e entrega final)
+        
+        Retorna (sucesso, resultados) com um dict por item. Custo constante:
+        1 SELECT ... FOR UPDATE (com pedido e comprador) e 1 UPDATE condicional,
+        independente do número de itens
+        """
+        from functools import reduce
+        import operator
+        from django.db import transaction
+        from django.db.models import Case, F, Q, Value, When
+        
+        solicitados = {}
+        for item_id, quantidade in itens or []:
+            solicitados[item_id] = solicitados.get(item_id, 0) + quantidade
+        
+        with transaction.atomic():
+            linhas = cls.objects.select_for_update(of=('self',)).select_related('pedido__comprador')
+            if pedido_id is not None:
+                linhas = linhas.filter(pedido_id=pedido_id)
+            else:
+                linhas = linhas.filter(id__in=solicitados.keys())
+            encontrados = {item.id: item for item in linhas.order_by('id')}
+            
+            if pedido_id is not None:
+                solicitados = {
+                    item.id: item.quantidade_pendente
+                    for item in encontrados.values()
+                    if item.quantidade_pendente > 0
+                }
+            
+            if not solicitados:
+                return False, []
+            
+            # Validar tudo em memória antes de escrever qualquer coisa
+            sucesso = True
+            resultados = []
+            for item_id, quantidade in solicitados.items():
+                item = encontrados.get(item_id)
+                resultado = {'item_id': item_id, 'quantidade_solicitada': quantidade, 'ok': False}
+                if item is None:
+                    resultado['erro'] = f'Item {item_id} não encontrado'
+                elif quantidade <= 0:
+                    resultado['erro'] = f'{item}: Quantidade inválida ({quantidade})'
+                elif item.entrega_completa:
+                    resultado['erro'] = f'{item}: já foi totalmente entregue ({item.quantidade_entregue}/{item.quantidade})'
+                elif quantidade > item.quantidade_pendente:
+                    resultado['erro'] = f'{item}: quantidade excede o pendente. Restam {item.quantidade_pendente} unidades'
+                else:
+                    resultado['ok'] = True
+                sucesso = sucesso and resultado['ok']
+                resultados.append(resultado)
+            
+            if not sucesso:
+                for resultado in resultados:
+                    item = encontrados.get(resultado['item_id'])
+                    if item is not None:
+                        resultado.update(item.estado_entrega())
+                return False, resultados
+            
+            # Um único UPDATE; a condição de limite continua valendo em bancos sem FOR UPDATE (SQLite)
+            agora = timezone.now()
+            quantidade_por_item = Case(
+                *[When(id=item_id, then=Value(quantidade)) for item_id, quantidade in solicitados.items()],
+                output_field=models.IntegerField()
+            )
+            condicao = reduce(operator.or_, (
+                Q(id=item_id, quantidade_entregue__lte=F('quantidade') - quantidade)
+                for item_id, quantidade in solicitados.items()
+            ))
+            completa = Q(quantidade_entregue__gte=F('quantidade') - quantidade_por_item)
+            atualizados = cls.objects.filter(condicao).update(
+                quantidade_entregue=F('quantidade_entregue') + quantidade_por_item,
+                data_atualizacao=agora,
+                entregue=Case(When(completa, then=Value(True)), default=F('entregue')),
+                data_entrega=Case(When(completa, then=Value(agora)), default=F('data_entrega')),
+                usuario_entrega=Case(
+                    When(completa | Q(quantidade_entregue=0), then=Value(usuario)),
+                    default=F('usuario_entrega')
+                ),
+            )
+            
+            if atualizados != len(solicitados):
+                # Outra entrega mudou algum item entre a leitura e a escrita: desfazer tudo
+                transaction.set_rollback(True)
+                for resultado in resultados:
+                    resultado['ok'] = False
+                    resultado['erro'] = 'Entrega alterada durante o processamento, tente novamente'
+                return False, resultados
+            
+            # Linhas travadas e UPDATE confirmado: o estado final é calculável sem reler
+            for resultado in resultados:
+                item = encontrados[resultado['item_id']]
+                quantidade = resultado['quantidade_solicitada']
+                if item.quantidade_entregue == 0 or item.quantidade_entregue + quantidade >= item.quantidade:
+                    item.usuario_entrega = usuario
+                item.quantidade_entregue += quantidade
+                if item.entrega_completa:
+                    item.entregue = True
+                    item.data_entrega = agora
+                resultado['quantidade_entregue_agora'] = quantidade
+                resultado.update(item.estado_entrega())
+        
+        return True, resultados
+    
+    def estado_entrega(self):
+        """Situação de entrega do item para respostas JSON"""
+        return {
+            'produto': self.get_produto_display(),
+            'tamanho': self.tamanho,
+            'pedido_id': self.pedido_id,
+            'comprador': self.pedido.comprador.nome,
+            'quantidade_total_entregue': self.quantidade_entregue,
+            'quantidade_total': self.quantidade,
+            'quantidade_pendente': self.quantidade_pendente,
+            'percentual_entregue': self.percentual_entregue,
+            'status_entrega': self.status_entrega_display,
+            'entrega_completa': self.entrega_completa,
+        }
 
 
 class MovimentacaoEstoque(models.Model):
@@ -559,7 +1356,7 @@ class MovimentacaoEstoque(models.Model):
         return f"{sinal}{self.quantidade}"
     
     @classmethod
-    def registrar_movimentacao(cls, produto_tamanho, tipo, quantidade, pedido=None, usuario="", observacao="", origem=""):
+    def registrar_movimentacao(cls, produto_tamanho, tipo, quantidade, pedido=None, usuario="", observacao="", origem="", estoque_anterior=None):
         """
         Método utilitário para registrar movimentações
         
@@ -571,9 +1368,12 @@ class MovimentacaoEstoque(models.Model):
             usuario: Usuário que executou (opcional)
             observacao: Observações adicionais (opcional)
             origem: Sistema de origem (opcional)
+            estoque_anterior: Estoque real antes da movimentação, quando já conhecido
+                (ex: devolvido pelo UPDATE atômico). Padrão: produto_tamanho.estoque
         """
         # Capturar estoque anterior
-        estoque_anterior = produto_tamanho.estoque
+        if estoque_anterior is None:
+            estoque_anterior = produto_tamanho.estoque
         
         # Calcular estoque posterior
         if tipo in ['entrada', 'ajuste', 'reset', 'setup']:
@@ -601,8 +1401,597 @@ class MovimentacaoEstoque(models.Model):
             origem=origem
         )
         
-        # Debug log
         if pedido:
-            print(f"[DEBUG MovimentacaoEstoque] Criada movimentação ID #{movimentacao.id} para pedido #{pedido.id} - {produto_tamanho}")
+            logger.debug(
+                'Criada movimentação #%s para pedido #%s - %s',
+                movimentacao.id, pedido.id, produto_tamanho
+            )
         
         return movimentacao
+
+
+class ReservaEstoque(models.Model):
+    """
+    Reserva temporária de estoque durante o checkout online (Mercado Pago/PayPal)
+    Conta contra a disponibilidade até expirar, ser convertida em venda ou liberada
+    """
+    STATUS_CHOICES = [
+        ('ativa', 'Ativa'),
+        ('convertida', 'Convertida em venda'),
+        ('liberada', 'Liberada'),
+        ('expirada', 'Expirada'),
+    ]
+    
+    MINUTOS_PADRAO = 15
+    
+    produto_tamanho = models.ForeignKey(
+        'ProdutoTamanho',
+        on_delete=models.CASCADE,
+        related_name='reservas',
+        verbose_name="Produto/Tamanho"
+    )
+    pedido = models.ForeignKey(
+        'Pedido',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservas',
+        verbose_name="Pedido"
+    )
+    quantidade = models.PositiveIntegerField(verbose_name="Quantidade")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='ativa',
+        verbose_name="Status"
+    )
+    expira_em = models.DateTimeField(verbose_name="Expira em")
+    data_criacao = models.DateTimeField(auto_now_add=True, verbose_name="Data de Criação")
+    data_atualizacao = models.DateTimeField(auto_now=True, verbose_name="Última Atualização")
+    
+    class Meta:
+        verbose_name = "Reserva de Estoque"
+        verbose_name_plural = "Reservas de Estoque"
+        ordering = ['-data_criacao']
+        indexes = [
+            # Varredura de reservas vencidas (liberar_reservas_expiradas)
+            models.Index(fields=['status', 'expira_em']),
+            # Soma das reservas ativas por tamanho (validação de estoque)
+            models.Index(fields=['produto_tamanho', 'status', 'expira_em']),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantidade}x {self.produto_tamanho} ({self.get_status_display()})"
+    
+    @classmethod
+    def ativas(cls):
+        """Reservas que ainda contam contra o estoque"""
+        return cls.objects.filter(status='ativa', expira_em__gt=timezone.now())
+    
+    @classmethod
+    def quantidades_reservadas(cls, produto_tamanho_ids, excluir_pedido=None):
+        """
+        Retorna {product_size_id: quantidade reservada} com uma única query agregada
+        """
+        from django.db.models import Sum
+        
+        reservas = cls.ativas().filter(produto_tamanho_id__in=produto_tamanho_ids)
+        if excluir_pedido is not None:
+            reservas = reservas.exclude(pedido=excluir_pedido)
+        
+        return dict(
+            reservas.values('produto_tamanho_id')
+            .annotate(total=Sum('quantidade'))
+            .values_list('produto_tamanho_id', 'total')
+        )
+    
+    @classmethod
+    def reservar(cls, itens, pedido=None, minutos=None):
+        """
+        Cria reservas para vários tamanhos de uma vez (tudo ou nada)
+        
+        Args:
+            itens: Lista de (product_size_id, quantidade); ids repetidos são somados
+            pedido: Pedido do checkout; reservas ativas anteriores dele são substituídas
+            minutos: Validade da reserva (padrão: MINUTOS_PADRAO)
+        
+        Retorna (sucesso, resultados) com um dict por product_size_id
+        """
+        from datetime import timedelta
+        from django.db import transaction
+        
+        solicitados = {}
+        for product_size_id, quantidade in itens:
+            solicitados[product_size_id] = solicitados.get(product_size_id, 0) + quantidade
+        
+        if not solicitados:
+            return False, []
+        
+        expira_em = timezone.now() + timedelta(minutes=minutos or cls.MINUTOS_PADRAO)
+        
+        with transaction.atomic():
+            # Travar os tamanhos em ordem de id (mesma ordem do decremento em lote)
+            tamanhos = {
+                tamanho.id: tamanho
+                for tamanho in ProdutoTamanho.objects.select_for_update(of=('self',))
+                .select_related('produto')
+                .filter(id__in=solicitados.keys())
+                .order_by('id')
+            }
+            
+            # Nova tentativa do mesmo checkout substitui as reservas anteriores
+            if pedido is not None:
+                cls.objects.filter(pedido=pedido, status='ativa').update(
+                    status='liberada', data_atualizacao=timezone.now()
+                )
+            
+            reservado = cls.quantidades_reservadas(tamanhos.keys())
+            
+            sucesso = True
+            resultados = []
+            for product_size_id, quantidade in solicitados.items():
+                tamanho = tamanhos.get(product_size_id)
+                resultado = {
+                    'product_size_id': product_size_id,
+                    'quantidade_solicitada': quantidade,
+                    'ok': False,
+                }
+                if tamanho is None:
+                    resultado['erro'] = f'Produto com ID {product_size_id} não encontrado'
+                else:
+                    livre = tamanho.estoque - reservado.get(tamanho.id, 0)
+                    resultado['estoque_disponivel'] = max(0, livre)
+                    if quantidade <= 0:
+                        resultado['erro'] = f'{tamanho}: Quantidade inválida ({quantidade})'
+                    elif not (tamanho.disponivel and tamanho.produto.ativo) or livre < quantidade:
+                        resultado['erro'] = (
+                            f'{tamanho}: Estoque insuficiente '
+                            f'(disponível: {max(0, livre)}, solicitado: {quantidade})'
+                        )
+                    else:
+                        resultado['ok'] = True
+                
+                sucesso = sucesso and resultado['ok']
+                resultados.append(resultado)
+            
+            if not sucesso:
+                transaction.set_rollback(True)
+                return False, resultados
+            
+            cls.objects.bulk_create([
+                cls(
+                    produto_tamanho=tamanhos[product_size_id],
+                    pedido=pedido,
+                    quantidade=quantidade,
+                    expira_em=expira_em
+                )
+                for product_size_id, quantidade in solicitados.items()
+            ])
+        
+        for resultado in resultados:
+            resultado['expira_em'] = expira_em.isoformat()
+        return True, resultados
+    
+    @classmethod
+    def confirmar_reservas(cls, pedido, usuario="sistema", origem="confirmar_reservas"):
+        """
+        Converte as reservas do pedido aprovado em decremento real de estoque
+        Retorna True se o estoque foi decrementado
+        """
+        if pedido.estoque_decrementado:
+            return False
+        
+        # Vencidas ainda não varridas também valem: o pagamento foi aprovado
+        reservas = list(
+            cls.objects.filter(pedido=pedido, status__in=['ativa', 'expirada'])
+            .values_list('produto_tamanho_id', 'quantidade')
+        )
+        if not reservas:
+            return False
+        
+        sucesso, resultados = ProdutoTamanho.decrementar_estoque_lote(
+            reservas,
+            pedido=pedido,
+            usuario=usuario,
+            observacao=f'Pagamento aprovado - Pedido #{pedido.id}',
+            origem=origem
+        )
+        # decrementar_estoque_lote marca estoque_decrementado na mesma transação
+        # e não decrementa de novo se outro caminho chegou antes
+        return sucesso and not any(resultado.get('ja_decrementado') for resultado in resultados)
+    
+    @classmethod
+    def converter_reservas(cls, pedido, produto_tamanho_ids):
+        """Marca as reservas do pedido como vendidas após o decremento real"""
+        return cls.objects.filter(
+            pedido=pedido,
+            produto_tamanho_id__in=produto_tamanho_ids,
+            status__in=['ativa', 'expirada']
+        ).update(status='convertida', data_atualizacao=timezone.now())
+    
+    @classmethod
+    def liberar_reservas(cls, pedido):
+        """Libera as reservas ativas de um pedido rejeitado/cancelado"""
+        return cls.objects.filter(pedido=pedido, status='ativa').update(
+            status='liberada', data_atualizacao=timezone.now()
+        )
+
+
+class EventoEntrega(models.Model):
+    """
+    Entrega registrada offline por um tablet do balcão e sincronizada depois
+    A chave é gerada no dispositivo e é única: reenviar o mesmo evento nunca entrega duas vezes
+    """
+    STATUS_CHOICES = [
+        ('aplicado', 'Aplicado'),
+        ('parcial', 'Aplicado parcialmente'),
+        ('rejeitado', 'Rejeitado'),
+    ]
+    
+    chave = models.CharField(max_length=100, unique=True, verbose_name="Chave de idempotência")
+    item = models.ForeignKey(
+        'ItemPedido',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='eventos_entrega',
+        verbose_name="Item"
+    )
+    item_id_informado = models.BigIntegerField(verbose_name="Item informado")
+    quantidade_solicitada = models.PositiveIntegerField(verbose_name="Quantidade solicitada")
+    quantidade_aplicada = models.PositiveIntegerField(default=0, verbose_name="Quantidade aplicada")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name="Status")
+    motivo = models.CharField(max_length=200, blank=True, verbose_name="Motivo")
+    dispositivo = models.CharField(max_length=100, blank=True, verbose_name="Dispositivo")
+    usuario = models.CharField(max_length=100, blank=True, verbose_name="Usuário")
+    registrado_em = models.DateTimeField(verbose_name="Registrado no dispositivo em")
+    recebido_em = models.DateTimeField(auto_now_add=True, verbose_name="Recebido em")
+    
+    class Meta:
+        verbose_name = "Evento de Entrega (offline)"
+        verbose_name_plural = "Eventos de Entrega (offline)"
+        ordering = ['-recebido_em']
+    
+    def __str__(self):
+        return f"{self.chave}: {self.quantidade_aplicada}/{self.quantidade_solicitada} ({self.get_status_display()})"
+    
+    def resultado(self, duplicado=False):
+        """Resultado do evento devolvido ao dispositivo"""
+        return {
+            'chave': self.chave,
+            'item_id': self.item_id_informado,
+            'status': self.status,
+            'quantidade_solicitada': self.quantidade_solicitada,
+            'quantidade_aplicada': self.quantidade_aplicada,
+            'motivo': self.motivo,
+            'duplicado': duplicado,
+        }
+    
+    @classmethod
+    def sincronizar(cls, eventos, dispositivo='', usuario=''):
+        """
+        Aplica um lote de eventos de entrega, no máximo uma vez cada
+        
+        Args:
+            eventos: Lista de dicts {chave, item_id, quantidade, registrado_em}
+                     já validados (registrado_em como datetime)
+            dispositivo: Identificação do tablet que enviou o lote
+            usuario: Gravado nos eventos e em usuario_entrega
+        
+        Chaves já gravadas, e as repetidas dentro do próprio lote, devolvem o
+        resultado original (duplicado=True). As novas são aplicadas em ordem de
+        registrado_em, limitadas ao pendente de cada item:
+        o excedente vira 'parcial' ou 'rejeitado' em vez de erro, porque o tablet já
+        entregou fisicamente e só precisa saber o que foi contabilizado.
+        
+        Custo constante: 1 SELECT ... FOR UPDATE dos itens, 1 SELECT das chaves,
+        1 UPDATE condicional e 1 INSERT, independente do tamanho do lote.
+        
+        Retorna a lista de resultados na ordem recebida
+        """
+        from functools import reduce
+        import operator
+        from django.db import IntegrityError, transaction
+        from django.db.models import Case, F, Q, Value, When
+        
+        # Chave repetida dentro do mesmo lote: vale a primeira ocorrência
+        unicos = {}
+        for evento in eventos:
+            unicos.setdefault(evento['chave'], evento)
+        
+        for tentativa in range(2):
+            try:
+                with transaction.atomic():
+                    # Travar os itens antes de ler as chaves: sincronizações concorrentes
+                    # dos mesmos itens são serializadas e enxergam os eventos uma da outra
+                    itens = {
+                        item.id: item
+                        for item in ItemPedido.objects.select_for_update(of=('self',))
+                        .select_related('pedido__comprador')
+                        .filter(id__in={evento['item_id'] for evento in unicos.values()})
+                        .order_by('id')
+                    }
+                    
+                    resultados = {
+                        evento.chave: evento.resultado(duplicado=True)
+                        for evento in cls.objects.filter(chave__in=unicos.keys())
+                    }
+                    novos = sorted(
+                        (evento for chave, evento in unicos.items() if chave not in resultados),
+                        key=lambda evento: (evento['registrado_em'], evento['chave'])
+                    )
+                    
+                    # Aplicar em memória, na ordem em que as entregas aconteceram
+                    entregue_antes = {item_id: item.quantidade_entregue for item_id, item in itens.items()}
+                    registros = []
+                    for evento in novos:
+                        item = itens.get(evento['item_id'])
+                        quantidade = evento['quantidade']
+                        aplicada = 0
+                        motivo = ''
+                        if item is None:
+                            motivo = f"Item {evento['item_id']} não encontrado"
+                        else:
+                            aplicada = min(quantidade, item.quantidade_pendente)
+                            if aplicada:
+                                if item.quantidade_entregue == 0 or aplicada == item.quantidade_pendente:
+                                    item.usuario_entrega = usuario
+                                item.quantidade_entregue += aplicada
+                                if item.entrega_completa:
+                                    item.entregue = True
+                                    item.data_entrega = evento['registrado_em']
+                            if aplicada == 0:
+                                motivo = f'{item}: já foi totalmente entregue ({item.quantidade_entregue}/{item.quantidade})'
+                            elif aplicada < quantidade:
+                                motivo = f'{item}: quantidade excedia o pendente, aplicadas {aplicada} de {quantidade}'
+                        
+                        if aplicada == quantidade:
+                            status = 'aplicado'
+                        elif aplicada:
+                            status = 'parcial'
+                        else:
+                            status = 'rejeitado'
+                        
+                        registro = cls(
+                            chave=evento['chave'],
+                            item=item,
+                            item_id_informado=evento['item_id'],
+                            quantidade_solicitada=quantidade,
+                            quantidade_aplicada=aplicada,
+                            status=status,
+                            motivo=motivo,
+                            dispositivo=dispositivo,
+                            usuario=usuario,
+                            registrado_em=evento['registrado_em'],
+                        )
+                        registros.append(registro)
+                        resultados[registro.chave] = registro.resultado()
+                    
+                    alterados = [
+                        item for item_id, item in itens.items()
+                        if item.quantidade_entregue != entregue_antes[item_id]
+                    ]
+                    if alterados:
+                        # Um único UPDATE com os valores finais, condicionado ao valor lido
+                        # (a condição continua valendo em bancos sem FOR UPDATE, como o SQLite)
+                        condicao = reduce(operator.or_, (
+                            Q(id=item.id, quantidade_entregue=entregue_antes[item.id])
+                            for item in alterados
+                        ))
+                        atualizados = ItemPedido.objects.filter(condicao).update(data_atualizacao=timezone.now(), **{
+                            campo: Case(
+                                *[When(id=item.id, then=Value(getattr(item, campo))) for item in alterados],
+                                default=F(campo),
+                                output_field=ItemPedido._meta.get_field(campo)
+                            )
+                            for campo in ('quantidade_entregue', 'entregue', 'data_entrega', 'usuario_entrega')
+                        })
+                        if atualizados != len(alterados):
+                            # Outra entrega mudou algum item entre a leitura e a escrita
+                            transaction.set_rollback(True)
+                            continue
+                    
+                    # A chave única é a garantia final contra um lote concorrente com as mesmas chaves
+                    cls.objects.bulk_create(registros)
+            except IntegrityError:
+                if tentativa:
+                    raise
+                continue
+            
+            for resultado in resultados.values():
+                item = itens.get(resultado['item_id'])
+                if item is not None:
+                    resultado.update(item.estado_entrega())
+            
+            # Repetições da chave dentro do lote devolvem o resultado da primeira como duplicado
+            respostas = []
+            vistas = set()
+            for evento in eventos:
+                resultado = resultados[evento['chave']]
+                if evento['chave'] in vistas:
+                    resultado = {**resultado, 'duplicado': True}
+                vistas.add(evento['chave'])
+                respostas.append(resultado)
+            return respostas
+        
+        raise IntegrityError('Entregas alteradas durante a sincronização, tente novamente')
+
+
+class RegistroExclusao(models.Model):
+    """
+    Marca (tombstone) de pedido ou item excluído, para o feed de alterações
+    Preenchida pelos sinais post_delete abaixo, que também cobrem exclusões em
+    cascata e pelo queryset (admin, comandos)
+    """
+    TIPO_CHOICES = [
+        ('pedido', 'Pedido'),
+        ('item', 'Item do Pedido'),
+    ]
+    
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES, verbose_name="Tipo")
+    objeto_id = models.BigIntegerField(verbose_name="ID excluído")
+    pedido_id = models.BigIntegerField(null=True, blank=True, verbose_name="Pedido")
+    excluido_em = models.DateTimeField(default=timezone.now, verbose_name="Excluído em")
+    
+    class Meta:
+        verbose_name = "Registro de Exclusão"
+        verbose_name_plural = "Registros de Exclusão"
+        ordering = ['excluido_em', 'id']
+        indexes = [
+            models.Index(fields=['excluido_em', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.objeto_id} excluído em {self.excluido_em:%d/%m/%Y %H:%M}"
+
+
+@receiver(post_delete, sender=Pedido)
+def registrar_exclusao_pedido(sender, instance, **kwargs):
+    RegistroExclusao.objects.create(tipo='pedido', objeto_id=instance.id, pedido_id=instance.id)
+
+
+@receiver(post_delete, sender=ItemPedido)
+def registrar_exclusao_item(sender, instance, **kwargs):
+    RegistroExclusao.objects.create(tipo='item', objeto_id=instance.id, pedido_id=instance.pedido_id)
+
+
+class ChaveIdempotencia(models.Model):
+    """
+    Resposta gravada de uma criação enviada com o header Idempotency-Key
+    Um reenvio com a mesma chave (timeout do axios, clique duplo) recebe a mesma
+    resposta em vez de criar outro pedido. Ver pedidos/idempotencia.py
+    """
+    VALIDADE_HORAS = 24
+    
+    escopo = models.CharField(max_length=50, verbose_name="Escopo")
+    chave = models.CharField(max_length=255, verbose_name="Chave")
+    hash_requisicao = models.CharField(max_length=64, verbose_name="Hash da requisição")
+    status_http = models.PositiveSmallIntegerField(verbose_name="Status HTTP")
+    resposta = models.JSONField(verbose_name="Resposta")
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Criado em")
+    
+    class Meta:
+        verbose_name = "Chave de Idempotência"
+        verbose_name_plural = "Chaves de Idempotência"
+        unique_together = [['escopo', 'chave']]
+    
+    def __str__(self):
+        return f"{self.escopo}: {self.chave} ({self.status_http})"
+    
+    @classmethod
+    def limpar_expiradas(cls):
+        """Remove as chaves mais antigas que VALIDADE_HORAS; retorna quantas"""
+        from datetime import timedelta
+        limite = timezone.now() - timedelta(hours=cls.VALIDADE_HORAS)
+        removidas, _ = cls.objects.filter(criado_em__lt=limite).delete()
+        return removidas
+
+
+class NotificacaoMercadoPago(models.Model):
+    """
+    Notificação (webhook) recebida do Mercado Pago
+    O id da notificação é único: reenvios do MP não são processados duas vezes.
+    O webhook só grava a linha; a consulta ao pagamento e a mudança de status
+    acontecem depois, fora da requisição (ver pedidos/webhooks.py)
+    """
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('processada', 'Processada'),
+        ('ignorada', 'Ignorada'),
+        ('erro', 'Erro'),
+    ]
+    
+    notificacao_id = models.CharField(max_length=100, unique=True, verbose_name="ID da notificação")
+    tipo = models.CharField(max_length=50, verbose_name="Tipo")
+    acao = models.CharField(max_length=50, blank=True, verbose_name="Ação")
+    recurso_id = models.CharField(max_length=50, verbose_name="ID do recurso")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente', verbose_name="Status")
+    tentativas = models.PositiveSmallIntegerField(default=0, verbose_name="Tentativas")
+    pedido = models.ForeignKey(
+        Pedido,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='notificacoes_mp',
+        verbose_name="Pedido"
+    )
+    resultado = models.TextField(blank=True, verbose_name="Resultado")
+    payload = models.JSONField(default=dict, verbose_name="Payload")
+    recebida_em = models.DateTimeField(auto_now_add=True, verbose_name="Recebida em")
+    atualizada_em = models.DateTimeField(auto_now=True, verbose_name="Atualizada em")
+    
+    class Meta:
+        verbose_name = "Notificação Mercado Pago"
+        verbose_name_plural = "Notificações Mercado Pago"
+        ordering = ['-recebida_em']
+        indexes = [
+            # Fila do worker: pendentes (ou presas em processando) mais antigas primeiro
+            models.Index(fields=['status', 'atualizada_em'], name='pedidos_notif_mp_fila_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.tipo} {self.recurso_id} ({self.get_status_display()})"
+
+
+class PagamentoSnapshot(models.Model):
+    """
+    Último payload de um pagamento consultado no Mercado Pago
+    Status finais são servidos daqui para sempre; os demais só são consultados
+    de novo depois de MERCADOPAGO_SNAPSHOT_TTL segundos (ver consultar_mp_admin)
+    """
+    STATUS_FINAIS = ('approved', 'rejected', 'cancelled', 'refunded', 'charged_back')
+    
+    payment_id = models.CharField(max_length=50, unique=True, verbose_name="ID Pagamento MP")
+    status = models.CharField(max_length=20, blank=True, verbose_name="Status no MP")
+    dados = models.JSONField(verbose_name="Payload")
+    consultado_em = models.DateTimeField(verbose_name="Consultado em")
+    
+    class Meta:
+        verbose_name = "Snapshot de Pagamento MP"
+        verbose_name_plural = "Snapshots de Pagamentos MP"
+    
+    def __str__(self):
+        return f"{self.payment_id} ({self.status})"
+    
+    @property
+    def final(self):
+        return self.status in self.STATUS_FINAIS
+    
+    def valido(self, ttl=None):
+        """Pode ser servido sem consultar o MP: status final ou consultado há menos de ttl segundos"""
+        if self.final:
+            return True
+        from django.conf import settings
+        from datetime import timedelta
+        ttl = getattr(settings, 'MERCADOPAGO_SNAPSHOT_TTL', 60) if ttl is None else ttl
+        return timezone.now() - self.consultado_em < timedelta(seconds=ttl)
+    
+    @classmethod
+    def gravar(cls, pagamentos):
+        """
+        Upsert (um INSERT ... ON CONFLICT por lote) dos payloads consultados
+        Aceita um payload ou uma lista; retorna os snapshots gravados
+        """
+        if isinstance(pagamentos, dict):
+            pagamentos = [pagamentos]
+        agora = timezone.now()
+        # Mesmo pagamento repetido no lote: vale o último
+        snapshots = {
+            str(pagamento['id']): cls(
+                payment_id=str(pagamento['id']),
+                status=pagamento.get('status') or '',
+                dados=pagamento,
+                consultado_em=agora,
+            )
+            for pagamento in pagamentos if pagamento.get('id')
+        }
+        if snapshots:
+            cls.objects.bulk_create(
+                list(snapshots.values()),
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['payment_id'],
+                update_fields=['status', 'dados', 'consultado_em'],
+            )
+        return list(snapshots.values())
@@ -0,0 +1,26 @@
+"""
+Paginação por cursor das listagens da API
+
+O cursor guarda a posição na ordenação (data + id), então cada página custa
+um SELECT ... WHERE <posição> ORDER BY ... LIMIT n pelo índice, sem COUNT e
+sem OFFSET: o tempo de resposta não cresce com o número de pedidos e a
+paginação não pula nem repete linhas quando chegam pedidos novos.
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class CursorPaginacao(CursorPagination):
+    """Padrão da API (DEFAULT_PAGINATION_CLASS): mais recentes primeiro, pelo id"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = '-id'
+
+
+class PedidoCursorPaginacao(CursorPaginacao):
+    # Mesma ordem do admin; o id desempata pedidos do mesmo instante
+    ordering = ('-data_pedido', '-id')
+
+
+class CompradorCursorPaginacao(CursorPaginacao):
+    ordering = ('-data_cadastro', '-id')
@@ -0,0 +1,105 @@
+"""
+Consultas do relatório de vendas
+
+Os totais por produto/tamanho e por categoria são agregados no banco
+(values + annotate/aggregate); a lista de compradores de cada produto/tamanho
+é paginada e só é buscada quando o tamanho é expandido na página.
+"""
+from django.db.models import Q, Sum
+
+from .models import ItemPedido
+
+
+# Categorias de produtos
+PRODUTOS_CAMISETAS = ['camiseta-marrom', 'camiseta-jesus', 'camiseta-oneway-branca', 'camiseta-the-way']
+PRODUTOS_ALIMENTACAO = ['almoco-sabado', 'jantar-sabado', 'espetinho-carne', 'espetinho-frango', 'espetinho-linguica', 'adicional-mandioca']
+
+NOMES_PRODUTOS = dict(ItemPedido.PRODUTOS_CHOICES)
+ORDEM_TAMANHOS = ['P', 'M', 'G', 'GG', 'UNICO']
+
+COMPRADORES_POR_PAGINA = 50
+
+
+def itens_vendidos(categoria='todos'):
+    """
+    ItemPedido de pedidos aprovados ou de QUALQUER pedido presencial
+    (independente do status), filtrados pela categoria
+    """
+    itens = ItemPedido.objects.filter(
+        Q(pedido__status_pagamento='approved') | Q(pedido__forma_pagamento='presencial')
+    )
+    return filtrar_categoria(itens, categoria)
+
+
+def filtrar_categoria(itens, categoria):
+    """Restringe um queryset de ItemPedido a camisetas ou alimentação ('todos' não filtra)"""
+    if categoria == 'camisetas':
+        return itens.filter(produto__in=PRODUTOS_CAMISETAS)
+    if categoria == 'alimentacao':
+        return itens.filter(produto__in=PRODUTOS_ALIMENTACAO)
+    return itens
+
+
+def categoria_do_produto(produto_key):
+    return 'camisetas' if produto_key in PRODUTOS_CAMISETAS else 'alimentacao'
+
+
+def resumo_vendas(categoria='todos'):
+    """
+    Totais do relatório em duas queries, independente do número de itens
+
+    Retorna (totais, vendas_por_produto):
+      totais = {'geral', 'camisetas', 'alimentacao'}
+      vendas_por_produto = {produto_nome: {'produto', 'categoria', 'total',
+                                           'tamanhos': {tamanho: total}}}
+    """
+    itens = itens_vendidos(categoria)
+
+    totais = itens.aggregate(
+        geral=Sum('quantidade'),
+        camisetas=Sum('quantidade', filter=Q(produto__in=PRODUTOS_CAMISETAS)),
+        alimentacao=Sum('quantidade', filter=~Q(produto__in=PRODUTOS_CAMISETAS)),
+    )
+    totais = {chave: valor or 0 for chave, valor in totais.items()}
+
+    linhas = (
+        itens.values('produto', 'tamanho')
+        .annotate(total=Sum('quantidade'))
+        .order_by('produto', 'tamanho')
+    )
+
+    vendas_por_produto = {}
+    for linha in linhas:
+        produto_key = linha['produto']
+        produto_nome = NOMES_PRODUTOS.get(produto_key, produto_key)
+        dados = vendas_por_produto.setdefault(produto_nome, {
+            'produto': produto_key,
+            'categoria': categoria_do_produto(produto_key),
+            'total': 0,
+            'tamanhos': {},
+        })
+        dados['tamanhos'][linha['tamanho']] = linha['total']
+        dados['total'] += linha['total']
+
+    return totais, vendas_por_produto
+
+
+def compradores_vendidos(produto, tamanho, pagina=1, por_pagina=COMPRADORES_POR_PAGINA):
+    """
+    Uma página de compradores de um produto/tamanho, ordenada por nome
+    Busca uma linha a mais para saber se existe próxima página (sem COUNT)
+
+    Retorna (compradores, tem_mais) com compradores = [{'nome', 'quantidade'}]
+    """
+    inicio = (pagina - 1) * por_pagina
+    linhas = list(
+        itens_vendidos()
+        .filter(produto=produto, tamanho=tamanho)
+        .order_by('pedido__comprador__nome', 'id')
+        .values('pedido__comprador__nome', 'quantidade')[inicio:inicio + por_pagina + 1]
+    )
+    compradores = [
+        {'nome': linha['pedido__comprador__nome'], 'quantidade': linha['quantidade']}
+        for linha in linhas[:por_pagina]
+    ]
+    return compradores, len(linhas) > por_pagina
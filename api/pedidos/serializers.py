@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Comprador, Pedido, ItemPedido
+from .models import Comprador, Pedido, ItemPedido, gerar_referencia
 
 
 class CompradorSerializer(serializers.ModelSerializer):
@@ -9,8 +9,22 @@ class CompradorSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'data_cadastro']
 
 
+class ItemPedidoSerializer(serializers.ModelSerializer):
+    subtotal = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = ItemPedido
+        fields = [
+            'id', 'pedido', 'produto', 'tamanho', 'quantidade', 
+            'preco_unitario', 'subtotal', 'quantidade_entregue', 'entregue',
+            'data_entrega', 'data_atualizacao'
+        ]
+        read_only_fields = ['id', 'quantidade_entregue', 'entregue', 'data_entrega', 'data_atualizacao']
+
+
 class PedidoSerializer(serializers.ModelSerializer):
     comprador = CompradorSerializer(read_only=True)
+    itens = ItemPedidoSerializer(many=True, read_only=True)
     status_display = serializers.ReadOnlyField()
     valor_com_desconto = serializers.ReadOnlyField()
     
@@ -21,11 +35,19 @@ class PedidoSerializer(serializers.ModelSerializer):
             'forma_pagamento', 'external_reference', 'payment_id',
             'preference_id', 'merchant_order_id', 'status_pagamento',
             'status_display', 'valor_com_desconto', 'data_pedido',
-            'data_atualizacao', 'observacoes'
+            'data_atualizacao', 'observacoes', 'itens'
         ]
         read_only_fields = ['id', 'data_pedido', 'data_atualizacao']
 
 
+class PedidoAlteracaoSerializer(PedidoSerializer):
+    """Pedido no feed de alterações: os itens alterados vêm em lista própria"""
+    itens = None
+    
+    class Meta(PedidoSerializer.Meta):
+        fields = [campo for campo in PedidoSerializer.Meta.fields if campo != 'itens']
+
+
 class CriarPedidoSerializer(serializers.Serializer):
     """Serializer para criar novo pedido com dados do comprador"""
     # Dados do comprador
@@ -54,8 +76,7 @@ class CriarPedidoSerializer(serializers.Serializer):
         # Para pagamento presencial, gerar external_reference automático se não fornecido
         if forma_pagamento == 'presencial':
             if not external_reference or external_reference.strip() == '':
-                import time
-                data['external_reference'] = f'PRESENCIAL-{int(time.time())}'
+                data['external_reference'] = gerar_referencia('PRESENCIAL')
         
         # Para outros pagamentos via gateway, apenas logar warning se não tiver external_reference
         # IMPORTANTE: NÃO bloquear criação para manter compatibilidade com sistema atual
@@ -72,27 +93,13 @@ class CriarPedidoSerializer(serializers.Serializer):
         return data
     
     def create(self, validated_data):
-        # Extrair dados do comprador
-        comprador_data = {
-            'nome': validated_data.pop('nome'),
-            'email': validated_data.pop('email'),
-            'telefone': validated_data.pop('telefone')
-        }
-        
-        # Criar ou buscar comprador existente
-        comprador, created = Comprador.objects.get_or_create(
-            email=comprador_data['email'],
-            defaults=comprador_data
+        # Criar ou buscar comprador existente (nome e telefone atualizados se mudaram)
+        comprador, created = Comprador.registrar(
+            nome=validated_data.pop('nome'),
+            email=validated_data.pop('email'),
+            telefone=validated_data.pop('telefone')
         )
         
-        # Se o comprador já existe, atualizar nome e telefone se necessário
-        if not created:
-            if comprador.nome != comprador_data['nome']:
-                comprador.nome = comprador_data['nome']
-            if comprador.telefone != comprador_data['telefone']:
-                comprador.telefone = comprador_data['telefone']
-            comprador.save()
-        
         # Log da criação do pedido para auditoria
         forma_pagamento = validated_data.get('forma_pagamento')
         external_reference = validated_data.get('external_reference')
@@ -117,22 +124,48 @@ class CriarPedidoSerializer(serializers.Serializer):
         return pedido
 
 
-class ItemPedidoSerializer(serializers.ModelSerializer):
-    subtotal = serializers.ReadOnlyField()
-    
-    class Meta:
-        model = ItemPedido
-        fields = [
-            'id', 'pedido', 'produto', 'tamanho', 'quantidade', 
-            'preco_unitario', 'subtotal'
-        ]
-        read_only_fields = ['id']
-
-
 class AtualizarStatusSerializer(serializers.Serializer):
     """Serializer para atualizar status do pedido"""
     status_pagamento = serializers.ChoiceField(choices=Pedido.STATUS_CHOICES, required=False)
     payment_id = serializers.CharField(max_length=50, required=False, allow_blank=True)
     preference_id = serializers.CharField(max_length=100, required=False, allow_blank=True)
     merchant_order_id = serializers.CharField(max_length=50, required=False, allow_blank=True)
-    observacoes = serializers.CharField(required=False, allow_blank=True)
\ No newline at end of file
+    observacoes = serializers.CharField(required=False, allow_blank=True)
+
+
+class ItemCheckoutSerializer(serializers.Serializer):
+    """Item do carrinho: product_size_id ou produto (json_key) + tamanho"""
+    product_size_id = serializers.IntegerField(required=False, min_value=1)
+    produto = serializers.CharField(max_length=100, required=False)
+    tamanho = serializers.CharField(max_length=5, required=False)
+    quantidade = serializers.IntegerField(min_value=1, max_value=100)
+    
+    def validate(self, data):
+        if 'product_size_id' not in data and not (data.get('produto') and data.get('tamanho')):
+            raise serializers.ValidationError('Informe product_size_id ou produto e tamanho')
+        return data
+
+
+class CheckoutSerializer(serializers.Serializer):
+    """Checkout do carrinho em uma chamada (POST /api/checkout/)"""
+    ESTOQUE_CHOICES = [
+        ('validar', 'Apenas validar'),
+        ('reservar', 'Reservar até o pagamento'),
+        ('decrementar', 'Decrementar agora'),
+    ]
+    
+    nome = serializers.CharField(max_length=100)
+    email = serializers.EmailField()
+    telefone = serializers.CharField(max_length=20)
+    itens = ItemCheckoutSerializer(many=True, allow_empty=False, max_length=50)
+    forma_pagamento = serializers.ChoiceField(choices=Pedido.FORMA_PAGAMENTO_CHOICES)
+    external_reference = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    observacoes = serializers.CharField(required=False, allow_blank=True)
+    # Padrão: decrementar no presencial, reservar nos pagamentos por gateway
+    estoque = serializers.ChoiceField(choices=ESTOQUE_CHOICES, required=False)
+    minutos = serializers.IntegerField(required=False, min_value=1, max_value=120)
+    
+    def validate(self, data):
+        if not data.get('estoque'):
+            data['estoque'] = 'decrementar' if data['forma_pagamento'] == 'presencial' else 'reservar'
+        return data
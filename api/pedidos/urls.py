@@ -2,8 +2,10 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     CompradorViewSet, PedidoViewSet, ItemPedidoViewSet, 
-    setup_estoque_view, validar_estoque_view, estoque_multiplo_view, gerar_products_json_view,
-    decrementar_estoque_view, relatorio_vendas_view, consulta_comprador_view, marcar_entrega_view
+    setup_estoque_view, validar_estoque_view, estoque_multiplo_view, gerar_products_json_view, catalogo_view,
+    decrementar_estoque_view, reservar_estoque_view, relatorio_vendas_view, relatorio_vendas_compradores_view, consulta_comprador_view,
+    exportar_vendas_view, exportar_compradores_view, marcar_entrega_view, marcar_entrega_lote_view,
+    sincronizar_entregas_view, checkout_view, webhook_mercadopago_view
 )
 
 router = DefaultRouter()
@@ -17,8 +19,17 @@ urlpatterns = [
     path('validar-estoque/', validar_estoque_view, name='validar-estoque'),
     path('estoque-multiplo/', estoque_multiplo_view, name='estoque-multiplo'),
     path('gerar-products-json/', gerar_products_json_view, name='gerar-products-json'),
+    path('catalogo/', catalogo_view, name='catalogo'),
     path('decrementar-estoque/', decrementar_estoque_view, name='decrementar-estoque'),
+    path('reservar-estoque/', reservar_estoque_view, name='reservar-estoque'),
     path('relatorio-vendas/', relatorio_vendas_view, name='relatorio-vendas'),
+    path('relatorio-vendas/compradores/', relatorio_vendas_compradores_view, name='relatorio-vendas-compradores'),
+    path('exportar-vendas/', exportar_vendas_view, name='exportar-vendas'),
+    path('exportar-compradores/', exportar_compradores_view, name='exportar-compradores'),
     path('consulta-comprador/', consulta_comprador_view, name='consulta-comprador'),
     path('marcar-entrega/', marcar_entrega_view, name='marcar-entrega'),
+    path('marcar-entrega-lote/', marcar_entrega_lote_view, name='marcar-entrega-lote'),
+    path('sincronizar-entregas/', sincronizar_entregas_view, name='sincronizar-entregas'),
+    path('checkout/', checkout_view, name='checkout'),
+    path('webhooks/mercadopago/', webhook_mercadopago_view, name='webhook-mercadopago'),
 ]
\ No newline at end of file
@@ -1,19 +1,17 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
-import requests
 import json
-import os
 from django.conf import settings
-from .models import Comprador, Pedido, ItemPedido
+from .models import Comprador, Pedido, ItemPedido, ReservaEstoque, normalizar_email
 from .serializers import (
     CompradorSerializer, 
     PedidoSerializer, 
@@ -21,33 +19,196 @@ from .serializers import (
     AtualizarStatusSerializer,
     ItemPedidoSerializer
 )
+from .paginacao import CompradorCursorPaginacao, PedidoCursorPaginacao
+from .idempotencia import idempotente
+
+
+def _parametro_lista(parametros, nome):
+    """Valores de um parâmetro GET separado por vírgula (?status=approved,pending)"""
+    return [valor.strip() for valor in parametros.get(nome, '').split(',') if valor.strip()]
+
+
+def _parametro_data(parametros, nome):
+    """Data AAAA-MM-DD de um parâmetro GET, ou None se ausente"""
+    from datetime import datetime
+    from rest_framework.exceptions import ValidationError
+    
+    valor = parametros.get(nome)
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValidationError({nome: 'Use o formato AAAA-MM-DD'})
 
 
 class CompradorViewSet(viewsets.ReadOnlyModelViewSet):
-    """ViewSet para visualizar compradores (somente leitura)"""
+    """
+    ViewSet para visualizar compradores (somente leitura)
+    Listagem paginada por cursor; filtro: ?email=
+    """
     queryset = Comprador.objects.all()
     serializer_class = CompradorSerializer
     authentication_classes = [TokenAuthentication]
+    pagination_class = CompradorCursorPaginacao
     
     permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        compradores = super().get_queryset()
+        email = self.request.query_params.get('email', '').strip()
+        if email:
+            compradores = compradores.filter(email=normalizar_email(email))
+        return compradores
+    
+    BUSCA_LIMITE_PADRAO = 10
+    BUSCA_LIMITE_MAXIMO = 50
+    
+    @action(
+        detail=False, methods=['get'],
+        authentication_classes=[TokenAuthentication, SessionAuthentication]
+    )
+    def busca(self, request):
+        """
+        Busca rápida para o balcão de retirada (typeahead)
+        GET /api/compradores/busca/?q=joao&limite=10
+        Procura por nome, e-mail, telefone, número do pedido ou external_reference
+        """
+        from django.db.models import Count, Sum
+        
+        termo = request.query_params.get('q', '').strip()
+        try:
+            limite = int(request.query_params.get('limite', self.BUSCA_LIMITE_PADRAO))
+        except ValueError:
+            return Response({'erro': 'limite deve ser um número'}, status=status.HTTP_400_BAD_REQUEST)
+        limite = min(max(1, limite), self.BUSCA_LIMITE_MAXIMO)
+        
+        if len(termo) < 2:
+            return Response({'q': termo, 'resultados': []})
+        
+        # 1ª query: só os ids dos primeiros por nome (índices de busca, sem joins de itens)
+        ids = list(
+            Comprador.buscar(termo).order_by('nome', 'id').values_list('id', flat=True)[:limite]
+        )
+        
+        # 2ª query: contagens de pedidos/itens apenas dos compradores encontrados
+        compradores = (
+            Comprador.objects.filter(id__in=ids)
+            .annotate(
+                total_pedidos=Count('pedido', distinct=True),
+                total_itens=Count('pedido__itens'),
+                total_unidades=Sum('pedido__itens__quantidade'),
+                total_entregue=Sum('pedido__itens__quantidade_entregue'),
+            )
+            .order_by('nome', 'id')
+            .values('id', 'nome', 'email', 'telefone', 'total_pedidos', 'total_itens', 'total_unidades', 'total_entregue')
+        ) if ids else []
+        
+        resultados = []
+        for comprador in compradores:
+            total_unidades = comprador['total_unidades'] or 0
+            total_entregue = min(comprador['total_entregue'] or 0, total_unidades)
+            if not total_unidades:
+                status_entrega = 'sem_itens'
+            elif total_entregue >= total_unidades:
+                status_entrega = 'completo'
+            elif total_entregue:
+                status_entrega = 'parcial'
+            else:
+                status_entrega = 'pendente'
+            
+            resultados.append({
+                'id': comprador['id'],
+                'nome': comprador['nome'],
+                'email': comprador['email'],
+                'telefone': comprador['telefone'],
+                'pedidos': comprador['total_pedidos'],
+                'itens': comprador['total_itens'],
+                'unidades': total_unidades,
+                'unidades_entregues': total_entregue,
+                'status_entrega': status_entrega,
+            })
+        
+        return Response({'q': termo, 'resultados': resultados})
 
 
 class ItemPedidoViewSet(viewsets.ModelViewSet):
-    """ViewSet para gerenciar itens de pedido"""
+    """
+    ViewSet para gerenciar itens de pedido
+    Listagem paginada por cursor; filtros: ?pedido=, ?produto=, ?tamanho=
+    """
     queryset = ItemPedido.objects.all()
     serializer_class = ItemPedidoSerializer
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        itens = super().get_queryset()
+        if self.action != 'list':
+            return itens
+        parametros = self.request.query_params
+        pedido = parametros.get('pedido', '')
+        if pedido:
+            if not pedido.isdigit():
+                from rest_framework.exceptions import ValidationError
+                raise ValidationError({'pedido': 'Informe o id numérico do pedido'})
+            itens = itens.filter(pedido_id=int(pedido))
+        # produto + tamanho usam o índice (produto, tamanho) do relatório de vendas
+        for campo in ('produto', 'tamanho'):
+            valores = _parametro_lista(parametros, campo)
+            if valores:
+                itens = itens.filter(**{f'{campo}__in': valores})
+        return itens
 
 
 class PedidoViewSet(viewsets.ModelViewSet):
-    """ViewSet completo para gerenciar pedidos"""
-    queryset = Pedido.objects.all()
+    """
+    ViewSet completo para gerenciar pedidos
+    
+    Listagem paginada por cursor (?cursor=, ?page_size= até 200), com comprador
+    e itens carregados em queries fixas por página. Filtros, todos indexados:
+      ?status=approved,pending   ?forma_pagamento=pix,presencial
+      ?data_inicio=AAAA-MM-DD    ?data_fim=AAAA-MM-DD
+      ?external_reference=ONEWAY-...
+    """
+    queryset = Pedido.objects.select_related('comprador').prefetch_related('itens')
     serializer_class = PedidoSerializer
     authentication_classes = [TokenAuthentication]
+    pagination_class = PedidoCursorPaginacao
     
     permission_classes = [IsAuthenticated]
     
+    def get_queryset(self):
+        pedidos = super().get_queryset()
+        if self.action != 'list':
+            return pedidos
+        parametros = self.request.query_params
+        
+        referencia = parametros.get('external_reference', '').strip()
+        if referencia:
+            pedidos = pedidos.filter(external_reference=referencia)
+        
+        status_pagamento = _parametro_lista(parametros, 'status')
+        if status_pagamento:
+            pedidos = pedidos.filter(status_pagamento__in=status_pagamento)
+        
+        formas = _parametro_lista(parametros, 'forma_pagamento')
+        if formas:
+            pedidos = pedidos.filter(forma_pagamento__in=formas)
+        
+        # Intervalos em data_pedido (e não __date) para o banco usar o índice
+        from datetime import datetime, time, timedelta
+        data_inicio = _parametro_data(parametros, 'data_inicio')
+        if data_inicio:
+            pedidos = pedidos.filter(data_pedido__gte=timezone.make_aware(datetime.combine(data_inicio, time.min)))
+        data_fim = _parametro_data(parametros, 'data_fim')
+        if data_fim:
+            pedidos = pedidos.filter(
+                data_pedido__lt=timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), time.min))
+            )
+        
+        return pedidos
+    
     def get_serializer_class(self):
         if self.action == 'create':
             return CriarPedidoSerializer
@@ -55,8 +216,12 @@ class PedidoViewSet(viewsets.ModelViewSet):
             return AtualizarStatusSerializer
         return PedidoSerializer
     
+    @idempotente('pedidos.create')
     def create(self, request):
-        """Criar novo pedido com dados do comprador"""
+        """
+        Criar novo pedido com dados do comprador
+        Com o header Idempotency-Key, reenvios devolvem a resposta da primeira criação
+        """
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         pedido = serializer.save()
@@ -65,6 +230,47 @@ class PedidoViewSet(viewsets.ModelViewSet):
         output_serializer = PedidoSerializer(pedido)
         return Response(output_serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['get'], url_path='changes')
+    def alteracoes(self, request):
+        """
+        Feed incremental: pedidos, itens e exclusões desde o cursor
+        GET /api/pedidos/changes/?since=<cursor>&limite=200
+        
+        Sem since, começa do início. Repita com o 'cursor' devolvido enquanto
+        'tem_mais' for true; depois guarde-o para a próxima sincronização.
+        """
+        from .alteracoes import LIMITE_MAXIMO, LIMITE_PADRAO, CursorInvalido, alteracoes_desde
+        from .serializers import PedidoAlteracaoSerializer
+        
+        try:
+            limite = int(request.query_params.get('limite', LIMITE_PADRAO))
+        except ValueError:
+            return Response({'erro': 'limite deve ser um número'}, status=status.HTTP_400_BAD_REQUEST)
+        limite = min(max(1, limite), LIMITE_MAXIMO)
+        
+        try:
+            pedidos, itens, exclusoes, cursor, tem_mais = alteracoes_desde(
+                request.query_params.get('since', ''), limite
+            )
+        except CursorInvalido:
+            return Response({'erro': 'Cursor inválido'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'pedidos': PedidoAlteracaoSerializer(pedidos, many=True).data,
+            'itens': ItemPedidoSerializer(itens, many=True).data,
+            'exclusoes': [
+                {
+                    'tipo': exclusao.tipo,
+                    'id': exclusao.objeto_id,
+                    'pedido_id': exclusao.pedido_id,
+                    'excluido_em': exclusao.excluido_em,
+                }
+                for exclusao in exclusoes
+            ],
+            'cursor': cursor,
+            'tem_mais': tem_mais,
+        })
+    
     @action(detail=False, methods=['get'], url_path='referencia/(?P<external_reference>[^/.]+)')
     def buscar_por_referencia(self, request, external_reference=None):
         """Buscar pedido por external_reference"""
@@ -80,28 +286,34 @@ class PedidoViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def atualizar_status(self, request, pk=None):
-        """Atualizar status do pedido"""
+        """
+        Atualizar status do pedido
+        O pedido é relido com SELECT ... FOR UPDATE e só os campos enviados são
+        gravados: mudanças do webhook/conciliação no meio do caminho não são
+        sobrescritas e os efeitos de estoque usam o estado travado
+        """
+        from django.db import transaction
+        
         pedido = self.get_object()
         serializer = AtualizarStatusSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        dados = serializer.validated_data
         
-        # Atualizar campos
-        if 'status_pagamento' in serializer.validated_data:
-            pedido.status_pagamento = serializer.validated_data['status_pagamento']
-        
-        if 'payment_id' in serializer.validated_data:
-            pedido.payment_id = serializer.validated_data['payment_id']
-        
-        if 'preference_id' in serializer.validated_data:
-            pedido.preference_id = serializer.validated_data['preference_id']
-        
-        if 'merchant_order_id' in serializer.validated_data:
-            pedido.merchant_order_id = serializer.validated_data['merchant_order_id']
+        with transaction.atomic():
+            pedido = Pedido.objects.select_for_update().get(pk=pedido.pk)
+            status_anterior = pedido.status_pagamento
             
-        if 'observacoes' in serializer.validated_data:
-            pedido.observacoes = serializer.validated_data['observacoes']
-        
-        pedido.save()
+            # Atualizar campos
+            campos = [
+                campo for campo in ('status_pagamento', 'payment_id', 'preference_id', 'merchant_order_id', 'observacoes')
+                if campo in dados
+            ]
+            for campo in campos:
+                setattr(pedido, campo, dados[campo])
+            pedido.save(update_fields=campos + ['data_atualizacao'])
+            
+            # Reservas do checkout: viram venda na aprovação, são liberadas na recusa
+            pedido.aplicar_efeitos_status(status_anterior, usuario='api_atualizar_status', origem='atualizar_status')
         
         output_serializer = PedidoSerializer(pedido)
         return Response(output_serializer.data)
@@ -147,7 +359,18 @@ class PedidoViewSet(viewsets.ModelViewSet):
 @require_http_methods(["POST"])
 @staff_member_required
 def consultar_mp_admin(request):
-    """Endpoint para consultar status MP via admin interface"""
+    """
+    Endpoint para consultar status MP via admin interface
+    
+    Servido do PagamentoSnapshot quando o pagamento já está em status final ou
+    foi consultado há menos de MERCADOPAGO_SNAPSHOT_TTL segundos; só então chama
+    a API. Snapshot em aberto (pending/in_process) só é exibido, nunca gravado
+    no pedido: ele pode ser mais velho que a aprovação que chegou pelo webhook.
+    Body: {"payment_id": "...", "forcar": false}
+    """
+    from .mercadopago import ErroMercadoPago, consultar_pagamento, registrar_pagamento, token_configurado
+    from .models import PagamentoSnapshot
+    
     try:
         data = json.loads(request.body)
         payment_id = data.get('payment_id')
@@ -167,72 +390,60 @@ def consultar_mp_admin(request):
                 'error': f'Pedido com payment_id {payment_id} não encontrado'
             })
         
-        # Token do Mercado Pago
-        mp_token = getattr(settings, 'MERCADOPAGO_ACCESS_TOKEN', os.environ.get('MERCADOPAGO_ACCESS_TOKEN'))
-        
-        if not mp_token:
+        if not token_configurado():
             return JsonResponse({
                 'success': False,
                 'error': 'Token do Mercado Pago não configurado'
             })
         
-        # Consultar API do Mercado Pago
-        response = requests.get(
-            f'https://api.mercadopago.com/v1/payments/{payment_id}',
-            headers={'Authorization': f'Bearer {mp_token}'},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            mp_data = response.json()
-            novo_status = mp_data.get('status', pedido.status_pagamento)
-            status_detail = mp_data.get('status_detail', '')
-            
-            # Atualizar status se mudou
-            status_mudou = False
-            if novo_status != pedido.status_pagamento:
-                pedido.status_pagamento = novo_status
-                pedido.save()
-                status_mudou = True
-            
-            # Mapear status para display
-            status_display_map = {
-                'pending': 'Pendente',
-                'approved': 'Aprovado',
-                'in_process': 'Em processamento',
-                'rejected': 'Rejeitado',
-                'cancelled': 'Cancelado',
-                'refunded': 'Estornado',
-            }
-            
-            return JsonResponse({
-                'success': True,
-                'pedido_id': pedido.id,
-                'payment_id': payment_id,
-                'status_anterior': pedido.status_pagamento if not status_mudou else '',
-                'novo_status': novo_status,
-                'status_display': status_display_map.get(novo_status, novo_status),
-                'status_detail': status_detail,
-                'status_mudou': status_mudou,
-                'detalhes': {
-                    'transaction_amount': mp_data.get('transaction_amount'),
-                    'payment_method_id': mp_data.get('payment_method_id'),
-                    'date_created': mp_data.get('date_created'),
-                    'date_approved': mp_data.get('date_approved'),
-                }
-            })
+        # Snapshot válido ou consulta à API do Mercado Pago
+        mp_data, consultado_em, do_cache = consultar_pagamento(payment_id, forcar=bool(data.get('forcar')))
         
-        elif response.status_code == 404:
+        if mp_data is None:
             return JsonResponse({
                 'success': False,
                 'error': f'Payment {payment_id} não encontrado no Mercado Pago'
             })
         
-        else:
-            return JsonResponse({
-                'success': False,
-                'error': f'Erro na API do MP: HTTP {response.status_code}'
-            })
+        # Atualizar status (e estoque reservado) se mudou: dados novos da API ou status final
+        status_anterior = pedido.status_pagamento
+        status_mudou = False
+        novo_status = status_anterior
+        if not do_cache or mp_data.get('status') in PagamentoSnapshot.STATUS_FINAIS:
+            atualizado, campos, _, _ = registrar_pagamento(
+                mp_data, usuario=request.user.username, origem='consultar_mp_admin', gravar_snapshot=False
+            )
+            status_mudou = 'status_pagamento' in campos
+            novo_status = atualizado.status_pagamento if atualizado is not None else mp_data.get('status', status_anterior)
+        
+        # Mapear status para display
+        status_display_map = {
+            'pending': 'Pendente',
+            'approved': 'Aprovado',
+            'in_process': 'Em processamento',
+            'rejected': 'Rejeitado',
+            'cancelled': 'Cancelado',
+            'refunded': 'Estornado',
+        }
+        
+        return JsonResponse({
+            'success': True,
+            'pedido_id': pedido.id,
+            'payment_id': payment_id,
+            'status_anterior': status_anterior if status_mudou else '',
+            'novo_status': novo_status,
+            'status_display': status_display_map.get(novo_status, novo_status),
+            'status_detail': mp_data.get('status_detail', ''),
+            'status_mudou': status_mudou,
+            'cache': do_cache,
+            'consultado_em': consultado_em.isoformat(),
+            'detalhes': {
+                'transaction_amount': mp_data.get('transaction_amount'),
+                'payment_method_id': mp_data.get('payment_method_id'),
+                'date_created': mp_data.get('date_created'),
+                'date_approved': mp_data.get('date_approved'),
+            }
+        })
             
     except json.JSONDecodeError:
         return JsonResponse({
@@ -240,16 +451,10 @@ def consultar_mp_admin(request):
             'error': 'JSON inválido na requisição'
         })
     
-    except requests.exceptions.Timeout:
+    except ErroMercadoPago as e:
         return JsonResponse({
             'success': False,
-            'error': 'Timeout na consulta ao Mercado Pago'
-        })
-    
-    except requests.exceptions.RequestException as e:
-        return JsonResponse({
-            'success': False,
-            'error': f'Erro de conexão: {str(e)}'
+            'error': str(e)
         })
     
     except Exception as e:
@@ -898,7 +1103,12 @@ def execute_command_ajax(request):
         'migrar_produtos',
         'gerar_products_json',
         'associar_pedidos_legacy',
-        'criar_token_api'
+        'criar_token_api',
+        'liberar_reservas_expiradas',
+        'normalizar_nomes_compradores',
+        'limpar_chaves_idempotencia',
+        'processar_notificacoes_mp',
+        'conciliar_periodo'
     ]
     
     if command not in allowed_commands:
@@ -968,31 +1178,48 @@ def validar_estoque_view(request):
         }, status=400)
     
     try:
-        from .models import ProdutoTamanho
+        product_size_id = int(product_size_id)
+    except ValueError:
+        return JsonResponse({
+            'error': 'product_size_id deve ser numérico'
+        }, status=400)
+    
+    try:
+        from .models import ReservaEstoque
+        from . import cache_estoque
+        
+        # Leitura via cache do worker (invalidado pela VersaoEstoque)
+        produto_tamanho = cache_estoque.obter_tamanhos([product_size_id]).get(product_size_id)
         
-        produto_tamanho = ProdutoTamanho.objects.select_related('produto').get(
-            id=product_size_id
+        if produto_tamanho is None:
+            return JsonResponse({
+                'error': 'Produto/tamanho não encontrado'
+            }, status=404)
+        
+        # Reservas de checkouts em andamento contam contra o estoque
+        estoque_reservado = ReservaEstoque.quantidades_reservadas([product_size_id]).get(product_size_id, 0)
+        estoque_livre = max(0, produto_tamanho['estoque'] - estoque_reservado)
+        esta_disponivel = (
+            produto_tamanho['disponivel'] and produto_tamanho['estoque'] > 0 and produto_tamanho['produto__ativo']
         )
+        pode_comprar = esta_disponivel and estoque_livre > 0
         
         return JsonResponse({
-            'product_size_id': produto_tamanho.id,
+            'product_size_id': product_size_id,
             'produto': {
-                'id': produto_tamanho.produto.id,
-                'nome': produto_tamanho.produto.nome,
-                'preco': float(produto_tamanho.produto.preco),
-                'json_key': produto_tamanho.produto.json_key
+                'id': produto_tamanho['produto_id'],
+                'nome': produto_tamanho['produto__nome'],
+                'preco': float(produto_tamanho['produto__preco']),
+                'json_key': produto_tamanho['produto__json_key']
             },
-            'tamanho': produto_tamanho.tamanho,
-            'estoque': produto_tamanho.estoque,
-            'disponivel': produto_tamanho.disponivel,
-            'pode_comprar': produto_tamanho.esta_disponivel,
-            'status': 'disponivel' if produto_tamanho.esta_disponivel else 'indisponivel'
+            'tamanho': produto_tamanho['tamanho'],
+            'estoque': estoque_livre,
+            'estoque_fisico': produto_tamanho['estoque'],
+            'estoque_reservado': estoque_reservado,
+            'disponivel': produto_tamanho['disponivel'],
+            'pode_comprar': pode_comprar,
+            'status': 'disponivel' if pode_comprar else 'indisponivel'
         })
-        
-    except ProdutoTamanho.DoesNotExist:
-        return JsonResponse({
-            'error': 'Produto/tamanho não encontrado'
-        }, status=404)
     
     except Exception as e:
         return JsonResponse({
@@ -1005,14 +1232,21 @@ def estoque_multiplo_view(request):
     """
     Endpoint para validar estoque de múltiplos produtos
     POST /api/estoque-multiplo/
+    POST /api/estoque-multiplo/?fields=product_size_id,pode_comprar
     Body: {"items": [{"product_size_id": 123, "quantidade": 2}, ...]}
+    
+    Custo fixo (versão do cache + reservas; o mapa de estoque só é recarregado
+    após alguma mutação), independente do tamanho do carrinho. Ids repetidos têm as quantidades somadas. `fields` limita as chaves
+    de cada item para quem só precisa saber se pode comprar
     """
     if request.method != 'POST':
         return JsonResponse({'error': 'Método não permitido'}, status=405)
     
     try:
         import json
-        from .models import ProdutoTamanho
+        from decimal import Decimal
+        from .models import ReservaEstoque
+        from . import cache_estoque
         
         data = json.loads(request.body)
         items = data.get('items', [])
@@ -1029,46 +1263,76 @@ def estoque_multiplo_view(request):
             'erros': []
         }
         
+        # Somar quantidades de ids repetidos, preservando a ordem do carrinho
+        solicitados = {}
         for item in items:
             product_size_id = item.get('product_size_id')
-            quantidade = item.get('quantidade', 1)
             
             if not product_size_id:
                 resultado['erros'].append('product_size_id é obrigatório em todos os items')
                 continue
             
             try:
-                produto_tamanho = ProdutoTamanho.objects.select_related('produto').get(
-                    id=product_size_id
-                )
-                
-                # Validar estoque
-                estoque_suficiente = produto_tamanho.estoque >= quantidade
-                pode_comprar = produto_tamanho.disponivel and estoque_suficiente
-                
-                item_resultado = {
-                    'product_size_id': produto_tamanho.id,
-                    'produto_nome': produto_tamanho.produto.nome,
-                    'tamanho': produto_tamanho.tamanho,
-                    'quantidade_solicitada': quantidade,
-                    'estoque_disponivel': produto_tamanho.estoque,
-                    'preco_unitario': float(produto_tamanho.produto.preco),
-                    'subtotal': float(produto_tamanho.produto.preco * quantidade),
-                    'pode_comprar': pode_comprar,
-                    'status': 'ok' if pode_comprar else 'sem_estoque'
-                }
-                
-                if pode_comprar:
-                    resultado['total_valor'] += item_resultado['subtotal']
-                else:
-                    resultado['pode_processar'] = False
-                    item_resultado['erro'] = f'Estoque insuficiente. Disponível: {produto_tamanho.estoque}, Solicitado: {quantidade}'
-                
-                resultado['items'].append(item_resultado)
-                
-            except ProdutoTamanho.DoesNotExist:
+                product_size_id = int(product_size_id)
+                quantidade = int(item.get('quantidade', 1))
+            except (TypeError, ValueError):
+                resultado['erros'].append(f'Item inválido: {item}')
+                resultado['pode_processar'] = False
+                continue
+            
+            solicitados[product_size_id] = solicitados.get(product_size_id, 0) + quantidade
+        
+        # Leitura via cache do worker (invalidado pela VersaoEstoque)
+        tamanhos = cache_estoque.obter_tamanhos(solicitados.keys())
+        
+        # Reservas de checkouts em andamento contam contra o estoque
+        reservado = ReservaEstoque.quantidades_reservadas(tamanhos.keys()) if tamanhos else {}
+        
+        total_valor = Decimal('0')
+        for product_size_id, quantidade in solicitados.items():
+            tamanho = tamanhos.get(product_size_id)
+            
+            if tamanho is None:
                 resultado['erros'].append(f'Produto com ID {product_size_id} não encontrado')
                 resultado['pode_processar'] = False
+                continue
+            
+            # Validar estoque
+            estoque_livre = max(0, tamanho['estoque'] - reservado.get(product_size_id, 0))
+            estoque_suficiente = estoque_livre >= quantidade
+            pode_comprar = tamanho['disponivel'] and estoque_suficiente
+            subtotal = tamanho['produto__preco'] * quantidade
+            
+            item_resultado = {
+                'product_size_id': product_size_id,
+                'produto_nome': tamanho['produto__nome'],
+                'tamanho': tamanho['tamanho'],
+                'quantidade_solicitada': quantidade,
+                'estoque_disponivel': estoque_livre,
+                'preco_unitario': float(tamanho['produto__preco']),
+                'subtotal': float(subtotal),
+                'pode_comprar': pode_comprar,
+                'status': 'ok' if pode_comprar else 'sem_estoque'
+            }
+            
+            if pode_comprar:
+                total_valor += subtotal
+            else:
+                resultado['pode_processar'] = False
+                item_resultado['erro'] = f'Estoque insuficiente. Disponível: {estoque_livre}, Solicitado: {quantidade}'
+            
+            resultado['items'].append(item_resultado)
+        
+        resultado['total_valor'] = float(total_valor)
+        
+        # Resposta enxuta: manter só os campos pedidos (e o erro, quando houver)
+        fields = request.GET.get('fields')
+        if fields:
+            campos = {campo.strip() for campo in fields.split(',') if campo.strip()} | {'erro'}
+            resultado['items'] = [
+                {chave: valor for chave, valor in item.items() if chave in campos}
+                for item in resultado['items']
+            ]
         
         return JsonResponse(resultado)
         
@@ -1157,37 +1421,82 @@ def gerar_products_json_view(request):
         output_buffer.close()
 
 
-@csrf_exempt
+@require_http_methods(["GET", "HEAD"])
+def catalogo_view(request):
+    """
+    Catálogo de produtos (mesma estrutura do products.json) direto do banco
+    GET /api/catalogo/
+    
+    O JSON é montado uma vez por versão do estoque e servido da memória com
+    ETag forte (304 Not Modified com If-None-Match) e variantes gzip/brotli
+    pré-comprimidas, para o server.js e os navegadores consultarem com frequência
+    """
+    from .catalogo import catalogo_serializado
+    
+    catalogo = catalogo_serializado()
+    encoding = _escolher_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), catalogo.variantes)
+    etag = catalogo.etag(encoding)
+    
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    etags_cliente = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',') if tag.strip()}
+    
+    if '*' in etags_cliente or etags_cliente & catalogo.etags():
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(catalogo.variantes[encoding], content_type='application/json; charset=utf-8')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _escolher_encoding(accept_encoding, variantes):
+    """Escolhe br > gzip > identity conforme o Accept-Encoding do cliente"""
+    aceitos = set()
+    for parte in accept_encoding.split(','):
+        nome, _, parametros = parte.strip().partition(';')
+        qualidade = parametros.strip().removeprefix('q=')
+        try:
+            if parametros and float(qualidade) <= 0:
+                continue
+        except ValueError:
+            pass
+        aceitos.add(nome.strip().lower())
+    
+    for encoding in ('br', 'gzip'):
+        if encoding in variantes and (encoding in aceitos or '*' in aceitos):
+            return encoding
+    return 'identity'
+
+
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
 def decrementar_estoque_view(request):
     """
     Endpoint para decrementar estoque imediatamente (pagamento presencial)
     POST /api/decrementar-estoque/
+    Header: Authorization: Token <token da API>
     Body: {"items": [{"product_size_id": 1, "quantidade": 2}, ...], "pedido_id": 123}
-    """
-    if request.method != 'POST':
-        return JsonResponse({'error': 'Método não permitido'}, status=405)
-    
-    # Verificar autenticação por token
-    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-    if not auth_header.startswith('Token '):
-        return JsonResponse({'error': 'Token de autorização obrigatório'}, status=401)
     
+    Todos os itens são reservados juntos (ProdutoTamanho.decrementar_estoque_lote):
+    número fixo de queries por requisição, independente do tamanho do carrinho.
+    Retorna 409 com o resultado de cada item se algum não tiver estoque
+    """
     try:
-        import json
-        from django.db import transaction
         from .models import ProdutoTamanho, Pedido
         
-        data = json.loads(request.body)
+        data = request.data if isinstance(request.data, dict) else {}
         items = data.get('items', [])
         pedido_id = data.get('pedido_id')  # Opcional
         
         # Buscar pedido se fornecido
         pedido_obj = None
         if pedido_id:
-            try:
-                pedido_obj = Pedido.objects.get(id=pedido_id)
-            except Pedido.DoesNotExist:
-                pass
+            pedido_obj = Pedido.objects.filter(id=pedido_id).first()
         
         if not items:
             return JsonResponse({
@@ -1200,73 +1509,65 @@ def decrementar_estoque_view(request):
             'erros': []
         }
         
-        with transaction.atomic():
-            for item in items:
-                product_size_id = item.get('product_size_id')
-                quantidade = item.get('quantidade', 1)
-                
-                if not product_size_id:
-                    resultado['erros'].append('product_size_id é obrigatório em todos os items')
-                    continue
-                
-                try:
-                    produto_tamanho = ProdutoTamanho.objects.select_related('produto').get(
-                        id=product_size_id
-                    )
-                    
-                    # Verificar se há estoque suficiente
-                    if produto_tamanho.estoque < quantidade:
-                        resultado['success'] = False
-                        resultado['erros'].append(
-                            f'{produto_tamanho}: Estoque insuficiente (disponível: {produto_tamanho.estoque}, solicitado: {quantidade})'
-                        )
-                        continue
-                    
-                    # Decrementar estoque
-                    if produto_tamanho.decrementar_estoque(
-                        quantidade=quantidade,
-                        pedido=pedido_obj,
-                        usuario='api_pagamento_presencial',
-                        observacao=f'Pagamento presencial - Pedido #{pedido_obj.id if pedido_obj else "N/A"}',
-                        origem='decrementar_estoque_view'
-                    ):
-                        resultado['items_processados'].append({
-                            'product_size_id': produto_tamanho.id,
-                            'produto_nome': produto_tamanho.produto.nome,
-                            'tamanho': produto_tamanho.tamanho,
-                            'quantidade_decrementada': quantidade,
-                            'estoque_restante': produto_tamanho.estoque,
-                            'ainda_disponivel': produto_tamanho.disponivel
-                        })
-                    else:
-                        resultado['success'] = False
-                        resultado['erros'].append(f'{produto_tamanho}: Falha ao decrementar estoque')
-                
-                except ProdutoTamanho.DoesNotExist:
-                    resultado['success'] = False
-                    resultado['erros'].append(f'Produto com ID {product_size_id} não encontrado')
-            
-            # Se houve erros, fazer rollback
-            if not resultado['success']:
-                raise Exception('Rollback devido a erros')
-            
-            # Se foi fornecido pedido_id e o decremento foi bem-sucedido, marcar flag
-            if pedido_id and resultado['success']:
-                try:
-                    pedido = Pedido.objects.get(id=pedido_id)
-                    pedido.estoque_decrementado = True
-                    pedido.save()
-                    resultado['pedido_atualizado'] = True
-                except Pedido.DoesNotExist:
-                    resultado['erro_pedido'] = f'Pedido {pedido_id} não encontrado'
+        itens_lote = []
+        for item in items:
+            product_size_id = item.get('product_size_id')
+            
+            if not product_size_id:
+                resultado['erros'].append('product_size_id é obrigatório em todos os items')
+                continue
+            
+            try:
+                itens_lote.append((int(product_size_id), int(item.get('quantidade', 1))))
+            except (TypeError, ValueError):
+                resultado['success'] = False
+                resultado['erros'].append(f'Item inválido: {item}')
+        
+        if not resultado['success'] or not itens_lote:
+            resultado['success'] = False
+            return JsonResponse(resultado, status=400)
+        
+        # Reserva em lote: todas as linhas travadas em ordem de id, tudo ou nada
+        sucesso, resultados_itens = ProdutoTamanho.decrementar_estoque_lote(
+            itens_lote,
+            pedido=pedido_obj,
+            usuario='api_pagamento_presencial',
+            observacao=f'Pagamento presencial - Pedido #{pedido_obj.id if pedido_obj else "N/A"}',
+            origem='decrementar_estoque_view'
+        )
+        
+        if not sucesso:
+            resultado['success'] = False
+            resultado['erros'].extend(r['erro'] for r in resultados_itens if r.get('erro'))
+            resultado['items'] = resultados_itens
+            return JsonResponse(resultado, status=409)
+        
+        if any(r.get('ja_decrementado') for r in resultados_itens):
+            # Nova tentativa (ou outro caminho) já decrementou este pedido: nada a fazer
+            resultado['ja_decrementado'] = True
+            resultado['pedido_atualizado'] = False
+            return JsonResponse(resultado)
+        
+        resultado['items_processados'] = [
+            {
+                'product_size_id': r['product_size_id'],
+                'produto_nome': r['produto_nome'],
+                'tamanho': r['tamanho'],
+                'quantidade_decrementada': r['quantidade_decrementada'],
+                'estoque_restante': r['estoque_restante'],
+                'ainda_disponivel': r['ainda_disponivel']
+            }
+            for r in resultados_itens
+        ]
+        
+        # estoque_decrementado foi marcado na transação do decremento
+        if pedido_obj:
+            resultado['pedido_atualizado'] = True
+        elif pedido_id:
+            resultado['erro_pedido'] = f'Pedido {pedido_id} não encontrado'
         
         return JsonResponse(resultado)
         
-    except json.JSONDecodeError:
-        return JsonResponse({
-            'error': 'JSON inválido'
-        }, status=400)
-    
     except Exception as e:
         return JsonResponse({
             'error': f'Erro interno: {str(e)}',
@@ -1274,6 +1575,54 @@ def decrementar_estoque_view(request):
         }, status=500)
 
 
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def reservar_estoque_view(request):
+    """
+    Endpoint para reservar estoque durante o checkout online (Mercado Pago/PayPal)
+    POST /api/reservar-estoque/
+    Header: Authorization: Token <token da API>
+    Body: {"items": [{"product_size_id": 1, "quantidade": 2}, ...], "pedido_id": 123, "minutos": 15}
+    
+    A reserva conta contra a disponibilidade até o pagamento ser aprovado
+    (vira decremento real), recusado ou até expirar (liberar_reservas_expiradas)
+    """
+    try:
+        data = request.data
+        items = data.get('items', []) if isinstance(data, dict) else []
+        pedido_id = data.get('pedido_id') if isinstance(data, dict) else None
+        
+        if not items:
+            return Response({'error': 'Lista de items é obrigatória'}, status=400)
+        
+        try:
+            itens_reserva = [
+                (int(item['product_size_id']), int(item.get('quantidade', 1)))
+                for item in items
+            ]
+            minutos = int(data.get('minutos') or ReservaEstoque.MINUTOS_PADRAO)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return Response({'error': 'product_size_id e quantidade devem ser numéricos'}, status=400)
+        
+        pedido_obj = None
+        if pedido_id:
+            pedido_obj = Pedido.objects.filter(id=pedido_id).first()
+            if pedido_obj is None:
+                return Response({'error': f'Pedido {pedido_id} não encontrado'}, status=404)
+        
+        sucesso, resultados = ReservaEstoque.reservar(itens_reserva, pedido=pedido_obj, minutos=minutos)
+        
+        return Response({
+            'success': sucesso,
+            'items': resultados,
+            'erros': [r['erro'] for r in resultados if r.get('erro')]
+        }, status=200 if sucesso else 409)
+        
+    except Exception as e:
+        return Response({'error': f'Erro interno: {str(e)}', 'success': False}, status=500)
+
+
 @staff_member_required
 def relatorio_vendas_view(request):
     """
@@ -1282,76 +1631,19 @@ def relatorio_vendas_view(request):
     GET /api/relatorio-vendas/?categoria=camisetas
     GET /api/relatorio-vendas/?categoria=alimentacao
     """
-    from django.db.models import Sum, Count, Q
-    from .models import ItemPedido, Pedido
-    
-    # Definir categorias de produtos
-    PRODUTOS_CAMISETAS = ['camiseta-marrom', 'camiseta-jesus', 'camiseta-oneway-branca', 'camiseta-the-way']
-    PRODUTOS_ALIMENTACAO = ['almoco-sabado', 'jantar-sabado', 'espetinho-carne', 'espetinho-frango', 'espetinho-linguica', 'adicional-mandioca']
+    from .relatorios import resumo_vendas
     
     # Obter categoria do filtro
     categoria = request.GET.get('categoria', 'todos')
     
-    # Buscar pedidos aprovados ou TODOS os presenciais (independente do status)
-    pedidos_validos = Q(status_pagamento='approved') | Q(forma_pagamento='presencial')
-    
-    # Base query com dados dos compradores
-    vendas_query = ItemPedido.objects.filter(
-        pedido__in=Pedido.objects.filter(pedidos_validos)
-    ).select_related('pedido__comprador')
-    
-    # Aplicar filtro de categoria
-    if categoria == 'camisetas':
-        vendas_query = vendas_query.filter(produto__in=PRODUTOS_CAMISETAS)
-    elif categoria == 'alimentacao':
-        vendas_query = vendas_query.filter(produto__in=PRODUTOS_ALIMENTACAO)
-    
-    # Ordenar por produto, tamanho e nome do comprador
-    vendas_detalhadas = vendas_query.order_by('produto', 'tamanho', 'pedido__comprador__nome')
-    
-    # Calcular totais gerais e organizar dados com compradores
-    total_geral = 0
-    total_camisetas = 0
-    total_alimentacao = 0
-    vendas_por_produto = {}
-    
-    for item in vendas_detalhadas:
-        produto_key = item.produto
-        produto_nome = dict(ItemPedido.PRODUTOS_CHOICES).get(produto_key, produto_key)
-        tamanho = item.tamanho
-        quantidade = item.quantidade
-        comprador_nome = item.pedido.comprador.nome
-        
-        # Inicializar estrutura se necessário
-        if produto_nome not in vendas_por_produto:
-            vendas_por_produto[produto_nome] = {
-                'tamanhos': {},
-                'total': 0,
-                'categoria': 'camisetas' if produto_key in PRODUTOS_CAMISETAS else 'alimentacao'
-            }
-        
-        if tamanho not in vendas_por_produto[produto_nome]['tamanhos']:
-            vendas_por_produto[produto_nome]['tamanhos'][tamanho] = {
-                'compradores': [],
-                'total': 0
-            }
-        
-        # Adicionar comprador e quantidade
-        vendas_por_produto[produto_nome]['tamanhos'][tamanho]['compradores'].append({
-            'nome': comprador_nome,
-            'quantidade': quantidade
-        })
-        
-        # Atualizar totais
-        vendas_por_produto[produto_nome]['tamanhos'][tamanho]['total'] += quantidade
-        vendas_por_produto[produto_nome]['total'] += quantidade
-        total_geral += quantidade
-        
-        # Somar por categoria
-        if produto_key in PRODUTOS_CAMISETAS:
-            total_camisetas += quantidade
-        else:
-            total_alimentacao += quantidade
+    # Totais agregados no banco; compradores são carregados sob demanda (relatorio_vendas_compradores_view)
+    totais, vendas_por_produto = resumo_vendas(categoria)
+    total_geral = totais['geral']
+    total_camisetas = totais['camisetas']
+    total_alimentacao = totais['alimentacao']
+    
+    # Só categorias conhecidas vão para os links de exportação
+    categoria_exportacao = categoria if categoria in ('camisetas', 'alimentacao') else 'todos'
     
     # Gerar HTML do relatório
     html_response = f"""
@@ -1612,6 +1904,14 @@ def relatorio_vendas_view(request):
                 border-bottom: 1px solid #dee2e6;
             }}
             
+            summary.tamanho-header {{
+                cursor: pointer;
+            }}
+            
+            .btn-mais {{
+                margin: 10px 0;
+            }}
+            
             /* Responsividade Mobile */
             @media (max-width: 768px) {{
                 body {{
@@ -1789,28 +2089,16 @@ def relatorio_vendas_view(request):
                     </div>
         """
         
-        # Adicionar tamanhos com lista de compradores
+        # Tamanhos com lista de compradores carregada ao expandir
         for tamanho in ['P', 'M', 'G', 'GG', 'UNICO']:
             if tamanho in dados['tamanhos']:
-                tamanho_info = dados['tamanhos'][tamanho]
                 html_response += f"""
-                    <div class="tamanho-header">
-                        Tamanho {tamanho} - Total: {tamanho_info['total']} unidades
-                    </div>
-                    <div class="compradores-lista">
-                """
-                
-                # Adicionar cada comprador
-                for comprador in tamanho_info['compradores']:
-                    html_response += f"""
-                        <div class="comprador-item">
-                            <span class="comprador-nome">• {comprador['nome']}</span>
-                            <span class="comprador-qtd">{comprador['quantidade']} {'unidade' if comprador['quantidade'] == 1 else 'unidades'}</span>
-                        </div>
-                    """
-                
-                html_response += """
-                    </div>
+                    <details class="tamanho-detalhes" data-produto="{dados['produto']}" data-tamanho="{tamanho}">
+                        <summary class="tamanho-header">
+                            Tamanho {tamanho} - Total: {dados['tamanhos'][tamanho]} unidades
+                        </summary>
+                        <div class="compradores-lista"></div>
+                    </details>
                 """
         
         html_response += """
@@ -1822,9 +2110,67 @@ def relatorio_vendas_view(request):
             
             <div class="botoes">
                 <a href="#" onclick="window.print(); return false;" class="btn print">🖨️ Imprimir Relatório</a>
+                <a href="/api/exportar-vendas/?formato=xlsx&categoria=""" + categoria_exportacao + """" class="btn">📥 Exportar Excel</a>
+                <a href="/api/exportar-vendas/?formato=csv&categoria=""" + categoria_exportacao + """" class="btn">📥 Exportar CSV</a>
                 <a href="/api/setup-estoque/" class="btn">⬅️ Voltar ao Dashboard</a>
             </div>
         </div>
+        
+        <script>
+            // Compradores de cada tamanho são buscados só quando o tamanho é expandido
+            async function carregarCompradores(detalhes) {
+                const lista = detalhes.querySelector('.compradores-lista');
+                const pagina = parseInt(detalhes.dataset.pagina || '0') + 1;
+                const params = new URLSearchParams({
+                    produto: detalhes.dataset.produto,
+                    tamanho: detalhes.dataset.tamanho,
+                    pagina: pagina
+                });
+                
+                const botaoAnterior = lista.querySelector('.btn-mais');
+                if (botaoAnterior) botaoAnterior.remove();
+                
+                try {
+                    const response = await fetch('/api/relatorio-vendas/compradores/?' + params);
+                    const result = await response.json();
+                    if (!response.ok) throw new Error(result.error || response.status);
+                    
+                    result.compradores.forEach(function (comprador) {
+                        const item = document.createElement('div');
+                        item.className = 'comprador-item';
+                        const nome = document.createElement('span');
+                        nome.className = 'comprador-nome';
+                        nome.textContent = '• ' + comprador.nome;
+                        const qtd = document.createElement('span');
+                        qtd.className = 'comprador-qtd';
+                        qtd.textContent = comprador.quantidade + (comprador.quantidade === 1 ? ' unidade' : ' unidades');
+                        item.appendChild(nome);
+                        item.appendChild(qtd);
+                        lista.appendChild(item);
+                    });
+                    detalhes.dataset.pagina = pagina;
+                    
+                    if (result.tem_mais) {
+                        const botao = document.createElement('a');
+                        botao.href = '#';
+                        botao.className = 'btn-filtro btn-mais';
+                        botao.textContent = 'Carregar mais compradores';
+                        botao.onclick = function () { carregarCompradores(detalhes); return false; };
+                        lista.appendChild(botao);
+                    }
+                } catch (error) {
+                    alert('❌ Erro ao carregar compradores: ' + error.message);
+                }
+            }
+            
+            document.querySelectorAll('.tamanho-detalhes').forEach(function (detalhes) {
+                detalhes.addEventListener('toggle', function () {
+                    if (detalhes.open && !detalhes.dataset.pagina) {
+                        carregarCompradores(detalhes);
+                    }
+                });
+            });
+        </script>
     </body>
     </html>
     """
@@ -1832,6 +2178,82 @@ def relatorio_vendas_view(request):
     return HttpResponse(html_response, content_type='text/html')
 
 
+@staff_member_required
+def relatorio_vendas_compradores_view(request):
+    """
+    Página de compradores de um produto/tamanho do relatório de vendas
+    GET /api/relatorio-vendas/compradores/?produto=camiseta-marrom&tamanho=M&pagina=1
+    """
+    from .relatorios import compradores_vendidos
+    
+    produto = request.GET.get('produto')
+    tamanho = request.GET.get('tamanho')
+    if not produto or not tamanho:
+        return JsonResponse({'error': 'produto e tamanho são obrigatórios'}, status=400)
+    
+    try:
+        pagina = max(1, int(request.GET.get('pagina', 1)))
+    except ValueError:
+        return JsonResponse({'error': 'pagina deve ser um número'}, status=400)
+    
+    compradores, tem_mais = compradores_vendidos(produto, tamanho, pagina)
+    
+    return JsonResponse({
+        'produto': produto,
+        'tamanho': tamanho,
+        'pagina': pagina,
+        'compradores': compradores,
+        'tem_mais': tem_mais
+    })
+
+
+def _exportacao_streaming(request, tipo):
+    """Resposta em streaming (CSV ou XLSX) para exportar_vendas_view/exportar_compradores_view"""
+    from django.http import StreamingHttpResponse
+    from .exportacao import FORMATOS, filtrar_itens, gerar_csv, gerar_xlsx
+    
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS:
+        return JsonResponse({'error': f'formato deve ser um de: {", ".join(FORMATOS)}'}, status=400)
+    
+    itens, erro = filtrar_itens(request.GET, tipo)
+    if erro:
+        return JsonResponse({'error': erro}, status=400)
+    
+    nome_arquivo = f"{tipo}-oneway-{timezone.localtime().strftime('%Y%m%d-%H%M')}.{formato}"
+    if formato == 'xlsx':
+        response = StreamingHttpResponse(
+            gerar_xlsx(itens, nome_planilha=tipo.title()),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    else:
+        response = StreamingHttpResponse(gerar_csv(itens), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    # Não deixar proxies segurarem a resposta inteira antes de repassar
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@staff_member_required
+def exportar_vendas_view(request):
+    """
+    Exporta os itens vendidos (mesmos critérios do relatório de vendas)
+    GET /api/exportar-vendas/?formato=csv|xlsx
+    Filtros: categoria=camisetas|alimentacao, status=approved,pending, data_inicio=AAAA-MM-DD, data_fim=AAAA-MM-DD
+    """
+    return _exportacao_streaming(request, 'vendas')
+
+
+@staff_member_required
+def exportar_compradores_view(request):
+    """
+    Exporta compradores com seus itens, ordenados por nome
+    GET /api/exportar-compradores/?formato=csv|xlsx&nome=João
+    Aceita os mesmos filtros de exportar_vendas_view
+    """
+    return _exportacao_streaming(request, 'compradores')
+
+
 @staff_member_required
 def consulta_comprador_view(request):
     """
@@ -1839,20 +2261,18 @@ def consulta_comprador_view(request):
     GET /api/consulta-comprador/
     GET /api/consulta-comprador/?nome=João
     """
-    from django.db.models import Q, Count
-    from .models import Comprador, ItemPedido, Pedido
-    import unicodedata
-    
-    def normalizar_texto(texto):
-        """Remove acentos e converte para minúsculas para busca insensível a acentos"""
-        if not texto:
-            return ""
-        # Normalizar caracteres unicode (NFD) e remover acentos
-        texto_normalizado = unicodedata.normalize('NFD', texto.lower().strip())
-        # Remover caracteres de combinação (acentos)
-        return ''.join(c for c in texto_normalizado if unicodedata.category(c) != 'Mn')
+    from django.db.models import Prefetch
+    from django.utils.html import escapejs
+    from .models import Comprador, Pedido
+    from urllib.parse import quote
+    
+    COMPRADORES_POR_PAGINA = 20
     
     nome_busca = request.GET.get('nome', '').strip()
+    try:
+        pagina = max(1, int(request.GET.get('pagina', 1)))
+    except ValueError:
+        pagina = 1
     
     # HTML base
     html_response = f"""
@@ -1902,6 +2322,34 @@ def consulta_comprador_view(request):
                 text-align: center;
             }}
             
+            .exportar-links {{
+                margin-top: 10px;
+                font-size: 0.9em;
+            }}
+            
+            .paginacao {{
+                text-align: center;
+                margin: 20px 0;
+            }}
+            
+            .sugestoes {{
+                max-width: 600px;
+                margin: 10px auto 0;
+                text-align: left;
+            }}
+            
+            .sugestao {{
+                display: block;
+                padding: 8px 15px;
+                border-bottom: 1px solid #e9ecef;
+                color: #2c3e50;
+                text-decoration: none;
+            }}
+            
+            .sugestao:hover {{
+                background: #e9ecef;
+            }}
+            
             .busca-input {{
                 width: 60%;
                 padding: 12px 20px;
@@ -2421,6 +2869,11 @@ def consulta_comprador_view(request):
                            value="{nome_busca}" autofocus>
                     <button type="submit" class="btn-buscar">🔍 Buscar</button>
                 </form>
+                <div id="sugestoes" class="sugestoes"></div>
+                <div class="exportar-links">
+                    <a href="/api/exportar-compradores/?formato=xlsx&nome={quote(nome_busca)}">📥 Exportar Excel</a> |
+                    <a href="/api/exportar-compradores/?formato=csv&nome={quote(nome_busca)}">📥 Exportar CSV</a>
+                </div>
             </div>
             
             <div id="loading" class="loading">
@@ -2432,33 +2885,31 @@ def consulta_comprador_view(request):
     """
     
     if nome_busca:
-        # Normalizar o termo de busca (remover acentos)
-        nome_busca_normalizado = normalizar_texto(nome_busca)
-        
-        # Buscar todos os compradores e filtrar por nome normalizado
-        todos_compradores = Comprador.objects.prefetch_related(
-            'pedido_set__itens'
-        ).all()
-        
-        # Filtrar manualmente para busca sem acentos
-        compradores = []
-        for comprador in todos_compradores:
-            nome_normalizado = normalizar_texto(comprador.nome)
-            if nome_busca_normalizado in nome_normalizado:
-                compradores.append(comprador)
-        
-        # Ordenar por nome
-        compradores = sorted(compradores, key=lambda c: c.nome)
+        # Busca indexada em nome_normalizado; pedidos/itens só dos compradores desta página
+        inicio = (pagina - 1) * COMPRADORES_POR_PAGINA
+        compradores = list(
+            Comprador.buscar_por_nome(nome_busca)
+            .order_by('nome', 'id')
+            .prefetch_related(
+                Prefetch('pedido_set', queryset=Pedido.objects.order_by('id').prefetch_related('itens'))
+            )[inicio:inicio + COMPRADORES_POR_PAGINA + 1]
+        )
+        # Um comprador a mais indica que existe próxima página (sem COUNT)
+        tem_mais = len(compradores) > COMPRADORES_POR_PAGINA
+        compradores = compradores[:COMPRADORES_POR_PAGINA]
         
         if compradores:
             for comprador in compradores:
+                # Nome como argumento JS dentro de onclick: escapejs troca aspas, <, > e & por \uXXXX
+                nome_js = escapejs(comprador.nome)
+                
                 # Contar totais
                 total_itens = 0
                 total_entregue = 0
                 
                 pedidos_com_itens = []
                 for pedido in comprador.pedido_set.all():
-                    if pedido.itens.exists():
+                    if pedido.itens.all():
                         itens_list = []
                         for item in pedido.itens.all():
                             total_itens += 1
@@ -2522,6 +2973,14 @@ def consulta_comprador_view(request):
                     if pedido.forma_pagamento == 'presencial' and pedido.status_pagamento == 'pending':
                         destaque_class = " status-destaque"
                     
+                    # Pedido com mais de um item pendente: entregar tudo numa chamada só
+                    botao_entregar_tudo = ""
+                    if sum(1 for item in itens if not item.entrega_completa) > 1:
+                        botao_entregar_tudo = (
+                            f'<button class="btn-entregar-unitario" '
+                            f'onclick="entregarPedido({pedido.id}, \'{nome_js}\')">📦 Entregar tudo</button>'
+                        )
+                    
                     html_response += f"""
                         <div class="pedido-grupo">
                             <div class="pedido-header">
@@ -2538,6 +2997,7 @@ def consulta_comprador_view(request):
                                         </span>
                                     </div>
                                 </div>
+                                {botao_entregar_tudo}
                             </div>
                     """
                     
@@ -2559,7 +3019,7 @@ def consulta_comprador_view(request):
                                     </div>
                                     <small style="color: #f39c12;">{porcentagem}% entregue</small>
                                 </div>
-                                <button class="btn-entregar-unitario" onclick="entregarUmItem({item.id}, '{comprador.nome}', {item.quantidade_pendente})">
+                                <button class="btn-entregar-unitario" onclick="entregarUmItem({item.id}, '{nome_js}', {item.quantidade_pendente})">
                                     Entregar +1 ({item.quantidade_pendente} restantes)
                                 </button>
                             """
@@ -2567,7 +3027,7 @@ def consulta_comprador_view(request):
                             # Nenhuma entrega ainda
                             status_html = f"""
                                 <span class="status-pendente">📦 Pendente ({item.quantidade}x)</span>
-                                <button class="btn-entregar-unitario" onclick="entregarUmItem({item.id}, '{comprador.nome}', {item.quantidade_pendente})">
+                                <button class="btn-entregar-unitario" onclick="entregarUmItem({item.id}, '{nome_js}', {item.quantidade_pendente})">
                                     Entregar +1
                                 </button>
                             """
@@ -2610,6 +3070,16 @@ def consulta_comprador_view(request):
                     </div>
                 </div>
                 """
+            
+            # Navegação entre páginas
+            if pagina > 1 or tem_mais:
+                html_response += '<div class="paginacao">'
+                if pagina > 1:
+                    html_response += f'<a href="?nome={quote(nome_busca)}&pagina={pagina - 1}" class="voltar-link">⬅️ Anteriores</a>'
+                html_response += f' <span>Página {pagina}</span> '
+                if tem_mais:
+                    html_response += f'<a href="?nome={quote(nome_busca)}&pagina={pagina + 1}" class="voltar-link">Próximos ➡️</a>'
+                html_response += '</div>'
         else:
             html_response += f"""
                 <div class="sem-resultados">
@@ -2677,6 +3147,80 @@ def consulta_comprador_view(request):
                 }}
             }}
             
+            async function entregarPedido(pedidoId, compradorNome) {{
+                if (!confirm(`Entregar todos os itens pendentes do pedido #${{pedidoId}} para ${{compradorNome}}?`)) {{
+                    return;
+                }}
+                
+                const loading = document.getElementById('loading');
+                loading.style.display = 'block';
+                
+                try {{
+                    const response = await fetch('/api/marcar-entrega-lote/', {{
+                        method: 'POST',
+                        headers: {{
+                            'Content-Type': 'application/json',
+                            'X-CSRFToken': getCookie('csrftoken')
+                        }},
+                        body: JSON.stringify({{ pedido_id: pedidoId }})
+                    }});
+                    
+                    const result = await response.json();
+                    
+                    if (result.success) {{
+                        alert(`✅ ${{result.itens.length}} itens entregues!`);
+                        window.location.reload();
+                    }} else {{
+                        alert('❌ Erro: ' + (result.error || (result.erros || []).join('\\n') || 'Erro desconhecido'));
+                    }}
+                }} catch (error) {{
+                    alert('❌ Erro na requisição: ' + error.message);
+                }} finally {{
+                    loading.style.display = 'none';
+                }}
+            }}
+            
+            // Sugestões enquanto digita (GET /api/compradores/busca/), sem recarregar a página
+            const STATUS_ENTREGA = {{
+                completo: '✅', parcial: '🟡', pendente: '⏳', sem_itens: '—'
+            }};
+            let buscaTimer = null;
+            let buscaController = null;
+            
+            document.querySelector('.busca-input').addEventListener('input', function (event) {{
+                const termo = event.target.value.trim();
+                clearTimeout(buscaTimer);
+                buscaTimer = setTimeout(function () {{ buscarSugestoes(termo); }}, 250);
+            }});
+            
+            async function buscarSugestoes(termo) {{
+                const lista = document.getElementById('sugestoes');
+                if (buscaController) buscaController.abort();
+                if (termo.length < 2) {{
+                    lista.replaceChildren();
+                    return;
+                }}
+                buscaController = new AbortController();
+                try {{
+                    const response = await fetch('/api/compradores/busca/?q=' + encodeURIComponent(termo), {{
+                        signal: buscaController.signal
+                    }});
+                    if (!response.ok) return;
+                    const result = await response.json();
+                    lista.replaceChildren();
+                    result.resultados.forEach(function (comprador) {{
+                        const link = document.createElement('a');
+                        link.className = 'sugestao';
+                        link.href = '?nome=' + encodeURIComponent(comprador.nome);
+                        link.textContent = (STATUS_ENTREGA[comprador.status_entrega] || '') + ' ' + comprador.nome +
+                            ' — ' + comprador.telefone + ' (' + comprador.unidades_entregues + '/' + comprador.unidades + ')';
+                        lista.appendChild(link);
+                    }});
+                }} catch (error) {{
+                    if (error.name !== 'AbortError') console.error(error);
+                }}
+            }}
+            
             function getCookie(name) {{
                 let cookieValue = null;
                 if (document.cookie && document.cookie !== '') {{
@@ -2718,41 +3262,31 @@ def marcar_entrega_view(request):
         if not item_id:
             return JsonResponse({'error': 'item_id é obrigatório'}, status=400)
         
+        if not isinstance(quantidade_a_entregar, int) or isinstance(quantidade_a_entregar, bool):
+            return JsonResponse({'error': 'Quantidade deve ser um número inteiro'}, status=400)
+        
         if quantidade_a_entregar <= 0:
             return JsonResponse({'error': 'Quantidade deve ser maior que zero'}, status=400)
         
-        # Buscar o item
+        # Um UPDATE condicional + uma leitura (o limite é garantido pelo banco, não pelo Python)
         from .models import ItemPedido
-        try:
-            item = ItemPedido.objects.get(id=item_id)
-        except ItemPedido.DoesNotExist:
-            return JsonResponse({'error': 'Item não encontrado'}, status=404)
+        sucesso, item = ItemPedido.registrar_entrega(
+            item_id, quantidade_a_entregar, usuario=request.user.username
+        )
         
-        # Verificar se já foi totalmente entregue
-        if item.entrega_completa:
-            return JsonResponse({
-                'error': f'Item já foi totalmente entregue ({item.quantidade_entregue}/{item.quantidade})'
-            }, status=400)
+        if item is None:
+            return JsonResponse({'error': 'Item não encontrado'}, status=404)
         
-        # Verificar se quantidade não excede o pendente
-        if quantidade_a_entregar > item.quantidade_pendente:
+        if not sucesso:
+            # Verificar se já foi totalmente entregue
+            if item.entrega_completa:
+                return JsonResponse({
+                    'error': f'Item já foi totalmente entregue ({item.quantidade_entregue}/{item.quantidade})'
+                }, status=400)
             return JsonResponse({
                 'error': f'Quantidade excede o pendente. Restam {item.quantidade_pendente} unidades'
             }, status=400)
         
-        # Incrementar quantidade entregue
-        quantidade_anterior = item.quantidade_entregue
-        item.quantidade_entregue += quantidade_a_entregar
-        
-        # Registrar usuário e data na primeira entrega ou na entrega final
-        if quantidade_anterior == 0 or item.entrega_completa:
-            item.usuario_entrega = request.user.username
-            if item.entrega_completa:
-                item.data_entrega = timezone.now()
-        
-        # Salvar (o método save() automaticamente marca entregue=True se completo)
-        item.save()
-        
         # Resposta com informações detalhadas
         response_data = {
             'success': True,
@@ -2779,3 +3313,267 @@ def marcar_entrega_view(request):
         return JsonResponse({'error': 'JSON inválido'}, status=400)
     except Exception as e:
         return JsonResponse({'error': f'Erro interno: {str(e)}'}, status=500)
+
+
+@csrf_exempt
+@staff_member_required
+def marcar_entrega_lote_view(request):
+    """
+    Entrega vários itens de uma vez (tudo ou nada)
+    POST /api/marcar-entrega-lote/
+    Body: {"pedido_id": 123}  -> entrega tudo o que está pendente no pedido
+      ou: {"itens": [{"item_id": 1, "quantidade": 2}, {"item_id": 2, "quantidade": 1}]}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        pedido_id = data.get('pedido_id')
+        itens = data.get('itens')
+        
+        if (pedido_id is None) == (itens is None):
+            return JsonResponse({'error': 'Informe pedido_id ou itens (apenas um deles)'}, status=400)
+        
+        entregas = []
+        if itens is not None:
+            if not isinstance(itens, list) or not itens:
+                return JsonResponse({'error': 'itens deve ser uma lista não vazia'}, status=400)
+            for entrada in itens:
+                if not isinstance(entrada, dict):
+                    return JsonResponse({'error': 'Cada item deve ser {"item_id", "quantidade"}'}, status=400)
+                item_id = entrada.get('item_id')
+                quantidade = entrada.get('quantidade', 1)
+                if (not isinstance(item_id, int) or isinstance(item_id, bool)
+                        or not isinstance(quantidade, int) or isinstance(quantidade, bool)):
+                    return JsonResponse({'error': 'item_id e quantidade devem ser números inteiros'}, status=400)
+                entregas.append((item_id, quantidade))
+        elif not isinstance(pedido_id, int) or isinstance(pedido_id, bool):
+            return JsonResponse({'error': 'pedido_id deve ser um número inteiro'}, status=400)
+        
+        from .models import ItemPedido
+        sucesso, resultados = ItemPedido.registrar_entregas_lote(
+            entregas, pedido_id=pedido_id, usuario=request.user.username
+        )
+        
+        if not resultados:
+            # Só acontece no modo pedido_id: pedido inexistente ou sem nada pendente
+            if not Pedido.objects.filter(id=pedido_id).exists():
+                return JsonResponse({'error': 'Pedido não encontrado'}, status=404)
+            return JsonResponse({'error': 'Pedido não tem itens pendentes de entrega'}, status=400)
+        
+        return JsonResponse({
+            'success': sucesso,
+            'itens': resultados,
+            'erros': [r['erro'] for r in resultados if r.get('erro')],
+            'timestamp': timezone.now().strftime('%d/%m/%Y %H:%M:%S')
+        }, status=200 if sucesso else 409)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Erro interno: {str(e)}'}, status=500)
+
+
+SINCRONIZACAO_MAX_EVENTOS = 500
+
+
+@csrf_exempt
+@staff_member_required
+def sincronizar_entregas_view(request):
+    """
+    Recebe as entregas registradas offline por um tablet e aplica cada uma no máximo uma vez
+    POST /api/sincronizar-entregas/
+    Body: {"dispositivo": "balcao-1",
+           "eventos": [{"chave": "uuid-gerado-no-tablet", "item_id": 1, "quantidade": 1,
+                        "registrado_em": "2025-06-14T19:32:05-03:00"}, ...]}
+    
+    Sempre responde 200 com um resultado por evento (na ordem enviada); o tablet
+    pode descartar do buffer todo evento cujo status não seja 'invalido'
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        eventos = data.get('eventos') if isinstance(data, dict) else None
+        if not isinstance(eventos, list) or not eventos:
+            return JsonResponse({'error': 'eventos deve ser uma lista não vazia'}, status=400)
+        if len(eventos) > SINCRONIZACAO_MAX_EVENTOS:
+            return JsonResponse({
+                'error': f'Máximo de {SINCRONIZACAO_MAX_EVENTOS} eventos por sincronização, envie em partes'
+            }, status=400)
+        dispositivo = str(data.get('dispositivo') or '')[:100]
+        
+        from django.utils.dateparse import parse_datetime
+        from .models import EventoEntrega
+        
+        # Eventos malformados não são gravados: o tablet recebe 'invalido' e pode corrigir/descartar
+        validos = []
+        invalidos = {}
+        for indice, evento in enumerate(eventos):
+            if not isinstance(evento, dict):
+                invalidos[indice] = {'chave': None, 'status': 'invalido', 'motivo': 'Evento deve ser um objeto'}
+                continue
+            chave = evento.get('chave')
+            item_id = evento.get('item_id')
+            quantidade = evento.get('quantidade', 1)
+            try:
+                registrado_em = parse_datetime(evento.get('registrado_em') or '')
+            except (TypeError, ValueError):
+                registrado_em = None
+            
+            motivo = None
+            if not isinstance(chave, str) or not chave.strip() or len(chave) > 100:
+                motivo = 'chave deve ser um texto de 1 a 100 caracteres'
+            elif (not isinstance(item_id, int) or isinstance(item_id, bool)
+                    or not isinstance(quantidade, int) or isinstance(quantidade, bool)):
+                motivo = 'item_id e quantidade devem ser números inteiros'
+            elif quantidade <= 0:
+                motivo = f'Quantidade inválida ({quantidade})'
+            elif registrado_em is None:
+                motivo = 'registrado_em deve ser uma data ISO 8601'
+            
+            if motivo:
+                invalidos[indice] = {
+                    'chave': chave if isinstance(chave, str) else None,
+                    'item_id': item_id,
+                    'status': 'invalido',
+                    'motivo': motivo,
+                }
+                continue
+            
+            if timezone.is_naive(registrado_em):
+                registrado_em = timezone.make_aware(registrado_em)
+            validos.append({
+                'chave': chave,
+                'item_id': item_id,
+                'quantidade': quantidade,
+                'registrado_em': registrado_em,
+            })
+        
+        aplicados = iter(EventoEntrega.sincronizar(
+            validos, dispositivo=dispositivo, usuario=request.user.username
+        ) if validos else [])
+        resultados = [
+            invalidos[indice] if indice in invalidos else next(aplicados)
+            for indice in range(len(eventos))
+        ]
+        
+        resumo = {}
+        for resultado in resultados:
+            resumo[resultado['status']] = resumo.get(resultado['status'], 0) + 1
+        resumo['duplicados'] = sum(1 for resultado in resultados if resultado.get('duplicado'))
+        
+        return JsonResponse({
+            'success': True,
+            'resultados': resultados,
+            'resumo': resumo,
+            'timestamp': timezone.now().strftime('%d/%m/%Y %H:%M:%S')
+        })
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Erro interno: {str(e)}'}, status=500)
+
+
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+@idempotente('checkout')
+def checkout_view(request):
+    """
+    Checkout do carrinho em uma chamada e uma transação
+    POST /api/checkout/
+    Body: {"nome": "...", "email": "...", "telefone": "...",
+           "forma_pagamento": "pix",
+           "itens": [{"product_size_id": 1, "quantidade": 2},
+                     {"produto": "almoco-sabado", "tamanho": "UNICO", "quantidade": 1}],
+           "estoque": "reservar",          # validar | reservar | decrementar (padrão pela forma)
+           "minutos": 15, "external_reference": "...", "observacoes": "..."}
+    
+    201 com o pedido (comprador e itens) e o que o pagamento precisa: itens com
+    preço unitário já com desconto PIX, valor total e validade da reserva.
+    409 com o resultado por item se faltar estoque; nada é gravado.
+    Aceita o header Idempotency-Key (reenvios devolvem a resposta gravada).
+    """
+    from .checkout import ErroCheckout, preco_final, realizar_checkout
+    from .serializers import CheckoutSerializer
+    
+    serializer = CheckoutSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    
+    try:
+        pedido, itens, estoque = realizar_checkout(serializer.validated_data)
+    except ErroCheckout as erro:
+        return Response({
+            'success': False,
+            'erro': erro.mensagem,
+            'items': erro.itens,
+            'erros': [r['erro'] for r in erro.itens if r.get('erro')],
+        }, status=erro.status)
+    
+    itens_pagamento = []
+    valor_total = 0
+    for item in itens:
+        preco_unitario = preco_final(item.preco_unitario, pedido.forma_pagamento)
+        valor_total += preco_unitario * item.quantidade
+        itens_pagamento.append({
+            'item_id': item.id,
+            'product_size_id': item.produto_tamanho_id,
+            'title': f'{item.produto_tamanho.produto.nome} - Tamanho {item.tamanho}',
+            'quantity': item.quantidade,
+            'unit_price': float(preco_unitario),
+        })
+    
+    return Response({
+        'success': True,
+        'pedido': PedidoSerializer(pedido).data,
+        'pagamento': {
+            'pedido_id': pedido.id,
+            'external_reference': pedido.external_reference,
+            'forma_pagamento': pedido.forma_pagamento,
+            'itens': itens_pagamento,
+            'valor_total': float(valor_total),
+        },
+        'estoque': estoque,
+    }, status=status.HTTP_201_CREATED)
+
+
+
+@csrf_exempt
+def webhook_mercadopago_view(request):
+    """
+    Notificações de pagamento do Mercado Pago
+    POST /api/webhooks/mercadopago/?data.id=123&type=payment
+    Headers: x-signature (ts=...,v1=...) e x-request-id
+    
+    Confere a assinatura, grava a notificação (id único: reenvios são no-op) e
+    responde 200 na hora; a consulta do pagamento e a mudança de status rodam
+    depois do commit, fora da requisição (ver pedidos/webhooks.py)
+    """
+    from .webhooks import AssinaturaInvalida, registrar_notificacao, segredo_configurado
+    
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método não permitido'}, status=405)
+    
+    if not segredo_configurado():
+        return JsonResponse({'error': 'MERCADOPAGO_WEBHOOK_SECRET não configurado'}, status=503)
+    
+    try:
+        data = json.loads(request.body) if request.body else {}
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'JSON inválido'}, status=400)
+        notificacao, criada = registrar_notificacao(data, request.GET, request.headers)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except AssinaturaInvalida as e:
+        return JsonResponse({'error': str(e)}, status=401)
+    
+    return JsonResponse({
+        'success': True,
+        'notificacao_id': notificacao.notificacao_id,
+        'duplicada': not criada,
+        'status': notificacao.status,
+    })
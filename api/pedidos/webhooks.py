@@ -0,0 +1,240 @@
+"""
+Webhook do Mercado Pago (POST /api/webhooks/mercadopago/)
+
+A requisição só confere a assinatura (x-signature) e grava a notificação em
+NotificacaoMercadoPago, cujo id é único: reenvios do MP viram no-op e a
+resposta 200 sai sem esperar a API do MP. Depois do commit uma thread do
+processo consulta o pagamento (uma chamada por pagamento, mesmo que venham
+várias notificações dele) e aplica status e estoque com registrar_pagamento.
+
+Se o processo morrer no meio, as notificações continuam na fila e são
+retomadas pela próxima notificação ou pelo comando processar_notificacoes_mp.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .mercadopago import ClienteMercadoPago, ErroMercadoPago, registrar_pagamento, token_configurado
+from .models import NotificacaoMercadoPago
+
+logger = logging.getLogger(__name__)
+
+
+TIPOS_PAGAMENTO = ('payment',)
+LOTE = 50
+TENTATIVAS_MAXIMAS = 5
+# Notificação em 'processando' há mais que isso é de um worker que morreu
+PRESA_APOS = timedelta(minutes=5)
+
+
+class AssinaturaInvalida(Exception):
+    pass
+
+
+def segredo_configurado():
+    return getattr(settings, 'MERCADOPAGO_WEBHOOK_SECRET', '')
+
+
+def verificar_assinatura(segredo, assinatura, request_id, data_id):
+    """
+    Confere o header x-signature ("ts=...,v1=...") do Mercado Pago:
+    v1 = HMAC-SHA256(segredo, "id:{data.id};request-id:{x-request-id};ts:{ts};"),
+    omitindo do template as partes que não vieram na notificação
+
+    Levanta AssinaturaInvalida
+    """
+    partes = {}
+    for parte in (assinatura or '').split(','):
+        chave, _, valor = parte.strip().partition('=')
+        partes[chave] = valor
+    ts, v1 = partes.get('ts'), partes.get('v1')
+    if not ts or not v1:
+        raise AssinaturaInvalida('Header x-signature ausente ou incompleto')
+
+    manifesto = ''
+    if data_id:
+        # O MP assina ids alfanuméricos em minúsculas
+        manifesto += f'id:{data_id.lower() if data_id.isalnum() else data_id};'
+    if request_id:
+        manifesto += f'request-id:{request_id};'
+    manifesto += f'ts:{ts};'
+
+    esperado = hmac.new(segredo.encode(), manifesto.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(esperado, v1):
+        raise AssinaturaInvalida('Assinatura não confere')
+
+
+def registrar_notificacao(dados, parametros, headers):
+    """
+    Valida e grava a notificação (um INSERT; id repetido não grava de novo)
+
+    Args:
+        dados: corpo JSON já decodificado ({} se vazio)
+        parametros: query string (data.id, type/topic, id)
+        headers: request.headers
+
+    Retorna (notificacao, criada). Levanta AssinaturaInvalida
+    """
+    dados_recurso = dados.get('data') if isinstance(dados.get('data'), dict) else {}
+    recurso_id = str(parametros.get('data.id') or dados_recurso.get('id') or parametros.get('id') or '')
+    tipo = dados.get('type') or dados.get('topic') or parametros.get('type') or parametros.get('topic') or ''
+    request_id = headers.get('x-request-id', '')
+
+    verificar_assinatura(segredo_configurado(), headers.get('x-signature', ''), request_id,
+                         parametros.get('data.id') or recurso_id)
+
+    notificacao_id = str(dados.get('id') or request_id or f'{tipo}:{recurso_id}')
+    status = 'pendente' if tipo in TIPOS_PAGAMENTO and recurso_id else 'ignorada'
+    try:
+        with transaction.atomic():
+            notificacao = NotificacaoMercadoPago.objects.create(
+                notificacao_id=notificacao_id[:100],
+                tipo=tipo[:50],
+                acao=str(dados.get('action') or '')[:50],
+                recurso_id=recurso_id[:50],
+                status=status,
+                resultado='' if status == 'pendente' else 'Tipo de notificação não tratado',
+                payload=dados,
+            )
+    except IntegrityError:
+        return NotificacaoMercadoPago.objects.get(notificacao_id=notificacao_id[:100]), False
+
+    if status == 'pendente':
+        transaction.on_commit(agendar_processamento)
+    return notificacao, True
+
+
+def _reivindicar(limite):
+    """
+    Marca como 'processando' até `limite` notificações da fila e as devolve
+    SKIP LOCKED: workers simultâneos (threads de outros processos, o comando)
+    pegam lotes diferentes em vez de esperar ou repetir
+    """
+    agora = timezone.now()
+    fila = NotificacaoMercadoPago.objects.filter(
+        Q(status='pendente') | Q(status='processando', atualizada_em__lt=agora - PRESA_APOS)
+    ).order_by('atualizada_em', 'id')
+
+    with transaction.atomic():
+        notificacoes = list(fila.select_for_update(skip_locked=True)[:limite])
+        if notificacoes:
+            NotificacaoMercadoPago.objects.filter(id__in=[n.id for n in notificacoes]).update(
+                status='processando', tentativas=F('tentativas') + 1, atualizada_em=agora
+            )
+    return notificacoes
+
+
+def processar_pendentes(cliente=None, limite=LOTE):
+    """
+    Processa um lote da fila: uma consulta ao MP por pagamento distinto
+
+    Retorna {'processadas', 'ignoradas', 'erros'} (zeros se a fila está vazia)
+    """
+    contagem = {'processadas': 0, 'ignoradas': 0, 'erros': 0}
+    notificacoes = _reivindicar(limite)
+    if not notificacoes:
+        return contagem
+
+    por_pagamento = {}
+    for notificacao in notificacoes:
+        por_pagamento.setdefault(notificacao.recurso_id, []).append(notificacao)
+
+    proprio = cliente is None
+    cliente = cliente or ClienteMercadoPago()
+    try:
+        for payment_id, grupo in por_pagamento.items():
+            status, pedido, resultado = _processar_pagamento(cliente, payment_id)
+            for notificacao in grupo:
+                if status == 'erro' and notificacao.tentativas + 1 < TENTATIVAS_MAXIMAS:
+                    # Volta para a fila; a próxima tentativa vem com a próxima notificação ou o comando
+                    status_final = 'pendente'
+                else:
+                    status_final = status
+                NotificacaoMercadoPago.objects.filter(id=notificacao.id).update(
+                    status=status_final, pedido=pedido, resultado=resultado, atualizada_em=timezone.now()
+                )
+                contagem[{'processada': 'processadas', 'ignorada': 'ignoradas', 'erro': 'erros'}[status]] += 1
+    finally:
+        if proprio:
+            cliente.fechar()
+    return contagem
+
+
+def _processar_pagamento(cliente, payment_id):
+    """Retorna (status da notificação, pedido, resultado)"""
+    try:
+        payment_data = cliente.buscar_pagamento(payment_id)
+    except ErroMercadoPago as e:
+        return 'erro', None, str(e)
+    if payment_data is None:
+        return 'ignorada', None, f'Pagamento {payment_id} não encontrado no Mercado Pago'
+
+    try:
+        pedido, campos, status_anterior, motivo = registrar_pagamento(
+            payment_data, usuario='webhook_mercadopago', origem='webhook_mercadopago'
+        )
+    except Exception as e:
+        logger.exception('Erro ao aplicar pagamento %s', payment_id)
+        return 'erro', None, f'Erro ao aplicar pagamento: {e}'
+
+    if motivo:
+        return 'ignorada', pedido, motivo
+    if 'status_pagamento' in campos:
+        return 'processada', pedido, f'{status_anterior} → {pedido.status_pagamento}'
+    return 'processada', pedido, f'Status mantido ({pedido.status_pagamento})'
+
+
+# ---------------------------------------------------------------------------
+# Worker em thread (um por processo)
+# ---------------------------------------------------------------------------
+
+_worker_lock = threading.Lock()
+_worker = None
+_acordar = False
+
+
+def agendar_processamento():
+    """
+    Garante uma thread drenando a fila neste processo
+    Chamadas enquanto ela roda só pedem mais uma volta, então uma rajada de
+    notificações não cria uma thread por requisição
+    """
+    global _worker, _acordar
+    if not token_configurado():
+        return
+
+    with _worker_lock:
+        _acordar = True
+        if _worker is not None:
+            return
+        _worker = threading.Thread(target=_executar_worker, name='webhook-mercadopago', daemon=True)
+        _worker.start()
+
+
+def _executar_worker():
+    global _worker, _acordar
+    try:
+        while True:
+            with _worker_lock:
+                _acordar = False
+            try:
+                contagem = processar_pendentes()
+            except Exception:
+                logger.exception('Erro ao processar notificações do Mercado Pago')
+                contagem = {'processadas': 0, 'ignoradas': 0, 'erros': 0}
+            # Continua enquanto o lote avançou; lote só de erros espera a próxima notificação
+            avancou = contagem['processadas'] or contagem['ignoradas']
+            with _worker_lock:
+                if not avancou and not _acordar:
+                    _worker = None
+                    return
+    finally:
+        # A thread abriu conexões próprias
+        connections.close_all()
@@ -5,6 +5,7 @@ const fs = require('fs');
 const stripe = require('stripe')(process.env.STRIPE_SECRET_KEY);
 const { MercadoPagoConfig, Preference } = require('mercadopago');
 const axios = require('axios');
+const crypto = require('crypto');
 require('dotenv').config();
 
 // Cache do catálogo de produtos para performance e segurança
@@ -36,6 +37,18 @@ function getProductsCatalog() {
 const DJANGO_API_URL = process.env.DJANGO_API_URL || 'http://localhost:8000/api';
 const DJANGO_API_TOKEN = process.env.DJANGO_API_TOKEN;
 
+// Sufixo da external_reference a partir do Idempotency-Key do navegador (uma chave
+// por tentativa de compra, reaproveitada quando o usuário clica de novo). Mesma chave
+// => mesma referência e mesmo corpo => o Django devolve o pedido já criado.
+// Sem chave válida cai no horário: cada requisição vira um pedido novo.
+function sufixoReferencia(req) {
+  const chave = String(req.get('Idempotency-Key') || '').trim();
+  if (!/^[A-Za-z0-9-]{16,100}$/.test(chave)) {
+    return String(Date.now());
+  }
+  return crypto.createHash('sha256').update(chave).digest('hex').slice(0, 16).toUpperCase();
+}
+
 // Função para validar estoque via Django
 async function validarEstoqueDjango(productSizeId, quantidade = 1) {
   try {
@@ -120,6 +133,96 @@ async function decrementarEstoqueImediato(items, pedidoId = null) {
   }
 }
 
+// Função para reservar estoque durante o checkout online (expira sozinha no Django)
+async function reservarEstoqueCheckout(items, pedidoId) {
+  try {
+    const response = await axios.post(`${DJANGO_API_URL}/reservar-estoque/`, {
+      items: items,
+      pedido_id: pedidoId
+    }, {
+      headers: {
+        'Authorization': `Token ${DJANGO_API_TOKEN}`,
+        'Content-Type': 'application/json'
+      },
+      timeout: 15000
+    });
+    
+    return response.data;
+  } catch (error) {
+    console.error('❌ Erro ao reservar estoque:', error.response?.data || error.message);
+    return {
+      success: false,
+      erros: error.response?.data?.erros || ['Erro de comunicação com sistema de estoque']
+    };
+  }
+}
+
+// Reserva o estoque do pedido antes de abrir o gateway; sem estoque o pedido é cancelado
+// Retorna null se reservou (ou não há product_size_id para reservar), senão o erro para o cliente
+async function reservarOuCancelarPedido(items, pedidoId) {
+  if (items.length === 0) {
+    return null;
+  }
+  
+  const reserva = await reservarEstoqueCheckout(items, pedidoId);
+  if (reserva.success) {
+    console.log('✅ Estoque reservado para checkout:', reserva.items.length, 'itens');
+    return null;
+  }
+  
+  console.error('❌ Falha ao reservar estoque:', reserva.erros);
+  try {
+    await axios.post(`${DJANGO_API_URL}/pedidos/${pedidoId}/atualizar_status/`, {
+      status_pagamento: 'cancelled',
+      observacoes: `Pedido cancelado automaticamente - estoque indisponível para reserva: ${reserva.erros.join(', ')}`
+    }, {
+      headers: { 
+        'Authorization': `Token ${DJANGO_API_TOKEN}`,
+        'Content-Type': 'application/json'
+      }
+    });
+  } catch (cancelError) {
+    console.error('⚠️ Erro ao cancelar pedido (não crítico):', cancelError.message);
+  }
+  
+  return {
+    error: 'Estoque insuficiente para completar reserva',
+    details: reserva.erros
+  };
+}
+
+// Item de reserva de um checkout de produto único (product_size_id vem do products.json)
+function itensReservaProdutoUnico(product, size) {
+  const productSizeId = product.sizes?.[size]?.product_size_id;
+  return productSizeId ? [{ product_size_id: productSizeId, quantidade: 1 }] : [];
+}
+
+// POST /pedidos/ repetido com o mesmo Idempotency-Key (mesma tentativa de compra): o Django
+// devolve a resposta gravada com Idempotent-Replayed. O pedido já tem itens e estoque;
+// relê o estado atual (a resposta gravada é de quando o pedido foi criado)
+async function pedidoDaTentativaAnterior(pedidoResponse) {
+  if (pedidoResponse.headers['idempotent-replayed'] !== 'true') {
+    return null;
+  }
+  const atual = await axios.get(`${DJANGO_API_URL}/pedidos/${pedidoResponse.data.id}/`, {
+    headers: { 'Authorization': `Token ${DJANGO_API_TOKEN}` },
+    timeout: 10000
+  });
+  console.log('🔁 Tentativa repetida: pedido já existente', atual.data.id, atual.data.status_pagamento);
+  return atual.data;
+}
+
+// Pedido repetido que não está mais em aberto (cancelado, recusado, pago) não volta ao gateway
+function erroPedidoEncerrado(pedido) {
+  if (!pedido || ['pending', 'in_process'].includes(pedido.status_pagamento)) {
+    return null;
+  }
+  return {
+    error: `O pedido #${pedido.id} desta tentativa já foi encerrado (${pedido.status_pagamento}). Atualize a página e tente novamente.`,
+    status_pagamento: pedido.status_pagamento
+  };
+}
+
 // Configurar Mercado Pago
 const mercadoPagoClient = new MercadoPagoConfig({ 
   accessToken: process.env.MERCADOPAGO_ACCESS_TOKEN 
@@ -406,7 +509,7 @@ app.post('/create-mp-checkout', async (req, res) => {
       // Se falhar no mapeamento, usar o productId numérico
       produtoIdRef = productId || 'UNKNOWN';
     }
-    const externalReference = `ONEWAY-${produtoIdRef}-${size}-${Date.now()}`;
+    const externalReference = `ONEWAY-${produtoIdRef}-${size}-${sufixoReferencia(req)}`;
     
     // Preparar dados do pedido
     const pedidoData = {
@@ -453,6 +556,7 @@ app.post('/create-mp-checkout', async (req, res) => {
     
     // Criar pedido no Django
     let pedidoCriado;
+    let pedidoRepetido = null;
     try {
       if (!DJANGO_API_TOKEN) {
         throw new Error('Token Django não configurado');
@@ -464,12 +568,15 @@ app.post('/create-mp-checkout', async (req, res) => {
         {
           headers: {
             'Authorization': `Token ${DJANGO_API_TOKEN}`,
+            // Mesma tentativa de compra (ver sufixoReferencia) devolve o mesmo pedido em vez de duplicar
+            'Idempotency-Key': externalReference,
             'Content-Type': 'application/json'
           }
         }
       );
       
       pedidoCriado = pedidoResponse.data;
+      pedidoRepetido = await pedidoDaTentativaAnterior(pedidoResponse);
       console.log('✅ Pedido criado:', pedidoCriado.id);
       
     } catch (error) {
@@ -479,6 +586,17 @@ app.post('/create-mp-checkout', async (req, res) => {
         details: error.response?.data || error.message
       });
     }
+    
+    const erroEncerradoMP = erroPedidoEncerrado(pedidoRepetido);
+    if (erroEncerradoMP) {
+      return res.status(409).json(erroEncerradoMP);
+    }
+    
+    // Reservar estoque enquanto o comprador paga no gateway (na repetição a reserva já existe)
+    const erroReservaMP = pedidoRepetido ? null : await reservarOuCancelarPedido(itensReservaProdutoUnico(product, size), pedidoCriado.id);
+    if (erroReservaMP) {
+      return res.status(400).json(erroReservaMP);
+    }
 
     // ETAPA 2: Criar preferência MP com external_reference
     console.log('🏪 ETAPA 2: Criando preferência Mercado Pago...');
@@ -548,6 +666,8 @@ app.post('/create-mp-checkout', async (req, res) => {
       },
       auto_return: 'approved',
       external_reference: externalReference,
+      // Webhook do Django (POST /api/webhooks/mercadopago/): atualiza o status mesmo se o comprador fechar a página
+      notification_url: process.env.MP_NOTIFICATION_URL || undefined,
       metadata: {
         // Dados do comprador
         comprador_nome: nome || '',
@@ -912,7 +1032,7 @@ app.post('/create-paypal-order', async (req, res) => {
     // ETAPA 1: Criar pedido pendente no Django
     console.log('💾 ETAPA 1: Criando pedido pendente no Django...');
     
-    const externalReference = `PAYPAL-${Date.now()}`;
+    const externalReference = `PAYPAL-${sufixoReferencia(req)}`;
     
     const pedidoData = {
       nome,
@@ -930,6 +1050,7 @@ app.post('/create-paypal-order', async (req, res) => {
     console.log('📤 Dados do pedido:', pedidoData);
     
     let pedidoCriado;
+    let pedidoRepetido = null;
     try {
       const pedidoResponse = await axios.post(
         `${DJANGO_API_URL}/pedidos/`,
@@ -937,12 +1058,15 @@ app.post('/create-paypal-order', async (req, res) => {
         {
           headers: {
             'Authorization': `Token ${DJANGO_API_TOKEN}`,
+            // Mesma tentativa de compra (ver sufixoReferencia) devolve o mesmo pedido em vez de duplicar
+            'Idempotency-Key': externalReference,
             'Content-Type': 'application/json'
           }
         }
       );
       
       pedidoCriado = pedidoResponse.data;
+      pedidoRepetido = await pedidoDaTentativaAnterior(pedidoResponse);
       console.log('✅ Pedido criado no Django:', pedidoCriado.id);
       
     } catch (error) {
@@ -953,6 +1077,17 @@ app.post('/create-paypal-order', async (req, res) => {
       });
     }
     
+    const erroEncerradoPayPal = erroPedidoEncerrado(pedidoRepetido);
+    if (erroEncerradoPayPal) {
+      return res.status(409).json(erroEncerradoPayPal);
+    }
+    
+    // Reservar estoque enquanto o comprador paga no PayPal (na repetição a reserva já existe)
+    const erroReservaPayPal = pedidoRepetido ? null : await reservarOuCancelarPedido(itensReservaProdutoUnico(product, size), pedidoCriado.id);
+    if (erroReservaPayPal) {
+      return res.status(400).json(erroReservaPayPal);
+    }
+    
     // ETAPA 2: Obter token PayPal
     console.log('🔑 ETAPA 2: Obtendo token PayPal...');
     
@@ -1519,8 +1654,7 @@ app.post('/api/cart/checkout', async (req, res) => {
     console.log(`👤 Comprador será criado no Django: ${buyer.name} (${buyer.email})`);
     
     // Gerar external_reference único para o pedido
-    const cartTimestamp = Date.now();
-    const external_reference = `ONEWAY-CART-${cartTimestamp}`;
+    const external_reference = `ONEWAY-CART-${sufixoReferencia(req)}`;
     
     // Função para encontrar chave do produto pelo ID
     function findProductKeyById(productId) {
@@ -1534,6 +1668,7 @@ app.post('/api/cart/checkout', async (req, res) => {
     
     // Criar pedido no Django usando CriarPedidoSerializer
     let pedidoId;
+    let pedidoRepetido = null;
     try {
       const firstProductKey = findProductKeyById(validatedItems[0].productId);
       
@@ -1568,11 +1703,14 @@ app.post('/api/cart/checkout', async (req, res) => {
       const pedidoResponse = await axios.post(`${DJANGO_API_URL}/pedidos/`, pedidoData, {
         headers: { 
           'Authorization': `Token ${DJANGO_API_TOKEN}`,
+          // Mesma tentativa de compra (ver sufixoReferencia) devolve o mesmo pedido em vez de duplicar
+          'Idempotency-Key': external_reference,
           'Content-Type': 'application/json'
         }
       });
       
       pedidoId = pedidoResponse.data.id;
+      pedidoRepetido = await pedidoDaTentativaAnterior(pedidoResponse);
       console.log('✅ PEDIDO CRIADO COM SUCESSO:', {
         pedidoId,
         external_reference,
@@ -1605,60 +1743,69 @@ app.post('/api/cart/checkout', async (req, res) => {
       });
     }
     
-    // Criar ItemPedido para cada item do carrinho
-    console.log('📦 CRIANDO ITENS DO PEDIDO:', { 
-      pedidoId, 
-      itemsCount: validatedItems.length,
-      timestamp: new Date().toISOString()
-    });
+    // Repetição de uma tentativa encerrada: não reabre o pagamento
+    const erroEncerrado = erroPedidoEncerrado(pedidoRepetido);
+    if (erroEncerrado) {
+      return res.status(409).json(erroEncerrado);
+    }
     
-    try {
-      for (const [index, item] of validatedItems.entries()) {
-        const productKey = findProductKeyById(item.productId);
+    // Itens e estoque só na primeira vez: na repetição o pedido já os tem
+    if (!pedidoRepetido) {
+      // Criar ItemPedido para cada item do carrinho
+      console.log('📦 CRIANDO ITENS DO PEDIDO:', { 
+        pedidoId, 
+        itemsCount: validatedItems.length,
+        timestamp: new Date().toISOString()
+      });
+    
+      try {
+        for (const [index, item] of validatedItems.entries()) {
+          const productKey = findProductKeyById(item.productId);
         
-        // Aplicar desconto PIX no preço unitário se necessário
-        const precoUnitarioFinal = paymentMethod === 'pix' ? 
-          parseFloat((item.priceUnit * 0.95).toFixed(2)) : // 5% desconto para PIX
-          item.priceUnit;
+          // Aplicar desconto PIX no preço unitário se necessário
+          const precoUnitarioFinal = paymentMethod === 'pix' ? 
+            parseFloat((item.priceUnit * 0.95).toFixed(2)) : // 5% desconto para PIX
+            item.priceUnit;
         
-        const itemData = {
-          pedido: pedidoId,
-          produto: productKey,
-          tamanho: item.size,
-          quantidade: item.quantity,
-          preco_unitario: parseFloat(precoUnitarioFinal.toFixed(2)) // Garantir 2 casas decimais
-        };
+          const itemData = {
+            pedido: pedidoId,
+            produto: productKey,
+            tamanho: item.size,
+            quantidade: item.quantity,
+            preco_unitario: parseFloat(precoUnitarioFinal.toFixed(2)) // Garantir 2 casas decimais
+          };
         
-        console.log(`📦 CRIANDO ITEM ${index + 1}/${validatedItems.length}:`, {
-          ...itemData,
-          title: item.title,
-          subtotal: `R$ ${(precoUnitarioFinal * item.quantity).toFixed(2)}`
-        });
+          console.log(`📦 CRIANDO ITEM ${index + 1}/${validatedItems.length}:`, {
+            ...itemData,
+            title: item.title,
+            subtotal: `R$ ${(precoUnitarioFinal * item.quantity).toFixed(2)}`
+          });
         
-        await axios.post(`${DJANGO_API_URL}/itempedidos/`, itemData, {
-          headers: { 
-            'Authorization': `Token ${DJANGO_API_TOKEN}`,
-            'Content-Type': 'application/json'
-          }
-        });
+          await axios.post(`${DJANGO_API_URL}/itempedidos/`, itemData, {
+            headers: { 
+              'Authorization': `Token ${DJANGO_API_TOKEN}`,
+              'Content-Type': 'application/json'
+            }
+          });
         
-        console.log(`✅ ITEM ${index + 1} CRIADO: ${item.quantity}x ${item.title} (${item.size}) - R$ ${(precoUnitarioFinal * item.quantity).toFixed(2)}`);
-      }
+          console.log(`✅ ITEM ${index + 1} CRIADO: ${item.quantity}x ${item.title} (${item.size}) - R$ ${(precoUnitarioFinal * item.quantity).toFixed(2)}`);
+        }
       
-      console.log('✅ TODOS ITENS CRIADOS COM SUCESSO:', { 
-        pedidoId, 
-        totalItens: validatedItems.length,
-        timestamp: new Date().toISOString()
-      });
-    } catch (error) {
-      console.error('❌ ERRO AO CRIAR ITENS:', {
-        pedidoId,
-        message: error.message,
-        status: error.response?.status,
-        responseData: error.response?.data,
-        timestamp: new Date().toISOString()
-      });
-      // Pedido já foi criado, mas sem itens - não é crítico para o fluxo de pagamento
+        console.log('✅ TODOS ITENS CRIADOS COM SUCESSO:', { 
+          pedidoId, 
+          totalItens: validatedItems.length,
+          timestamp: new Date().toISOString()
+        });
+      } catch (error) {
+        console.error('❌ ERRO AO CRIAR ITENS:', {
+          pedidoId,
+          message: error.message,
+          status: error.response?.status,
+          responseData: error.response?.data,
+          timestamp: new Date().toISOString()
+        });
+        // Pedido já foi criado, mas sem itens - não é crítico para o fluxo de pagamento
+      }
     }
     
     // Se for pagamento presencial, decrementar estoque e retornar URL especial
@@ -1666,7 +1813,9 @@ app.post('/api/cart/checkout', async (req, res) => {
       console.log('💒 Processando pagamento presencial...');
       
       // NOVO: Decrementar estoque imediatamente para pagamento presencial
-      if (estoqueItems.length > 0) {
+      if (pedidoRepetido) {
+        console.log('🔁 Pedido presencial repetido: estoque já processado na primeira tentativa');
+      } else if (estoqueItems.length > 0) {
         console.log('🔄 Decrementando estoque para pagamento presencial...');
         
         const estoqueResultado = await decrementarEstoqueImediato(estoqueItems, pedidoId);
@@ -1738,6 +1887,12 @@ app.post('/api/cart/checkout', async (req, res) => {
       });
     }
     
+    // Reservar estoque enquanto o comprador paga no gateway
+    const erroReserva = pedidoRepetido ? null : await reservarOuCancelarPedido(estoqueItems, pedidoId);
+    if (erroReserva) {
+      return res.status(400).json(erroReserva);
+    }
+    
     // Determinar provedor de pagamento baseado na configuração
     const formaPagamentoCartao = process.env.FORMA_PAGAMENTO_CARTAO || 'MERCADOPAGO';
     const formaPagamentoPix = process.env.FORMA_PAGAMENTO_PIX || 'MERCADOPAGO';
@@ -1863,6 +2018,8 @@ async function createMercadoPagoPreference(req, res, data) {
       },
       auto_return: 'approved',
       external_reference: external_reference,
+      // Webhook do Django (POST /api/webhooks/mercadopago/): atualiza o status mesmo se o comprador fechar a página
+      notification_url: process.env.MP_NOTIFICATION_URL || undefined,
       metadata: {
         pedido_id: pedido_id,
         comprador_nome: buyer.name,